@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Counts the system calls needed to read a gesture burst with the pooled bus
+handle and compares them with opening the bus for every register access.
+No hardware is needed: the bus is replaced by a fake that counts the calls.
+"""
+
+import time
+import melopero_apds9960 as mp
+from melopero_apds9960.bus import BusPool
+
+DATASETS_PER_GESTURE = 32
+GESTURES = 200
+
+
+class CountingBus():
+    """Fake SMBus that keeps track of the syscalls a real SMBus would do."""
+    counters = {"open": 0, "close": 0, "set_address": 0, "transaction": 0}
+
+    def __init__(self, i2c_bus):
+        self.address = None
+        CountingBus.counters["open"] += 1
+
+    def close(self):
+        CountingBus.counters["close"] += 1
+
+    def _transaction(self, i2c_addr):
+        if self.address != i2c_addr:
+            self.address = i2c_addr
+            CountingBus.counters["set_address"] += 1
+        CountingBus.counters["transaction"] += 1
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self._transaction(i2c_addr)
+        if register == mp.APDS_9960.GESTURE_FIFO_LEVEL_REG_ADDRESS:
+            # GFLVL, then GSTATUS with GVALID set
+            return [DATASETS_PER_GESTURE, 0x01][:length]
+        return [(register + i) & 0xFF for i in range(length)]
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self._transaction(i2c_addr)
+
+    def write_byte(self, i2c_addr, value):
+        self._transaction(i2c_addr)
+
+
+def main():
+    pool = BusPool(factory=CountingBus)
+    start = time.perf_counter()
+    with mp.APDS_9960(bus_pool=pool) as device:
+        for _ in range(GESTURES):
+            device.parse_gesture_in_fifo()
+    elapsed = time.perf_counter() - start
+
+    counters = CountingBus.counters
+    transactions = counters["transaction"] / GESTURES
+    pooled = sum(counters.values()) / GESTURES
+    # Opening the bus for every access costs open + ioctl(I2C_SLAVE) + close
+    # on top of the transaction itself.
+    per_access = transactions * 4
+
+    print(f"Transactions per gesture: {transactions:.1f}")
+    print(f"Syscalls per gesture (pooled handle): {pooled:.2f}")
+    print(f"Syscalls per gesture (open per access): {per_access:.1f}")
+    print(f"Bus opens for {GESTURES} gestures: {counters['open']}")
+    print(f"Driver overhead per gesture: {elapsed / GESTURES * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Compares the per-sample normalization of ColorExample (map over every color)
+with melopero_apds9960.color on batches of samples, pure Python and NumPy.
+The converter computes normalized RGB, HSV, lux and CCT, the map only the
+normalized RGB.
+"""
+
+import random
+import timeit
+from melopero_apds9960 import color
+from melopero_apds9960._compat import _import_numpy
+
+REPEAT = 5
+SATURATION = 35 * 1025
+
+
+def example_loop(samples):
+    return [list(map(lambda val: val / SATURATION * 255, sample)) for sample in samples]
+
+
+def random_samples(length, seed=0):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(length):
+        red, green, blue = (rng.randint(0, 12000) for _ in range(3))
+        samples.append([min(SATURATION, (red + green + blue) // 2 + rng.randint(0, 2000)), red, green, blue])
+    return samples
+
+
+def measure(statement, number):
+    return min(timeit.repeat(statement, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    converter = color.ColorConverter(gain=16, integration_millis=35 * 2.78, saturation=SATURATION)
+    for length in (8, 1024, 100000):
+        samples = random_samples(length)
+        number = max(1, 100000 // length)
+
+        results = [("ColorExample map", measure(lambda: example_loop(samples), number))]
+        results.append(("convert (Python)", measure(lambda: converter.convert(samples, use_numpy=False), number)))
+        numpy = _import_numpy()
+        if numpy is not None:
+            array = numpy.array(samples, dtype=numpy.uint16)
+            results.append(("convert (NumPy)", measure(lambda: converter.convert(array), number)))
+
+        print(f"{length} samples")
+        for name, seconds in results:
+            print(f"    {name:<20} {seconds * 1e6:10.1f} us  ({seconds / length * 1e6:6.3f} us/sample)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Compares the time needed to drain a full gesture FIFO (32 datasets) reading
+one dataset at a time with the bulk read_gesture_fifo, with SMBus block reads
+and with raw i2c transfers. The bus time is modeled (400 kHz clock plus a fixed
+cost per ioctl) so that the benchmark runs without hardware.
+"""
+
+import ctypes
+import time
+from smbus2 import I2cFunc
+import melopero_apds9960 as mp
+from melopero_apds9960.bus import BusPool
+
+FIFO_DATASETS = 32
+DRAINS = 500
+BUS_CLOCK_HZ = 400000
+IOCTL_COST_S = 30e-6
+# start + address + register + repeated start + address
+TRANSACTION_OVERHEAD_BYTES = 3
+
+
+class ModeledBus():
+    """Fake SMBus that returns a full FIFO and accumulates the modeled bus time."""
+
+    def __init__(self, i2c_bus, combined=False):
+        self.bus_time = 0.0
+        self.transactions = 0
+        # Without the I2C functionality flag the driver falls back to SMBus block reads.
+        self.funcs = I2cFunc.I2C if combined else I2cFunc(0)
+
+    def _account(self, length):
+        self.transactions += 1
+        bits = (TRANSACTION_OVERHEAD_BYTES + length) * 9
+        self.bus_time += IOCTL_COST_S + bits / BUS_CLOCK_HZ
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self._account(length)
+        if register == mp.APDS_9960.GESTURE_FIFO_LEVEL_REG_ADDRESS:
+            # GFLVL, then GSTATUS with GVALID set
+            return [FIFO_DATASETS, 0x01][:length]
+        return [i & 0xFF for i in range(length)]
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self._account(len(data))
+
+    def i2c_rdwr(self, write, read):
+        self._account(read.len)
+        ctypes.memset(read.buf, 0x55, read.len)
+
+    def close(self):
+        pass
+
+
+def run(name, combined, drain):
+    buses = []
+
+    def factory(i2c_bus):
+        buses.append(ModeledBus(i2c_bus, combined))
+        return buses[-1]
+
+    with mp.APDS_9960(bus_pool=BusPool(factory)) as device:
+        start = time.perf_counter()
+        for _ in range(DRAINS):
+            drain(device)
+        host_time = (time.perf_counter() - start) / DRAINS
+
+    bus = buses[0]
+    bus_time = bus.bus_time / DRAINS
+    print(f"{name:<28} transactions: {bus.transactions / DRAINS:5.1f}  "
+          f"modeled bus time: {bus_time * 1e3:6.2f} ms  host time: {host_time * 1e6:7.1f} us")
+    return bus_time + host_time
+
+
+def per_dataset(device):
+    for _ in range(device.get_number_of_datasets_in_fifo()):
+        device.get_gesture_data()
+
+
+def bulk(device):
+    device.read_gesture_fifo()
+
+
+def main():
+    print(f"Draining {FIFO_DATASETS} datasets, {DRAINS} times")
+    baseline = run("one dataset per read", True, per_dataset)
+    block = run("read_gesture_fifo (SMBus)", False, bulk)
+    combined = run("read_gesture_fifo (i2c_rdwr)", True, bulk)
+    print(f"Drain latency reduction: SMBus {1 - block / baseline:.0%}, "
+          f"i2c_rdwr {1 - combined / baseline:.0%}")
+
+
+if __name__ == "__main__":
+    main()
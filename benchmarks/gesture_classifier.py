@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Compares the per-dataset loop used by the parsers up to version 0.1.4 with the
+block classifier in melopero_apds9960.gesture (pure Python and NumPy) on
+FIFO-sized bursts and on long recordings.
+"""
+
+import random
+import timeit
+from melopero_apds9960 import gesture
+from melopero_apds9960._compat import _import_numpy
+
+REPEAT = 5
+
+
+def original_loop(datasets, tolerance=12, der_tolerance=6):
+    counts = [0, 0, 0, 0]
+    prev_dataset = datasets[0]
+    for curr_dataset in datasets[1:]:
+        derivatives = [curr_dataset[i] - prev_dataset[i] for i in range(4)]
+        axis_difference = [curr_dataset[i] - curr_dataset[i + 1] for i in range(0, 4, 2)]
+
+        for axis in range(2):
+            up_left_index = axis * 2
+            down_right_index = axis * 2 + 1
+            if (abs(axis_difference[axis]) > tolerance) and (abs(derivatives[up_left_index]) > der_tolerance or abs(
+                    derivatives[down_right_index]) > der_tolerance):
+                if derivatives[up_left_index] >= 0 and derivatives[down_right_index] >= 0:
+                    if curr_dataset[up_left_index] > curr_dataset[down_right_index]:
+                        counts[up_left_index] += 1
+                    else:
+                        counts[down_right_index] += 1
+                elif derivatives[up_left_index] <= 0 and derivatives[down_right_index] <= 0:
+                    if curr_dataset[up_left_index] < curr_dataset[down_right_index]:
+                        counts[up_left_index] += 1
+                    else:
+                        counts[down_right_index] += 1
+        prev_dataset = curr_dataset
+    return counts
+
+
+def random_walk(length, seed=0):
+    rng = random.Random(seed)
+    values = [rng.randint(0, 255) for _ in range(4)]
+    datasets = []
+    for _ in range(length):
+        values = [min(255, max(0, v + rng.randint(-30, 30))) for v in values]
+        datasets.append(list(values))
+    return datasets
+
+
+def measure(statement, number):
+    return min(timeit.repeat(statement, number=number, repeat=REPEAT)) / number
+
+
+def main():
+    for length in (32, 1024, 100000):
+        datasets = random_walk(length)
+        flat = bytes(value for dataset in datasets for value in dataset)
+        expected = original_loop(datasets)
+        number = max(1, 200000 // length)
+
+        results = [("original loop", measure(lambda: original_loop(datasets), number))]
+        assert gesture.count_votes(flat, use_numpy=False) == expected
+        results.append(("classifier (Python)", measure(lambda: gesture.count_votes(flat, use_numpy=False), number)))
+        if _import_numpy() is not None:
+            assert gesture.count_votes(flat, use_numpy=True) == expected
+            results.append(("classifier (NumPy)", measure(lambda: gesture.count_votes(flat, use_numpy=True), number)))
+
+        print(f"{length} datasets")
+        baseline = results[0][1]
+        for name, seconds in results:
+            print(f"    {name:<20} {seconds * 1e6:10.1f} us  ({baseline / seconds:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Sweeps the gesture parser parameters (tolerance, der_tolerance, confidence)
+over labeled recordings (see melopero_apds9960.recording: the label of a
+gesture is the text of the marker recorded before it) and reports accuracy,
+confusion matrix and classification time. The grid is evaluated by a
+process pool, the results are written as JSON.
+
+    python3 benchmarks/gesture_sweep.py gestures.rec --output sweep.json
+    python3 benchmarks/gesture_sweep.py --generate synthetic.rec --count 500
+
+Ranges are given as start:stop:step (stop excluded) or as comma separated values.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from melopero_apds9960 import gesture, recording
+
+_gestures = None
+
+
+def parse_range(text):
+    if ":" in text:
+        start, stop, step = (int(value) for value in text.split(":"))
+        return list(range(start, stop, step))
+    return [int(value) for value in text.split(",")]
+
+
+def predicted_label(result):
+    vertical, horizontal = result
+    if vertical == gesture.NO_GESTURE:
+        return horizontal
+    if horizontal == gesture.NO_GESTURE:
+        return vertical
+    return f"{vertical}+{horizontal}"
+
+
+def load_gestures(paths):
+    gestures = []
+    for path in paths:
+        with recording.Recording(path) as rec:
+            gestures.extend((recorded.label, bytes(recorded.datasets))
+                            for recorded in rec.gestures() if recorded.label is not None)
+    return gestures
+
+
+def _init_worker(paths):
+    global _gestures
+    _gestures = load_gestures(paths)
+
+
+def evaluate(tolerance, der_tolerance, confidences):
+    """Classifies every gesture once per confidence. The votes do not depend
+    on the confidence, so they are counted once per (tolerance, der_tolerance)."""
+    results = {confidence: {"correct": 0, "confusion": {}, "times": [], "label_times": {}}
+               for confidence in confidences}
+    for label, datasets in _gestures:
+        start = time.perf_counter()
+        counts = gesture.count_votes(datasets, tolerance, der_tolerance)
+        count_time = time.perf_counter() - start
+        for confidence in confidences:
+            start = time.perf_counter()
+            predicted = predicted_label(gesture.decide(counts, confidence))
+            elapsed = count_time + time.perf_counter() - start
+
+            result = results[confidence]
+            result["correct"] += predicted == label
+            row = result["confusion"].setdefault(label, {})
+            row[predicted] = row.get(predicted, 0) + 1
+            result["times"].append(elapsed)
+            result["label_times"].setdefault(label, []).append(elapsed)
+
+    summaries = []
+    for confidence, result in results.items():
+        times = sorted(result["times"])
+        summaries.append({
+            "tolerance": tolerance,
+            "der_tolerance": der_tolerance,
+            "confidence": confidence,
+            "accuracy": result["correct"] / len(_gestures),
+            "mean_time_us": statistics.mean(times) * 1e6,
+            "median_time_us": times[len(times) // 2] * 1e6,
+            "p95_time_us": times[int(len(times) * 0.95)] * 1e6,
+            "mean_time_by_label_us": {label: statistics.mean(label_times) * 1e6
+                                      for label, label_times in result["label_times"].items()},
+            "confusion": result["confusion"],
+        })
+    return summaries
+
+
+def sweep(paths, tolerances, der_tolerances, confidences, workers=None):
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(paths,)) as pool:
+        futures = [pool.submit(evaluate, tolerance, der_tolerance, confidences)
+                   for tolerance in tolerances for der_tolerance in der_tolerances]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+# =========================================================================
+#     Synthetic recordings
+# =========================================================================
+
+def _swipe(rng):
+    """The [near, far] photodiode pair values of a swipe going from far to near."""
+    length = rng.randint(15, 40)
+    peak = rng.randint(120, 255)
+    lag = rng.uniform(0.2, 0.5)
+    values = []
+    for i in range(length):
+        phase = i / (length - 1)
+        near = peak * max(0.0, 1 - abs(phase - 0.4) / 0.6)
+        far = peak * max(0.0, 1 - abs(phase - 0.4 - lag) / 0.6) * 0.8
+        values.append((near, far))
+    return values
+
+
+def synthetic_gesture(label, rng, noise=4, baseline=30):
+    values = _swipe(rng)
+    datasets = []
+    for near, far in values:
+        if label == gesture.NO_GESTURE:
+            near = far = (near + far) / 2
+        other = (near + far) / 2
+        pairs = {gesture.UP_GESTURE: (near, far, other, other),
+                 gesture.DOWN_GESTURE: (far, near, other, other),
+                 gesture.LEFT_GESTURE: (other, other, near, far),
+                 gesture.RIGHT_GESTURE: (other, other, far, near),
+                 gesture.NO_GESTURE: (near, far, near, far)}[label]
+        datasets.extend(max(0, min(255, int(baseline + value + rng.gauss(0, noise)))) for value in pairs)
+    return bytes(datasets)
+
+
+def generate(path, count, seed=0):
+    rng = random.Random(seed)
+    labels = [gesture.UP_GESTURE, gesture.DOWN_GESTURE, gesture.LEFT_GESTURE,
+              gesture.RIGHT_GESTURE, gesture.NO_GESTURE]
+    with recording.RecordingWriter(path) as writer:
+        timestamp = 0.0
+        for _ in range(count):
+            label = rng.choice(labels)
+            datasets = synthetic_gesture(label, rng)
+            writer.write_marker(label, timestamp)
+            writer.write_datasets(datasets, timestamp)
+            timestamp += len(datasets) // 4 * 0.0038
+            writer.write_gesture_end(timestamp)
+            timestamp += 0.5
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", nargs="*", help="labeled recordings")
+    parser.add_argument("--tolerance", type=parse_range, default=parse_range("0:41:4"))
+    parser.add_argument("--der-tolerance", type=parse_range, default=parse_range("0:21:2"))
+    parser.add_argument("--confidence", type=parse_range, default=parse_range("0:21:2"))
+    parser.add_argument("--workers", type=int, default=None, help="processes, by default one per core")
+    parser.add_argument("--output", default="gesture_sweep.json", help="the JSON file with the results")
+    parser.add_argument("--generate", metavar="PATH", help="write a synthetic labeled recording and exit")
+    parser.add_argument("--count", type=int, default=500, help="gestures of the synthetic recording")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate(args.generate, args.count)
+        print(f"{args.count} synthetic gestures written to {args.generate}")
+        return
+    if not args.recordings:
+        parser.error("at least one recording is needed (see --generate)")
+
+    gestures = load_gestures(args.recordings)
+    if not gestures:
+        parser.error("the recordings contain no labeled gestures")
+
+    start = time.perf_counter()
+    results = sweep(args.recordings, args.tolerance, args.der_tolerance, args.confidence, args.workers)
+    elapsed = time.perf_counter() - start
+    best = max(results, key=lambda result: (result["accuracy"], -result["mean_time_us"]))
+    default = next((result for result in results if (result["tolerance"], result["der_tolerance"],
+                                                       result["confidence"]) == (12, 6, 6)), None)
+
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    report = {
+        "recordings": [os.path.basename(path) for path in args.recordings],
+        "gestures": len(gestures),
+        "labels": sorted({label for label, _ in gestures}),
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "grid": {"tolerance": args.tolerance, "der_tolerance": args.der_tolerance,
+                 "confidence": args.confidence},
+        "sweep_seconds": elapsed,
+        "best": best,
+        "default": default,
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=1)
+
+    print(f"{len(gestures)} gestures x {len(results)} parameter sets in {elapsed:.1f} s "
+          f"({len(gestures) * len(results) / elapsed:.0f} classifications/s)")
+    for name, result in (("default", default), ("best", best)):
+        if result is None:
+            continue
+        print(f"{name}: tolerance={result['tolerance']} der_tolerance={result['der_tolerance']} "
+              f"confidence={result['confidence']}: accuracy {result['accuracy'] * 100:.1f}%, "
+              f"{result['mean_time_us']:.1f} us per gesture (p95 {result['p95_time_us']:.1f} us)")
+        for label, row in sorted(result["confusion"].items()):
+            print(f"    {label:>10} ({result['mean_time_by_label_us'][label]:.1f} us): "
+                  + ", ".join(f"{predicted} {count}" for predicted, count in sorted(row.items())))
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Measures the import time of the package with python -X importtime and checks
+it against a budget. Each import runs in a new interpreter, once to write the
+bytecode cache and then RUNS times, the median is reported. The script exits
+with status 1 if a budget is exceeded or if a library that should be loaded
+on first use (smbus2, NumPy, concurrent.futures) is imported.
+
+    python3 benchmarks/import_time.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = 7
+
+# (statement, budget in milliseconds)
+IMPORTS = [
+    ("import melopero_apds9960", 3),
+    ("import melopero_apds9960.registers", 5),
+    ("from melopero_apds9960 import APDS_9960", 40),
+]
+
+# Loaded only when they are needed: the first bus access, the first large
+# gesture block, the first executor.
+DEFERRED = ["smbus2", "numpy", "concurrent.futures"]
+
+
+def run(statement):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    # Measure the import as installed, with the bytecode cache.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    code = f"import sys\n{statement}\nprint(','.join(m for m in {DEFERRED!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            env=env, capture_output=True, text=True, check=True)
+    return import_time(result.stderr), [name for name in result.stdout.strip().split(",") if name]
+
+
+def import_time(report):
+    """The cumulative time in seconds of the package modules imported at top level."""
+    total = 0
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith(" melopero_apds9960"):
+            total += int(cumulative)
+    return total / 1e6
+
+
+def main():
+    failed = False
+    for statement, budget in IMPORTS:
+        run(statement)
+        times = []
+        for _ in range(RUNS):
+            seconds, loaded = run(statement)
+            times.append(seconds)
+        median = statistics.median(times) * 1e3
+        status = "ok" if median <= budget else "OVER BUDGET"
+        if loaded:
+            status += f", loaded {', '.join(loaded)}"
+        failed |= median > budget or bool(loaded)
+        print(f"{statement:<45} {median:6.1f} ms (budget {budget} ms) {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
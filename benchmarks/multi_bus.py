@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Scaling of Acquisition with the number of i2c adapters. Every adapter has 4
+simulated sensors; the bus backend sleeps for the duration of each transfer
+at 100 kHz (as a blocking ioctl would), so independent buses can overlap.
+"""
+
+import time
+import melopero_apds9960 as mp
+from melopero_apds9960.acquisition import Acquisition
+from melopero_apds9960.bus import BusBackend
+from melopero_apds9960.simulator import SimulatedAPDS9960
+
+SENSORS_PER_BUS = 4
+ROUNDS = 50
+BUS_CLOCK_HZ = 100000
+REPEAT = 5
+
+
+class TimedBus(BusBackend):
+    """Blocks for the time the transfer takes on the wire."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _wait(self, length):
+        time.sleep((2 + length) * 9 / BUS_CLOCK_HZ)
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self._wait(length)
+        return self.backend.read_i2c_block_data(i2c_addr, register, length)
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self._wait(len(data))
+        self.backend.write_i2c_block_data(i2c_addr, register, data)
+
+    def write_byte(self, i2c_addr, value):
+        self._wait(0)
+        self.backend.write_byte(i2c_addr, value)
+
+
+def run(buses):
+    acquisition = Acquisition(mp.APDS_9960.get_color_data)
+    devices = []
+    for bus in range(buses):
+        for index in range(SENSORS_PER_BUS):
+            sim = SimulatedAPDS9960(proximity=index * 10)
+            device = mp.APDS_9960(bus=TimedBus(sim), i2c_bus=bus + 1)
+            device.reset()
+            device.enable_proximity_engine()
+            device.wake_up()
+            acquisition.add(f"bus{bus + 1}-{index}", device)
+            devices.append(device)
+
+    samples = list(acquisition.stream(ROUNDS))
+    assert all(a.timestamp <= b.timestamp for a, b in zip(samples, samples[1:]))
+    stats = acquisition.get_stats()
+    utilization = ", ".join(f"{bus['utilization'] * 100:.0f}%" for bus in stats["buses"].values())
+    for device in devices:
+        device.close()
+    return stats["samples_per_second"], utilization
+
+
+def main():
+    # Warm up (imports, thread start, caches) so that the 1-bus baseline is not measured cold.
+    run(1)
+    baseline = None
+    for buses in (1, 2, 4):
+        # The run with the median rate of REPEAT runs.
+        rate, utilization = sorted(run(buses) for _ in range(REPEAT))[REPEAT // 2]
+        baseline = baseline or rate
+        print(f"{buses} bus(es), {buses * SENSORS_PER_BUS} sensors: {rate:.0f} samples/s "
+              f"({rate / baseline:.2f}x), utilization {utilization}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Throughput and latency measurements against the simulated APDS-9960, so that
+they can run on any machine (no sensor needed).
+"""
+
+import time
+import melopero_apds9960 as mp
+from melopero_apds9960.simulator import SimulatedAPDS9960
+from melopero_apds9960.sampler import Sampler
+from melopero_apds9960.mux import SensorArray
+from melopero_apds9960.simulator import SimulatedMux
+from melopero_apds9960.interrupt import PollingInterrupt
+from melopero_apds9960.drain import DrainController
+from melopero_apds9960.autorange import AutoRange
+
+GESTURES = 20
+
+
+def swipe_up():
+    approach = [[min(255, 40 + i * 8), min(255, 30 + i * 4), 60, 60] for i in range(25)]
+    leave = [[max(0, 240 - i * 12), max(0, 130 - i * 6), 60 - i * 3, 60 - i * 3] for i in range(20)]
+    return approach + leave
+
+
+def read_throughput():
+    sim = SimulatedAPDS9960(light=(100, 40, 30, 20), proximity=50)
+    device = mp.APDS_9960(bus=sim)
+    device.reset()
+    device.enable_als_engine()
+    device.enable_proximity_engine()
+    device.set_als_integration_time(2.78)
+    device.wake_up()
+
+    start_time = sim.now
+    start = time.perf_counter()
+    readings = 0
+    polls = 0
+    while sim.now - start_time < 1.0:
+        polls += 1
+        if device.read_if_valid() is not None:
+            readings += 1
+    host = time.perf_counter() - start
+    print(f"read_if_valid: {readings} new readings in 1 s of simulated bus time "
+          f"({polls} polls, {device.redundant_reads_avoided} stale values skipped), "
+          f"host time {host / polls * 1e6:.1f} us per poll")
+
+
+def gesture_latency():
+    sim = SimulatedAPDS9960(realtime=True)
+    device = mp.APDS_9960(bus=sim)
+    device.reset()
+    device.configure(enable_gestures_engine=True,
+                     gesture_prox_enter_threshold=30,
+                     gesture_exit_threshold=20,
+                     gesture_fifo_threshold=mp.APDS_9960.FIFO_INT_AFTER_4_DATASETS)
+    device.wake_up()
+
+    latencies = []
+    detected = 0
+    gesture = swipe_up()
+    for _ in range(GESTURES):
+        sim.play_gesture(gesture)
+        start = time.monotonic()
+        result = device.capture_gesture(timeout=1)
+        end = time.monotonic()
+        # Gesture duration: one dataset per gesture cycle, plus the exit persistence.
+        duration = (len(gesture) + 1) * device.get_gesture_dataset_period()
+        latencies.append(end - start - duration)
+        detected += result == [mp.APDS_9960.UP_GESTURE, mp.APDS_9960.NO_GESTURE]
+    latencies.sort()
+    print(f"capture_gesture: {detected}/{GESTURES} detected, latency after gesture end: "
+          f"median {latencies[len(latencies) // 2] * 1e3:.1f} ms, max {latencies[-1] * 1e3:.1f} ms, "
+          f"{sim.transactions / GESTURES:.0f} transactions per gesture")
+
+
+def recognizer_latency():
+    sim = SimulatedAPDS9960(realtime=True)
+    device = mp.APDS_9960(bus=sim)
+    device.reset()
+    device.configure(enable_gestures_engine=True,
+                     gesture_prox_enter_threshold=30,
+                     gesture_exit_threshold=20,
+                     gesture_fifo_threshold=mp.APDS_9960.FIFO_INT_AFTER_1_DATASET)
+    device.wake_up()
+
+    latencies = []
+    detected = 0
+    gesture = swipe_up()
+    duration = (len(gesture) + 1) * device.get_gesture_dataset_period()
+    for _ in range(GESTURES):
+        sim.play_gesture(gesture)
+        start = time.monotonic()
+        for result in device.recognize_gestures(timeout=1):
+            latencies.append(time.monotonic() - start)
+            detected += result == [mp.APDS_9960.UP_GESTURE, mp.APDS_9960.NO_GESTURE]
+            break
+        # let the engine exit before the next gesture
+        while device.is_gesture_engine_running() or device.get_number_of_datasets_in_fifo():
+            device.read_gesture_fifo()
+            time.sleep(duration / 10)
+    latencies.sort()
+    print(f"recognize_gestures: {detected}/{GESTURES} detected, latency after gesture start: "
+          f"median {latencies[len(latencies) // 2] * 1e3:.1f} ms, max {latencies[-1] * 1e3:.1f} ms "
+          f"(the gesture lasts {duration * 1e3:.1f} ms)")
+
+
+def sampler_rate():
+    sim = SimulatedAPDS9960(light=(100, 40, 30, 20), proximity=50, realtime=True)
+    device = mp.APDS_9960(bus=sim)
+    device.reset()
+    device.enable_als_engine()
+    device.enable_proximity_engine()
+    device.set_als_integration_time(27.8)
+    device.wake_up()
+    with Sampler(device) as sampler:
+        time.sleep(1)
+        stats = sampler.get_stats()
+    print(f"Sampler: {stats['sample_rate']:.1f} samples/s (interval {stats['interval'] * 1e3:.1f} ms), "
+          f"{stats['dropped']} dropped")
+
+
+def sensor_array():
+    channels = {channel: SimulatedAPDS9960(proximity=10 * channel) for channel in range(8)}
+    mux = SimulatedMux(channels)
+    with SensorArray(bus=mux) as array:
+        for channel in channels:
+            array.add_sensor(f"sensor{channel}", channel)
+        array.read_all(lambda device: (device.reset(), device.enable_proximity_engine(), device.wake_up()))
+        rounds = 200
+        for _ in range(rounds):
+            array.read_all(mp.APDS_9960.get_proximity_data)
+        stats = array.get_stats()
+    latency = max(sensor["mean_latency"] for sensor in stats["sensors"].values())
+    print(f"SensorArray: 8 sensors, {stats['samples_per_second']:.0f} samples/s, "
+          f"{stats['channel_switches'] / (rounds + 1):.1f} channel switches per round, "
+          f"max mean latency {latency * 1e6:.1f} us")
+
+
+class SlowHostInterrupt(PollingInterrupt):
+    """A host that needs 50 ms to react to every interrupt."""
+
+    def wait(self, timeout=None):
+        result = super().wait(timeout)
+        time.sleep(0.05)
+        return result
+
+
+def slow_host():
+    # A slow swipe: every dataset is repeated 4 times.
+    gesture = [dataset for dataset in swipe_up() for _ in range(4)]
+    for adaptive in (False, True):
+        sim = SimulatedAPDS9960(realtime=True)
+        device = mp.APDS_9960(bus=sim)
+        device.reset()
+        device.configure(enable_gestures_engine=True,
+                         gesture_prox_enter_threshold=30,
+                         gesture_exit_threshold=20,
+                         gesture_fifo_threshold=mp.APDS_9960.FIFO_INT_AFTER_16_DATASETS)
+        device.wake_up()
+        interrupt = SlowHostInterrupt(device)
+        controller = DrainController(device, interrupt).attach() if adaptive else None
+
+        detected = 0
+        for _ in range(GESTURES // 2):
+            sim.play_gesture(gesture)
+            event = device.capture_gesture_event(interrupt, timeout=1)
+            detected += event is not None and event.gesture == mp.APDS_9960.UP_GESTURE
+            time.sleep(0.05)
+        settings = ""
+        if controller is not None:
+            stats = controller.get_stats()
+            settings = (f", settled on threshold {stats['fifo_threshold_datasets']} and wait "
+                        f"{stats['gesture_wait_millis']} ms after {stats['changes']} changes")
+        print(f"slow host{' (DrainController)' if adaptive else ''}: {detected}/{GESTURES // 2} detected, "
+              f"{device.fifo_overflows} FIFO overflows, {device.lost_datasets} datasets lost "
+              f"(simulator: {sim.lost_datasets}){settings}")
+
+
+def auto_ranging():
+    # Clear channel counts per integration cycle at 1x, from a dark room to direct sunlight.
+    levels = [("night", 0.02), ("dim room", 5), ("office", 60), ("sunlight", 900), ("dim room", 5)]
+    light = {"level": 0}
+    sim = SimulatedAPDS9960(light=lambda now: (light["level"], 0.4 * light["level"],
+                                               0.35 * light["level"], 0.25 * light["level"]))
+    device = mp.APDS_9960(bus=sim, register_cache=True)
+    device.reset()
+    device.enable_als_engine()
+    device.set_als_integration_time(200)
+    device.set_als_gain(mp.APDS_9960.ALS_GAIN_64X)
+    device.wake_up()
+    auto = AutoRange(device)
+    for name, level in levels:
+        light["level"] = level
+        fixed = min(65535, int(level * 64 * 71))
+        saturated = auto.saturated
+        changes = len(auto.changes)
+        samples = 0
+        while samples < 10:
+            sim.advance(0.001)
+            reading = auto.read()
+            samples += reading is not None and reading.color is not None
+        stats = auto.get_stats()
+        print(f"AutoRange {name:<9}: {len(auto.changes) - changes} changes, converged in {stats['last_convergence']} "
+              f"samples ({stats['saturated'] - saturated} saturated) on {stats['gain']}x "
+              f"{stats['integration_millis']:.1f} ms, {stats['sample_rate']:.0f} samples/s "
+              f"(fixed 64x 197 ms: 5 samples/s{', saturated' if fixed >= 65535 else ''})")
+
+
+def main():
+    read_throughput()
+    gesture_latency()
+    recognizer_latency()
+    sampler_rate()
+    sensor_array()
+    slow_host()
+    auto_ranging()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,13 +14,13 @@ def main():
 
     device.enable_als_engine()
     device.set_als_integration_time(450)
-    saturation = device.get_saturation()
     device.wake_up()
 
     while True:
         time.sleep(.5)
         color = device.get_color_data()
-        color = map(lambda val : val / saturation * 255, color)
+        # device.saturation is updated by the setters, reading it costs no i2c transaction
+        color = map(lambda val : val / device.saturation * 255, color)
         print(f"Alfa: {next(color)}  Red: {next(color)}  Green: {next(color)}  Blue: {next(color)}")
 
 
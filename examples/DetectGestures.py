@@ -4,7 +4,6 @@
 @author: Leonardo La Rocca
 """
 
-import time
 import melopero_apds9960 as mp
 
 
@@ -14,20 +13,21 @@ def main():
     # reset
     device.reset()
 
-    device.enable_gestures_engine()
-
-    device.set_gesture_prox_enter_threshold(25)
-    device.set_gesture_exit_threshold(20)
-    device.set_gesture_exit_persistence(mp.APDS_9960.EXIT_AFTER_4_GESTURE_END)
+    # All the settings are sent in a few block writes
+    device.configure(enable_gestures_engine=True,
+                     gesture_prox_enter_threshold=25,
+                     gesture_exit_threshold=20,
+                     gesture_exit_persistence=mp.APDS_9960.EXIT_AFTER_4_GESTURE_END)
 
     device.wake_up()
 
     while True:
-        gesture_status = device.get_gesture_status()
-        if gesture_status["Gesture FIFO Data"]:
-            # try to detect and parse a gesture for 300 milliseconds
-            detected_gestures = device.parse_gesture(300)
-            print(detected_gestures)
+        # Sleeps until the gesture engine collects data, then parses the gesture
+        # until the gesture engine exits. The status register is polled at a rate
+        # derived from the gesture wait time: to wait on the INT pin instead use
+        # melopero_apds9960.interrupt.GpioInterrupt (see the README).
+        detected_gestures = device.capture_gesture()
+        print(detected_gestures)
 
 
 if __name__ == "__main__":
@@ -3,133 +3,109 @@
 """
 @author: Leonardo La Rocca
 """
-from smbus2 import SMBus
+from melopero_apds9960.bus import default_pool, SharedBus, SMBUS_BLOCK_MAX, CLOSED_BUS
+from melopero_apds9960.registers import Registers, FIELDS
+from melopero_apds9960.register_cache import RegisterCache, CACHEABLE_REGISTERS, BULK_READ_BLOCKS
+from melopero_apds9960.gesture_buffer import GestureBuffer
+from melopero_apds9960 import gesture
+from melopero_apds9960.interrupt import PollingInterrupt
+from melopero_apds9960.instrumentation import Instrumentation
+from collections import namedtuple
+from contextlib import contextmanager
 import time
 
+# status: dictionary as returned by get_status, color: [clear, red, green, blue]
+# or None if no new color data, proximity: int or None if no new proximity data,
+# saturation, integration_millis and gain: the largest color value, the ALS
+# integration time (milliseconds) and the ALS gain multiplier with the
+# configuration of the device when the data was read.
+Reading = namedtuple("Reading", ["status", "color", "proximity", "saturation", "integration_millis", "gain"])
 
-class APDS_9960():
-    DEFAULT_I2C_ADDRESS = 0x39
-
-    # Register addresses
-    ENABLE_REG_ADDRESS = 0x80
-    CONFIG_1_REG_ADDRESS = 0x8D
-    CONFIG_2_REG_ADDRESS = 0x90
-    CONFIG_3_REG_ADDRESS = 0x9F
-    CONTROL_1_REG_ADDRESS = 0x8F
-    INTERRUPT_PERSISTANCE_REG_ADDRESS = 0x8C
-    STATUS_REG_ADDRESS = 0x93
-
-    # Proximity Registers Addresses
-    PROX_INT_LOW_THR_REG_ADDRESS = 0x89
-    PROX_INT_HIGH_THR_REG_ADDRESS = 0x8B
-    PROX_PULSE_COUNT_REG_ADDRESS = 0x8E
-    PROX_UP_RIGHT_OFFSET_REG_ADDRESS = 0x9D
-    PROX_DOWN_LEFT_OFFSET_REG_ADDRESS = 0x9E
-    PROX_DATA_REG_ADDRESS = 0x9C
-
-    # ALS Register Addresses
-    ALS_ATIME_REG_ADDRESS = 0x81
-    ALS_INT_LOW_THR_LOW_BYTE_REG_ADDRESS = 0x84  # This register provides the low byte of the low interrupt threshold.
-    ALS_INT_LOW_THR_HIGH_BYTE_REG_ADDRESS = 0x85  # This register provides the high byte of the low interrupt threshold.
-    ALS_INT_HIGH_THR_LOW_BYTE_REG_ADDRESS = 0x86  # This register provides the low byte of the high interrupt threshold.
-    ALS_INT_HIGH_THR_HIGH_BYTE_REG_ADDRESS = 0x87  # This register provides the high byte of the high interrupt threshold.
-
-    CLEAR_DATA_LOW_BYTE_REG_ADDRESS = 0x94  # Low Byte of clear channel data.
-    CLEAR_DATA_HIGH_BYTE_REG_ADDRESS = 0x95  # High Byte of clear channel data.
-    RED_DATA_LOW_BYTE_REG_ADDRESS = 0x96  # Low Byte of red channel data.
-    RED_DATA_HIGH_BYTE_REG_ADDRESS = 0x97  # High Byte of red channel data.
-    GREEN_DATA_LOW_BYTE_REG_ADDRESS = 0x98  # Low Byte of green channel data.
-    GREEN_DATA_HIGH_BYTE_REG_ADDRESS = 0x99  # High Byte of green channel data.
-    BLUE_DATA_LOW_BYTE_REG_ADDRESS = 0x9A  # Low Byte of blue channel data.
-    BLUE_DATA_HIGH_BYTE_REG_ADDRESS = 0x9B  # High Byte of blue channel data.
-
-    # Gesture Register Addresses
-    GESTURE_PROX_ENTER_THR_REG_ADDRESS = 0xA0
-    GESTURE_EXIT_THR_REG_ADDRESS = 0xA1
-    GESTURE_CONFIG_1_REG_ADDRESS = 0xA2
-    GESTURE_CONFIG_2_REG_ADDRESS = 0xA3
-    GESTURE_CONFIG_3_REG_ADDRESS = 0xAA
-    GESTURE_CONFIG_4_REG_ADDRESS = 0xAB
-    GESTURE_OFFSET_REG_ADDRESSES = [0xA4, 0xA5, 0xA7, 0xA9]
-    GESTURE_PULSE_COUNT_AND_LEN_REG_ADDRESS = 0xA6
-    GESTURE_FIFO_LEVEL_REG_ADDRESS = 0xAE
-    GESTURE_FIFO_UP_REG_ADDRESS = 0xFC
-    GESTURE_FIFO_DOWN_REG_ADDRESS = 0xFD
-    GESTURE_FIFO_LEFT_REG_ADDRESS = 0xFE
-    GESTURE_FIFO_RIGHT_REG_ADDRESS = 0xFF
-    GESTURE_STATUS_REG_ADDRESS = 0xAF
-
-    # Wait Registers Addresses
-    WAIT_TIME_REG_ADDRESS = 0x83
-
-    # Clear interrupt regs
-    FORCE_INTERRUPT_REG_ADDRESS = 0xE4
-    PROXIMITY_INT_CLEAR_REG_ADDRESS = 0xE5
-    ALS_INT_CLEAR_REG_ADDRESS = 0xE6
-    CLEAR_ALL_NON_GEST_INT_REG_ADDRESS = 0xE7
-
-    # Proximity pulse lengths
-    PULSE_LEN_4_MICROS = 0
-    PULSE_LEN_8_MICROS = 1
-    PULSE_LEN_16_MICROS = 2
-    PULSE_LEN_32_MICROS = 3
-
-    # Led drive levels
-    LED_DRIVE_100_mA = 0
-    LED_DRIVE_50_mA = 1
-    LED_DRIVE_25_mA = 2
-    LED_DRIVE_12_5_mA = 3
-
-    # Led Boost levels
-    LED_BOOST_100 = 0
-    LED_BOOST_150 = 1
-    LED_BOOST_200 = 2
-    LED_BOOST_300 = 3
-
-    # Proximity gain
-    PROXIMITY_GAIN_1X = 0
-    PROXIMITY_GAIN_2X = 1
-    PROXIMITY_GAIN_4X = 2
-    PROXIMITY_GAIN_8X = 3
-
-    # ALS Gain
-    ALS_GAIN_1X = 0
-    ALS_GAIN_4X = 1
-    ALS_GAIN_16X = 2
-    ALS_GAIN_64X = 3
-
-    # Gesture FIFO interrupt levels
-    FIFO_INT_AFTER_1_DATASET = 0
-    FIFO_INT_AFTER_4_DATASETS = 1
-    FIFO_INT_AFTER_8_DATASETS = 2
-    FIFO_INT_AFTER_16_DATASETS = 3
-
-    # Gesture exit persistences
-    EXIT_AFTER_1_GESTURE_END = 0
-    EXIT_AFTER_2_GESTURE_END = 1
-    EXIT_AFTER_4_GESTURE_END = 2
-    EXIT_AFTER_7_GESTURE_END = 3
-
-    # Gesture wait time
-    GESTURE_WAIT_0_MILLIS = 0
-    GESTURE_WAIT_2_8_MILLIS = 1
-    GESTURE_WAIT_5_6_MILLIS = 2
-    GESTURE_WAIT_8_4_MILLIS = 3
-    GESTURE_WAIT_14_MILLIS = 4
-    GESTURE_WAIT_22_4_MILLIS = 5
-    GESTURE_WAIT_30_8_MILLIS = 6
-    GESTURE_WAIT_39_2_MILLIS = 7
+# Values derived from the timing registers, see APDS_9960.get_timing. Times in
+# milliseconds except cycle_time, gesture_dataset_period and fifo_fill_time
+# (seconds, as returned by the methods with the same name). als_gain is the
+# ALS gain multiplier: the color samples depend on it as on the integration time.
+Timing = namedtuple("Timing", ["saturation", "als_integration_millis", "wait_millis", "gesture_wait_millis",
+                               "cycle_time", "gesture_dataset_period", "fifo_fill_time", "als_gain"])
+
+# ENABLE, ATIME, WTIME, CONTROL, CONFIG1, GCONF1 and GCONF2: the registers Timing is derived from.
+TIMING_REGISTERS = (0x80, 0x81, 0x83, 0x8D, 0x8F, 0xA2, 0xA3)
 
-    # Gestures
-    NO_GESTURE = 'no_gesture'
-    UP_GESTURE = 'up'
-    DOWN_GESTURE = 'down'
-    LEFT_GESTURE = 'left'
-    RIGHT_GESTURE = 'right'
 
-    def __init__(self, i2c_address=DEFAULT_I2C_ADDRESS, i2c_bus=1):
+class APDS_9960(Registers):
+    # Gestures
+    NO_GESTURE = gesture.NO_GESTURE
+    UP_GESTURE = gesture.UP_GESTURE
+    DOWN_GESTURE = gesture.DOWN_GESTURE
+    LEFT_GESTURE = gesture.LEFT_GESTURE
+    RIGHT_GESTURE = gesture.RIGHT_GESTURE
+
+    def __init__(self, i2c_address=Registers.DEFAULT_I2C_ADDRESS, i2c_bus=1, bus_pool=None,
+                 register_cache=False, verify_interval=0, bus=None):
+        """The bus is opened once and kept open until close is called. Devices
+        created on the same bus share the same handle.\n
+        :i2c_address: the address of the device.\n
+        :i2c_bus = 1: the number of the i2c bus (/dev/i2c-N).\n
+        :bus_pool = None: the pool that provides the bus handle, by default
+            the module wide pool is used.\n
+        :bus = None: a BusBackend (or SharedBus) to use instead of opening
+            i2c_bus, for example a SimulatedAPDS9960. It is not closed by close.\n
+        :register_cache = False: if True keeps a shadow copy of the configuration
+            registers (see enable_register_cache).\n
+        :verify_interval = 0: see enable_register_cache.
+        """
         self.i2c_address = i2c_address
         self.i2c_bus = i2c_bus
+        if bus is not None:
+            self._bus_pool = None
+            self._bus = bus if isinstance(bus, SharedBus) else SharedBus(bus, i2c_bus)
+        else:
+            self._bus_pool = bus_pool if bus_pool is not None else default_pool
+            self._bus = self._bus_pool.acquire(i2c_bus)
+        self._register_cache = None
+        self._pending_writes = None
+        self._batch_depth = 0
+        self.redundant_reads_avoided = 0
+        # See enable_instrumentation. Checked once per transaction: costs nothing when None.
+        self.instrumentation = None
+        # The FIFO holds 32 datasets, plus the last dataset of the previous read.
+        self._gesture_buffer = GestureBuffer(64)
+        # Gesture FIFO overflows seen while reading the FIFO level and an
+        # estimate of the datasets lost (see get_number_of_datasets_in_fifo).
+        self.fifo_overflows = 0
+        self.lost_datasets = 0
+        # True if the FIFO overflowed while the last gesture was read.
+        self.gesture_overflowed = False
+        # See melopero_apds9960.drain.DrainController.
+        self.drain_controller = None
+        self._last_fifo_check = None
+        self._overflow_pending = False
+        # The last known values of TIMING_REGISTERS and the Timing derived
+        # from them, updated by every write (see get_timing).
+        self._timing_registers = dict()
+        self._timing = None
+        if register_cache:
+            self.enable_register_cache(True, verify_interval)
+
+    def close(self):
+        """Releases the bus handle. The underlying file descriptor is closed
+        when no other device is using the same bus. After close every
+        bus transaction raises RuntimeError."""
+        if self._bus is not CLOSED_BUS and self._bus_pool is not None:
+            self._bus_pool.release(self._bus)
+        self._bus = CLOSED_BUS
+
+    @property
+    def executor(self):
+        """The single thread executor of the device's i2c bus (see
+        SharedBus.executor), shared by all the devices on the bus."""
+        return self._bus.executor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     # =========================================================================
     #     I2C functions
@@ -141,8 +117,15 @@ class APDS_9960():
         :amount = 1: the amount of bytes to read, by default it is 1.\n
         Return value: an int if the amount is 1, a list of ints if the amount is greater than 1.\n
         """
-        with SMBus(self.i2c_bus) as bus:
-            data = bus.read_i2c_block_data(self.i2c_address, register_address, amount)
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+        with self._bus.lock:
+            data = self._bus.handle.read_i2c_block_data(self.i2c_address, register_address, amount)
+        if instrumentation is not None:
+            instrumentation.record_transaction("read", register_address, amount, time.perf_counter() - start)
+        if self._register_cache is not None:
+            self._register_cache.update(register_address, data)
         if amount == 1:
             return data[0]
         else:
@@ -155,11 +138,55 @@ class APDS_9960():
         """
         if type(value) != list:
             value = [value]
-        with SMBus(self.i2c_bus) as bus:
-            bus.write_i2c_block_data(self.i2c_address, register_address, value)
+        if self._pending_writes is not None:
+            for index, byte in enumerate(value):
+                self._pending_writes[register_address + index] = byte
+                if register_address + index in TIMING_REGISTERS:
+                    # get_timing takes the pending values into account.
+                    self._timing = None
+            return
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+        with self._bus.lock:
+            self._bus.handle.write_i2c_block_data(self.i2c_address, register_address, value)
+        if instrumentation is not None:
+            instrumentation.record_transaction("write", register_address, len(value), time.perf_counter() - start)
+        if self._register_cache is not None:
+            self._register_cache.update(register_address, value)
+        if register_address <= 0xA3 and register_address + len(value) > 0x80:
+            for index, byte in enumerate(value):
+                if register_address + index in TIMING_REGISTERS:
+                    self._timing_registers[register_address + index] = byte
+                    self._timing = None
+
+    def read_register(self, register_address):
+        """Reads a single register. When the register cache is enabled the
+        cached value is returned without accessing the bus.\n
+        :register_address: the address of the register.
+        """
+        if self._pending_writes is not None and register_address in self._pending_writes:
+            return self._pending_writes[register_address]
+
+        cache = self._register_cache
+        if cache is None:
+            return self.read_byte_data(register_address)
+
+        value = cache.get(register_address)
+        if value is None:
+            return self.read_byte_data(register_address)
+        if cache.needs_verification():
+            actual = self.read_byte_data(register_address)
+            if actual != value:
+                # The device lost its configuration: the whole copy is stale.
+                cache.drift_events += 1
+                cache.load(self.read_byte_data)
+            return actual
+        return value
 
     def write_flag_data(self, flag, register_address, offset):
-        """Writes a flag to a register with the given offset.\n
+        """Writes a flag to a register with the given offset. The setters use
+        write_field, this method is kept for compatibility.\n
         :flag: A list of booleans
         :register_address: the address at which to write the flag
         :offset: the offset inside the register
@@ -167,13 +194,190 @@ class APDS_9960():
         if len(flag) + offset > 8:
             raise ValueError("Flag + offset exceeded 8 bit limit.")
 
-        register_value = self.read_byte_data(register_address)
-        for index, value in enumerate(flag):
-            if value:
-                register_value |= value << (index + offset)
+        mask = ((1 << len(flag)) - 1) << offset
+        bits = sum(bool(value) << index for index, value in enumerate(flag)) << offset
+        self.write_byte_data((self.read_register(register_address) & ~mask) | bits, register_address)
+
+    def read_field(self, name):
+        """Returns the value of a field of a configuration register (see
+        melopero_apds9960.registers.FIELDS), from the register cache if enabled.\n
+        :name: the name of the field, e.g. "als_gain".
+        """
+        return FIELDS[name].decode(self.read_register(FIELDS[name].address))
+
+    def write_field(self, name, value):
+        """Writes a field of a configuration register leaving the other bits
+        of the register unchanged. Fields that fill the whole register are
+        written without reading it.\n
+        :name: the name of the field, e.g. "als_gain".\n
+        :value: the new value, ValueError if out of the range of the field.
+        """
+        field = FIELDS[name]
+        field.validate(value)
+        address = field.address
+        register_value = 0 if field.clear == 0 else self.read_register(address)
+        self.write_byte_data(field.encode(register_value, value), address)
+
+    def write_fields(self, **values):
+        """Writes many fields, each register is read and written once whatever
+        the number of its fields. All the values are validated before writing.
+        Example: device.write_fields(proximity_engine=True, gestures_engine=True)\n
+        :values: the new values by field name.
+        """
+        updates = dict()
+        for name, value in values.items():
+            field = FIELDS[name]
+            field.validate(value)
+            updates.setdefault(field.address, []).append((field, value))
+
+        registers = dict()
+        for address, fields in updates.items():
+            clear = 0xFF
+            for field, _ in fields:
+                clear &= field.clear
+            register_value = 0 if clear == 0 else self.read_register(address)
+            for field, value in fields:
+                register_value = field.encode(register_value, value)
+            registers[address] = register_value
+        self.write_registers(registers)
+
+    def address_access(self, register_address):
+        """Performs an "address access" of the given register: the chip address
+        followed by the register address, without data. Used to clear interrupts.\n
+        :register_address: the address to access.
+        """
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+        with self._bus.lock:
+            self._bus.handle.write_byte(self.i2c_address, register_address)
+        if instrumentation is not None:
+            instrumentation.record_transaction("address", register_address, 0, time.perf_counter() - start)
+
+    @contextmanager
+    def batch(self):
+        """Context manager that collects all the register writes done inside
+        the with block and sends them when the block ends. Changes to the same
+        register are merged and contiguous registers are written with block
+        writes. Batches can be nested, the writes are sent when the outermost
+        batch ends. If an exception is raised inside the block nothing is written.\n
+        Note: reads and interrupt clears are not deferred. read_register and
+        get_timing already return the values written in the batch.
+        """
+        if self._batch_depth == 0:
+            self._pending_writes = dict()
+        self._batch_depth += 1
+        completed = False
+        try:
+            yield self
+            completed = True
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                pending = self._pending_writes
+                self._pending_writes = None
+                # The Timing may include pending values that are not written.
+                self._timing = None
+                if completed:
+                    self.write_registers(pending)
+
+    def write_registers(self, registers):
+        """Writes many registers using as few block writes as possible.\n
+        :registers: a dictionary {register_address: value}.
+        """
+        for start, values in APDS_9960.group_contiguous(registers):
+            self.write_byte_data(values, start)
+
+    @staticmethod
+    def group_contiguous(registers, max_length=32):
+        """Groups the registers in runs of consecutive addresses.\n
+        :registers: a dictionary {register_address: value}.\n
+        :max_length = 32: the maximum length of a run (SMBus block limit).\n
+        Return value: a list of (start_address, [values]) tuples.
+        """
+        runs = []
+        for address in sorted(registers):
+            if runs and runs[-1][0] + len(runs[-1][1]) == address and len(runs[-1][1]) < max_length:
+                runs[-1][1].append(registers[address])
             else:
-                register_value &= value << (index + offset)
-        self.write_byte_data(register_value, register_address)
+                runs.append((address, [registers[address]]))
+        return runs
+
+    def configure(self, **settings):
+        """Applies many settings in a single batch (see batch). Every keyword is
+        the name of a setter without the "set_" prefix or the name of an
+        "enable_" method. Tuples and lists are passed as positional arguments,
+        dictionaries as keyword arguments. Example:\n
+            device.configure(gesture_prox_enter_threshold=25,
+                             gesture_exit_persistence=APDS_9960.EXIT_AFTER_4_GESTURE_END,
+                             gesture_offsets=(0, 0, 0, 0),
+                             enable_gestures_engine=True)
+        """
+        with self.batch():
+            for name, value in settings.items():
+                method = getattr(self, "set_" + name, None)
+                if method is None and name.startswith("enable_"):
+                    method = getattr(self, name, None)
+                if method is None:
+                    raise ValueError(f"Unknown setting: {name}")
+
+                if isinstance(value, dict):
+                    method(**value)
+                elif isinstance(value, (tuple, list)):
+                    method(*value)
+                else:
+                    method(value)
+
+    def enable_register_cache(self, enable=True, verify_interval=0):
+        """Keeps a shadow copy of the configuration registers, populated with a
+        bulk read. Flag updates then need only one write instead of a read and
+        a write. The copy is reloaded by reset.\n
+        :enable = True: enables or disables the cache.\n
+        :verify_interval = 0: if greater than 0, one cached read every
+            verify_interval is checked against the device. If the values differ
+            the cache is reloaded and the drift is counted.
+        """
+        if enable:
+            self._register_cache = RegisterCache(verify_interval)
+            self._register_cache.load(self.read_byte_data)
+        else:
+            self._register_cache = None
+
+    def read_configuration(self):
+        """Returns the configuration registers as a dictionary {register_address: value},
+        from the register cache if it is enabled, otherwise with two block reads."""
+        cache = self._register_cache
+        if cache is not None and len(cache.values) == len(CACHEABLE_REGISTERS):
+            return dict(cache.values)
+        registers = dict()
+        for start, amount in BULK_READ_BLOCKS:
+            for index, value in enumerate(self.read_byte_data(start, amount)):
+                if start + index in CACHEABLE_REGISTERS:
+                    registers[start + index] = value
+        return registers
+
+    def get_register_cache_stats(self):
+        """Returns a dictionary with the register cache counters or None if the
+        cache is disabled."""
+        if self._register_cache is None:
+            return None
+        return self._register_cache.get_stats()
+
+    def enable_instrumentation(self, instrumentation=None):
+        """Starts collecting transaction counts, latencies, FIFO overflows and
+        parser times (see melopero_apds9960.instrumentation).\n
+        :instrumentation = None: the Instrumentation to update (it can be shared
+            by many devices), by default a new one is created. Pass False to
+            disable the instrumentation.\n
+        Return value: the Instrumentation in use (None if disabled).
+        """
+        if instrumentation is False:
+            self.instrumentation = None
+        else:
+            if instrumentation is None:
+                instrumentation = Instrumentation()
+            self.instrumentation = instrumentation
+        return self.instrumentation
 
     # =========================================================================
     #     Device Methods
@@ -184,10 +388,14 @@ class APDS_9960():
         still receive and process I2C messages.\n
         :power_up = True: Enter the IDLE state if True else enter SLEEP state, by default the value is True.
         """
-        self.write_flag_data([wake_up], APDS_9960.ENABLE_REG_ADDRESS, 0)
-        time.sleep(0.01)
+        self.write_field("power_on", bool(wake_up))
+        time.sleep(APDS_9960.POWER_UP_DELAY)
 
     def reset(self):
+        if self._register_cache is not None:
+            self._register_cache.load(self.read_byte_data)
+        self._timing_registers.clear()
+        self._timing = None
         self.set_sleep_after_interrupt(False)
         self.enable_all_engines_and_power_up(False)
         self.enable_proximity_interrupts(False)
@@ -201,24 +409,88 @@ class APDS_9960():
         interrupt settings."""
         value = 0b01001111 if enable else 0
         self.write_byte_data(value, APDS_9960.ENABLE_REG_ADDRESS)
-        time.sleep(0.01)
+        time.sleep(APDS_9960.POWER_UP_DELAY)
+
+    def get_cycle_time(self):
+        """Returns the approximate time in seconds of a full cycle of the
+        proximity, ALS and wait engines, given the enabled engines, the ALS
+        integration time and the wait time. New proximity and color data are
+        available once per cycle."""
+        return (self._timing or self._update_timing()).cycle_time
+
+    def get_timing(self):
+        """Returns the Timing derived from the configuration: saturation,
+        ALS integration time, wait time (with the long wait factor), gesture
+        wait time, cycle time, gesture dataset period, FIFO fill time and ALS
+        gain multiplier. The registers are read once, then the values are updated by every
+        write of the driver, so they cost no bus transaction. reset reads
+        them again (e.g. if another program changed the configuration)."""
+        return self._timing or self._update_timing()
+
+    @property
+    def saturation(self):
+        """The largest value of the color channels (see get_saturation)."""
+        return (self._timing or self._update_timing()).saturation
+
+    @property
+    def als_integration_millis(self):
+        """The ALS integration time in milliseconds."""
+        return (self._timing or self._update_timing()).als_integration_millis
+
+    @property
+    def wait_millis(self):
+        """The wait time in milliseconds, multiplied by 12 with long wait."""
+        return (self._timing or self._update_timing()).wait_millis
+
+    @property
+    def gesture_wait_millis(self):
+        """The gesture wait time in milliseconds."""
+        return (self._timing or self._update_timing()).gesture_wait_millis
+
+    def _update_timing(self):
+        registers = self._timing_registers
+        pending = self._pending_writes or dict()
+        for address in TIMING_REGISTERS:
+            if address not in registers and address not in pending:
+                registers[address] = self.read_register(address)
+        # Inside a batch the values not written yet count already.
+        values = {address: pending.get(address, registers.get(address)) for address in TIMING_REGISTERS}
+
+        enable = values[APDS_9960.ENABLE_REG_ADDRESS]
+        cycles = 256 - FIELDS["atime"].decode(values[APDS_9960.ALS_ATIME_REG_ADDRESS])
+        integration = cycles * APDS_9960.TIME_STEP_MILLIS
+        wait = (256 - FIELDS["wtime"].decode(values[APDS_9960.WAIT_TIME_REG_ADDRESS])) * APDS_9960.TIME_STEP_MILLIS
+        if FIELDS["long_wait"].decode(values[APDS_9960.CONFIG_1_REG_ADDRESS]):
+            wait *= 12
+        millis = 0
+        if FIELDS["proximity_engine"].decode(enable):
+            millis += APDS_9960.PROXIMITY_CYCLE_MILLIS
+        if FIELDS["als_engine"].decode(enable):
+            millis += integration
+        if FIELDS["wait_engine"].decode(enable):
+            millis += wait
+        gesture_wait = APDS_9960.GESTURE_WAIT_TIMES_MILLIS[
+            FIELDS["gesture_wait_time"].decode(values[APDS_9960.GESTURE_CONFIG_2_REG_ADDRESS])]
+        period = (APDS_9960.GESTURE_CYCLE_MILLIS + gesture_wait) / 1000
+        fill_time = APDS_9960.FIFO_THRESHOLD_DATASETS[
+            FIELDS["gesture_fifo_threshold"].decode(values[APDS_9960.GESTURE_CONFIG_1_REG_ADDRESS])] * period
+        gain = APDS_9960.ALS_GAIN_FACTORS[FIELDS["als_gain"].decode(values[APDS_9960.CONTROL_1_REG_ADDRESS])]
+        self._timing = Timing(min(65535, cycles * 1025), integration, wait, gesture_wait,
+                              millis / 1000, period, fill_time, gain)
+        return self._timing
 
     def set_sleep_after_interrupt(self, enable=True):
         """Sleep After Interrupt. When enabled, the device will automatically 
         enter low power mode when the INT pin is asserted. Normal operation is 
         resumed when INT pin is cleared over I2C.\n
         """
-        self.write_flag_data([enable], APDS_9960.CONFIG_3_REG_ADDRESS, 4)
+        self.write_field("sleep_after_interrupt", bool(enable))
 
     def set_led_drive(self, led_drive):
         """LED drive strength.\n
         :led_drive: must be one of LED_DRIVE_N_mA.
         """
-        if not (APDS_9960.LED_DRIVE_100_mA <= led_drive <= APDS_9960.LED_DRIVE_12_5_mA):
-            raise ValueError("led_drive must be one of APDS_9960.LED_DRIVE_N_mA")
-
-        self.write_flag_data([bool(led_drive & 0b01), bool(led_drive & 0b10)],
-                             APDS_9960.CONTROL_1_REG_ADDRESS, 6)
+        self.write_field("led_drive", led_drive)
 
     def set_led_boost(self, led_boost):
         """The LED_BOOST allows the LDR pin to sink more current above the 
@@ -227,15 +499,15 @@ class APDS_9960():
         percentage of LED_BOOST.\n
         :led_boost: must be one of LED_BOOST_N
         """
-        if not (APDS_9960.LED_BOOST_100 <= led_boost <= APDS_9960.LED_BOOST_300):
-            raise ValueError("led_boost must be one of APDS.LED_BOOST_N")
-
-        self.write_flag_data([bool(led_boost & 0b01), bool(led_boost & 0b10)],
-                             APDS_9960.CONFIG_2_REG_ADDRESS, 4)
+        self.write_field("led_boost", led_boost)
 
     def get_status(self):
         "Returns a dictionary containing the status of the device."
-        status = self.read_byte_data(APDS_9960.STATUS_REG_ADDRESS)
+        return APDS_9960.decode_status(self.read_byte_data(APDS_9960.STATUS_REG_ADDRESS))
+
+    @staticmethod
+    def decode_status(status):
+        "Returns a dictionary containing the flags of the STATUS register value."
         status_dic = dict()
         status_dic["Clear Photodiode Saturation"] = bool(status & 0x80)
         status_dic["Proximity/Gesture Saturation"] = bool(status & 0x40)
@@ -246,34 +518,58 @@ class APDS_9960():
         status_dic["ALS Valid"] = bool(status & 0x01)
         return status_dic
 
+    def read_if_valid(self):
+        """Reads STATUS, color and proximity data with a single block read
+        (the registers are contiguous) and returns only the data that is new:
+        the device sets AVALID and PVALID when a new measurement completes and
+        clears them when the data is read.\n
+        Return value: a Reading (status, color, proximity) where color and
+            proximity are None if they did not change since the last read, or
+            None if neither of them is new. Every value not returned is counted
+            in redundant_reads_avoided.
+        """
+        data = self.read_byte_data(APDS_9960.STATUS_REG_ADDRESS, 10)
+        status = data[0]
+        color = None
+        proximity = None
+        if status & 0x01:
+            color = APDS_9960.decode_color(data[1:9])
+        else:
+            self.redundant_reads_avoided += 1
+        if status & 0x02:
+            proximity = data[9]
+        else:
+            self.redundant_reads_avoided += 1
+
+        if color is None and proximity is None:
+            return None
+        timing = self._timing or self._update_timing()
+        return Reading(APDS_9960.decode_status(status), color, proximity,
+                       timing.saturation, timing.als_integration_millis, timing.als_gain)
+
     # =========================================================================
     #     Proximity Engine Methods
     # =========================================================================
 
     def enable_proximity_engine(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 2)
+        self.write_field("proximity_engine", bool(enable))
 
     def enable_proximity_interrupts(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 5)
+        self.write_field("proximity_interrupts", bool(enable))
 
     def enable_proximity_saturation_interrupts(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.CONFIG_2_REG_ADDRESS, 7)
+        self.write_field("proximity_saturation_interrupts", bool(enable))
 
     def clear_proximity_interrupts(self):
         # Interrupts are cleared by “address accessing” the appropriate register. This is special I2C transaction
         # consisting of only two bytes: chip address with R/W = 0, followed by a register address.
-        with SMBus(self.i2c_bus) as bus:
-            bus.write_byte(self.i2c_address, APDS_9960.PROXIMITY_INT_CLEAR_REG_ADDRESS)
+        self.address_access(APDS_9960.PROXIMITY_INT_CLEAR_REG_ADDRESS)
 
     def set_proximity_gain(self, prox_gain):
         """Proximity Gain Control.\n
         :prox_gain: must be one of PROXIMITY_GAIN_NX.
         """
-        if not (APDS_9960.PROXIMITY_GAIN_1X <= prox_gain <= APDS_9960.PROXIMITY_GAIN_8X):
-            raise ValueError("prox_gain must be one of PROXIMITY_GAIN_NX.")
-
-        self.write_flag_data([bool(prox_gain & 0b01), bool(prox_gain & 0b10)],
-                             APDS_9960.CONTROL_1_REG_ADDRESS, 2)
+        self.write_field("proximity_gain", prox_gain)
 
     def set_proximity_interrupt_thresholds(self, low_thr, high_thr):
         """The Proximity Interrupt Threshold sets the high and low trigger points
@@ -285,8 +581,7 @@ class APDS_9960():
         :low_thr: the low trigger point value.\n
         :high_thr: the high trigger point value. \n
         """
-        self.write_byte_data(low_thr, APDS_9960.PROX_INT_LOW_THR_REG_ADDRESS)
-        self.write_byte_data(high_thr, APDS_9960.PROX_INT_HIGH_THR_REG_ADDRESS)
+        self.write_fields(proximity_low_threshold=low_thr, proximity_high_threshold=high_thr)
 
     def set_proximity_interrupt_persistence(self, persistence):
         """The Interrupt Persistence sets a value which is compared with the 
@@ -297,31 +592,17 @@ class APDS_9960():
             0 : an interrupt is triggered every cycle.\n
             N > 0 : an interrupt is triggered after N results over the threshold.
         """
-        if not (0 <= persistence <= 15):
-            raise ValueError("persistance must be in range [0-15]")
-
-        flag = []
-        for i in range(4):
-            flag.append(bool(persistence & (1 << i)))
-        self.write_flag_data(flag, APDS_9960.INTERRUPT_PERSISTANCE_REG_ADDRESS, 4)
+        self.write_field("proximity_interrupt_persistence", persistence)
 
     def set_proximity_pulse_count_and_length(self, pulse_count,
-                                             pulse_length=PULSE_LEN_8_MICROS):
+                                             pulse_length=Registers.PULSE_LEN_8_MICROS):
         """The proximity pulse count is the number of pulses to be output on
         the LDR pin. The proximity pulse length is the amount of time the LDR 
         pin is sinking current during a proximity pulse.\n
         :pulse_count: must be in range [1-64]\n
         :pulse_length: must be one of APDS_9960.PULSE_LEN_N_MICROS.
         """
-        if not (1 <= pulse_count <= 64):
-            raise ValueError("pulse_count must be in range [1-64]")
-        if not (APDS_9960.PULSE_LEN_4_MICROS <= pulse_length
-                <= APDS_9960.PULSE_LEN_32_MICROS):
-            raise ValueError("pulse_length must be one of APDS_9960.PULSE_LEN_N_MICROS")
-
-        reg_value = pulse_length << 6
-        reg_value |= pulse_count - 1
-        self.write_byte_data(reg_value, APDS_9960.PROX_PULSE_COUNT_REG_ADDRESS)
+        self.write_fields(proximity_pulse_count=pulse_count, proximity_pulse_length=pulse_length)
 
     def set_proximity_offset(self, up_right_offset=0, down_left_offset=0):
         """In proximity mode, the UP and RIGHT and the DOWN and LEFT
@@ -336,10 +617,9 @@ class APDS_9960():
 
         ur_reg_value = abs(up_right_offset)
         ur_reg_value |= 0x80 if up_right_offset < 0 else 0x00
-        self.write_byte_data(ur_reg_value, APDS_9960.PROX_UP_RIGHT_OFFSET_REG_ADDRESS)
         dl_reg_value = abs(down_left_offset)
         dl_reg_value |= 0x80 if down_left_offset < 0 else 0x00
-        self.write_byte_data(dl_reg_value, APDS_9960.PROX_DOWN_LEFT_OFFSET_REG_ADDRESS)
+        self.write_byte_data([ur_reg_value, dl_reg_value], APDS_9960.PROX_UP_RIGHT_OFFSET_REG_ADDRESS)
 
     def disable_photodiodes(self, mask_up, mask_down, mask_left, mask_right,
                             proximity_gain_compensation):
@@ -355,10 +635,9 @@ class APDS_9960():
             of 127. Enabling enables an additional gain of 2X, resulting in a 
             maximum ADC value of 255.
         """
-        self.write_flag_data([mask_right, mask_left, mask_down, mask_up],
-                             APDS_9960.CONFIG_3_REG_ADDRESS, 0)
-        self.write_flag_data([proximity_gain_compensation],
-                             APDS_9960.CONFIG_3_REG_ADDRESS, 5)
+        self.write_fields(proximity_mask_up=bool(mask_up), proximity_mask_down=bool(mask_down),
+                          proximity_mask_left=bool(mask_left), proximity_mask_right=bool(mask_right),
+                          proximity_gain_compensation=bool(proximity_gain_compensation))
 
     def get_proximity_data(self):
         return self.read_byte_data(APDS_9960.PROX_DATA_REG_ADDRESS)
@@ -368,29 +647,24 @@ class APDS_9960():
     # =========================================================================
 
     def enable_als_engine(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 1)
+        self.write_field("als_engine", bool(enable))
 
     def enable_als_interrupts(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 4)
+        self.write_field("als_interrupts", bool(enable))
 
     def enable_als_saturation_interrupts(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.CONFIG_2_REG_ADDRESS, 6)
+        self.write_field("als_saturation_interrupts", bool(enable))
 
     def clear_als_interrupts(self):
         # Interrupts are cleared by “address accessing” the appropriate register. This is special I2C transaction
         # consisting of only two bytes: chip address with R/W = 0, followed by a register address.
-        with SMBus(self.i2c_bus) as bus:
-            bus.write_byte(self.i2c_address, APDS_9960.ALS_INT_CLEAR_REG_ADDRESS)
+        self.address_access(APDS_9960.ALS_INT_CLEAR_REG_ADDRESS)
 
     def set_als_gain(self, als_gain):
         """ALS and Color Gain Control.\n
         :als_gain: must be one of ALS_GAIN_NX.
         """
-        if not (APDS_9960.ALS_GAIN_1X <= als_gain <= APDS_9960.ALS_GAIN_64X):
-            raise ValueError("als_gain must be one of ALS_GAIN_NX.")
-
-        self.write_flag_data([bool(als_gain & 0b01), bool(als_gain & 0b10)],
-                             APDS_9960.CONTROL_1_REG_ADDRESS, 0)
+        self.write_field("als_gain", als_gain)
 
     def set_als_thresholds(self, low_thr, high_thr):
         """ALS level detection uses data generated by the Clear Channel.
@@ -424,13 +698,7 @@ class APDS_9960():
                 3 = 3 consecutive ALS values out of range\n
                 N > 3 = (N - 3) * 5 consecutive ALS values out of range\n
         """
-        if not (0 <= persistence <= 15):
-            raise ValueError("Persistence must be in range [0 - 15]")
-
-        flag = []
-        for i in range(4):
-            flag.append(bool(persistence & (1 << i)))
-        self.write_flag_data(flag, APDS_9960.INTERRUPT_PERSISTANCE_REG_ADDRESS)
+        self.write_field("als_interrupt_persistence", persistence)
 
     def set_als_integration_time(self, wtime):
         """The ATIME register controls the internal integration time of 
@@ -441,21 +709,24 @@ class APDS_9960():
         if not (2.78 <= wtime <= 712):
             raise ValueError("The integration time must be in range [2.78 - 712] millis.")
 
-        value = 256 - int(wtime / 2.78)
-        self.write_byte_data(value, APDS_9960.ALS_ATIME_REG_ADDRESS)
+        self.write_field("atime", 256 - int(wtime / 2.78))
 
     def get_saturation(self):
         """Returns the saturation value. The values returned by get_color_data can not exceed
-        this value."""
-        cycles = 256 - self.read_byte_data(APDS_9960.ALS_ATIME_REG_ADDRESS)
-        return min(65535, cycles * 1025)
+        this value. It is derived from the last ATIME written (see get_timing)."""
+        return (self._timing or self._update_timing()).saturation
 
     def get_color_data(self):
         """Red, green, blue, and clear data is stored as 16-bit values.\n
         Returns : The data is returned as 4 element list: [clear, red, green, blue]. 
         """
+        return APDS_9960.decode_color(self.read_byte_data(APDS_9960.CLEAR_DATA_LOW_BYTE_REG_ADDRESS, 8))
+
+    @staticmethod
+    def decode_color(data):
+        """Returns the [clear, red, green, blue] values given the 8 bytes of
+        the color data registers (starting from the low byte of clear)."""
         color = []
-        data = self.read_byte_data(APDS_9960.CLEAR_DATA_LOW_BYTE_REG_ADDRESS, 8)
         for i in range(4):
             channel_low = data[2 * i]
             channel_high = data[2 * i + 1]
@@ -467,18 +738,17 @@ class APDS_9960():
     # =========================================================================
 
     def enable_gestures_engine(self, enable=True):
-        self.enable_proximity_engine()
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 6)
+        self.write_fields(proximity_engine=True, gestures_engine=bool(enable))
 
     def enter_immediately_gesture_engine(self):
         """Causes immediate entry in to the gesture state machine.
         (Sets GMODE bit to 1)."""
-        self.write_flag_data([True], APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS, 0)
+        self.write_field("gesture_mode", True)
 
     def exit_gesture_engine(self):
         """Causes exit of gesture when current analog conversion has finished.
         (Sets GMODE bit to 0)."""
-        self.write_flag_data([False], APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS, 0)
+        self.write_field("gesture_mode", False)
 
     def set_gesture_prox_enter_threshold(self, enter_thr):
         """The Gesture Proximity Enter Threshold Register value is compared 
@@ -487,10 +757,7 @@ class APDS_9960():
         gesture state machine entry.\n
         :enter_thr: the enter threshold value must be an 8-bit unsigned int
         """
-        if not (0 <= enter_thr <= 0xFF):
-            raise ValueError("enter_thr must be in range [0-0xFF]")
-
-        self.write_byte_data(enter_thr, APDS_9960.GESTURE_PROX_ENTER_THR_REG_ADDRESS)
+        self.write_field("gesture_prox_enter_threshold", enter_thr)
 
     def set_gesture_exit_threshold(self, exit_thr):
         """The Gesture Proximity Exit Threshold value compares all non-masked 
@@ -499,10 +766,7 @@ class APDS_9960():
         :exit_thr: Gesture Exit Threshold. The value used to determine a 
             “gesture end” and subsequent exit of the gesture state machine.
         """
-        if not (0 <= exit_thr <= 0xFF):
-            raise ValueError("exit_thr must be in range [0-0xFF]")
-
-        self.write_byte_data(exit_thr, APDS_9960.GESTURE_EXIT_THR_REG_ADDRESS)
+        self.write_field("gesture_exit_threshold", exit_thr)
 
     def set_gesture_exit_mask(self, mask_up, mask_down, mask_left, mask_right):
         """Gesture Exit Mask. Controls which of the gesture detector photodiodes
@@ -514,8 +778,8 @@ class APDS_9960():
         :mask_left: if True do not include left photodiode in sum.\n
         :mask_right: if True do not include right photodiode in sum.\n
         """
-        self.write_flag_data([mask_right, mask_left, mask_down, mask_up],
-                             APDS_9960.GESTURE_CONFIG_1_REG_ADDRESS, 2)
+        self.write_fields(gesture_exit_mask_up=bool(mask_up), gesture_exit_mask_down=bool(mask_down),
+                          gesture_exit_mask_left=bool(mask_left), gesture_exit_mask_right=bool(mask_right))
 
     def set_gesture_exit_persistence(self, persistence):
         """Gesture Exit Persistence. When a number of consecutive “gesture end”
@@ -523,45 +787,27 @@ class APDS_9960():
         Gesture state machine is exited.\n
         :persistence: must be one of EXIT_AFTER_N_GESTURE_END.
         """
-        if not (APDS_9960.EXIT_AFTER_1_GESTURE_END <= persistence
-                <= APDS_9960.EXIT_AFTER_7_GESTURE_END):
-            raise ValueError("persistence must be one of EXIT_AFTER_N_GESTURE_END.")
-
-        flag = [bool(persistence & 0b01), bool(persistence & 0b10)]
-        self.write_flag_data(flag, APDS_9960.GESTURE_CONFIG_1_REG_ADDRESS, 0)
+        self.write_field("gesture_exit_persistence", persistence)
 
     def set_gesture_gain(self, gesture_gain):
         """Gesture Gain Control. Sets the gain of the proximity receiver in 
         gesture mode.\n
         :gesture_gain: must be one of PROXIMITY_GAIN_NX.
         """
-        if not (APDS_9960.PROXIMITY_GAIN_1X <= gesture_gain <= APDS_9960.PROXIMITY_GAIN_8X):
-            raise ValueError("gesture_gain must be one of PROXIMITY_GAIN_NX.")
-
-        self.write_flag_data([bool(gesture_gain & 0b01), bool(gesture_gain & 0b10)],
-                             APDS_9960.GESTURE_CONFIG_2_REG_ADDRESS, 5)
+        self.write_field("gesture_gain", gesture_gain)
 
     def set_gesture_led_drive(self, led_drive):
         """Gesture LED Drive Strength. Sets LED Drive Strength in gesture mode.\n
         :led_drive: must be one of LED_DRIVE_N_mA.
         """
-        if not (APDS_9960.LED_DRIVE_100_mA <= led_drive <= APDS_9960.LED_DRIVE_12_5_mA):
-            raise ValueError("led_drive must be one of APDS_9960.LED_DRIVE_N_mA")
-
-        self.write_flag_data([bool(led_drive & 0b01), bool(led_drive & 0b10)],
-                             APDS_9960.GESTURE_CONFIG_2_REG_ADDRESS, 3)
+        self.write_field("gesture_led_drive", led_drive)
 
     def set_gesture_wait_time(self, wait_time):
         """Gesture Wait Time. The wait time controls the amount of time in a 
         low power mode between gesture detection cycles.\n
         :wait_time: must be one of GESTURE_WAIT_N_MILLIS.
         """
-        if not (APDS_9960.GESTURE_WAIT_0_MILLIS <= wait_time
-                <= APDS_9960.GESTURE_WAIT_39_2_MILLIS):
-            raise ValueError("wait_time must be one of GESTURE_WAIT_N_MILLIS.")
-
-        flag = [bool(wait_time & 0b001), bool(wait_time & 0b010), bool(wait_time & 0b100)]
-        self.write_flag_data(flag, APDS_9960.GESTURE_CONFIG_2_REG_ADDRESS, 0)
+        self.write_field("gesture_wait_time", wait_time)
 
     def set_gesture_offsets(self, up_offset, down_offset, left_offset, right_offset):
         """The offsets are used to scale an internal offset correction factor 
@@ -572,13 +818,14 @@ class APDS_9960():
         :right_offset: must be in range [-127-127].\n
         """
         offsets = [up_offset, down_offset, left_offset, right_offset]
-        if not all(map(lambda x: -127 <= x <= 127), offsets):
+        if not all(map(lambda x: -127 <= x <= 127, offsets)):
             raise ValueError("All offset must be in range [-127-127]")
 
-        for i, offset in enumerate(offsets):
-            reg_value = abs(offset)
-            reg_value |= 0x80 if offset < 0 else 0
-            self.write_byte_data(reg_value, APDS_9960.GESTURE_OFFSET_REG_ADDRESSES[i])
+        with self.batch():
+            for i, offset in enumerate(offsets):
+                reg_value = abs(offset)
+                reg_value |= 0x80 if offset < 0 else 0
+                self.write_byte_data(reg_value, APDS_9960.GESTURE_OFFSET_REG_ADDRESSES[i])
 
     def set_gesture_pulse_count_and_length(self, pulse_count, pulse_length):
         """The Gesture pulse count sets the number of pulses to be output on 
@@ -587,14 +834,7 @@ class APDS_9960():
         :pulse_count: must be in range [1-64].\n
         :pulse_length: must be one of PULSE_LEN_N_MICROS.
         """
-        if not (1 <= pulse_count <= 64):
-            raise ValueError("pulse_count must be in range [1-64].")
-        if not (APDS_9960.PULSE_LEN_4_MICROS <= pulse_length
-                <= APDS_9960.PULSE_LEN_32_MICROS):
-            raise ValueError("pulse_length must be one of PULSE_LEN_N_MICROS.")
-
-        reg_value = (pulse_count - 1) | (pulse_length << 6)
-        self.write_byte_data(reg_value, APDS_9960.GESTURE_PULSE_COUNT_AND_LEN_REG_ADDRESS)
+        self.write_fields(gesture_pulse_count=pulse_count, gesture_pulse_length=pulse_length)
 
     def set_active_photodiodes_pairs(self, up_down_active=True, right_left_active=True):
         """Which gesture photodiode pair: UP-DOWN and/or RIGHT-LEFT will be 
@@ -606,12 +846,12 @@ class APDS_9960():
         :up_down_active = True:\n
         :right_left_active = True:
         """
-        self.write_flag_data([up_down_active, right_left_active],
-                             APDS_9960.GESTURE_CONFIG_3_REG_ADDRESS, 0)
+        self.write_fields(gesture_up_down_active=bool(up_down_active),
+                          gesture_right_left_active=bool(right_left_active))
 
     def enable_gesture_interrupts(self, enable_interrupts=True):
         """Enables or disables all gesture engine related interrupts."""
-        self.write_flag_data([enable_interrupts], APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS, 1)
+        self.write_field("gesture_interrupts", bool(enable_interrupts))
 
     def set_gesture_fifo_threshold(self, fifo_thr):
         """Gesture FIFO Threshold. This value is compared with the FIFO Level
@@ -619,24 +859,42 @@ class APDS_9960():
         (if enabled).\n
         :fifo_thr: must be one of FIFO_INT_AFTER_N_DATASET(S).
         """
-        if not (APDS_9960.FIFO_INT_AFTER_1_DATASET <= fifo_thr
-                <= APDS_9960.FIFO_INT_AFTER_16_DATASETS):
-            raise ValueError("fifo_thr must be one of FIFO_INT_AFTER_N_DATASET(S)")
-
-        flag = [bool(fifo_thr & 0b01), bool(fifo_thr & 0b10)]
-        self.write_flag_data(flag, APDS_9960.GESTURE_CONFIG_1_REG_ADDRESS, 6)
+        self.write_field("gesture_fifo_threshold", fifo_thr)
 
     def reset_gesture_engine_interrupt_settings(self):
         """Clears GFIFO, GINT, GVALID, GFIFO_OV and GFIFO_LVL."""
-        self.write_flag_data([True], APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS, 2)
+        self.write_field("gesture_fifo_clear", True)
 
     def is_gesture_engine_running(self):
         return bool(self.read_byte_data(APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS) & 0x01)
 
     def get_number_of_datasets_in_fifo(self):
         """Returns how many four byte data points - UDLR are ready for read 
-        over I2C. One four-byte dataset is equivalent to a single count."""
-        return self.read_byte_data(APDS_9960.GESTURE_FIFO_LEVEL_REG_ADDRESS)
+        over I2C. One four-byte dataset is equivalent to a single count.\n
+        The gesture status is read in the same transaction (the registers are
+        contiguous): if the FIFO overflowed, fifo_overflows and lost_datasets
+        are updated and the overflow flag is cleared by the next
+        read_gesture_fifo, once the datasets have been read."""
+        level, status = self.read_byte_data(APDS_9960.GESTURE_FIFO_LEVEL_REG_ADDRESS, 2)
+        now = time.monotonic()
+        overflow = bool(status & 0x02)
+        if overflow and not self._overflow_pending:
+            self._overflow_pending = True
+            self.gesture_overflowed = True
+            self.fifo_overflows += 1
+            if self.instrumentation is not None:
+                self.instrumentation.record_overflow()
+            # The datasets produced since the previous check that did not fit
+            # in the FIFO (assuming it was emptied then), at least one.
+            lost = 1
+            if self._last_fifo_check is not None:
+                produced = (now - self._last_fifo_check) / self.get_gesture_dataset_period()
+                lost = max(lost, round(produced) - APDS_9960.GESTURE_FIFO_SIZE)
+            self.lost_datasets += lost
+        self._last_fifo_check = now
+        if self.drain_controller is not None:
+            self.drain_controller.observe(level, overflow, now)
+        return level
 
     def get_gesture_status(self):
         """Returns a dictionary containing data about the gesture engine status."""
@@ -646,155 +904,240 @@ class APDS_9960():
         status_dict["Gesture FIFO Data"] = bool(status & 0x01)
         return status_dict
 
+    def get_gesture_dataset_period(self):
+        """Returns the approximate time in seconds between two datasets, given
+        the configured gesture wait time."""
+        return (self._timing or self._update_timing()).gesture_dataset_period
+
+    def get_fifo_fill_time(self):
+        """Returns the approximate time in seconds the gesture engine needs to
+        collect enough datasets to reach the FIFO threshold."""
+        return (self._timing or self._update_timing()).fifo_fill_time
+
     def get_gesture_data(self):
         """Returns a dataset (list) containing one integration cycle of UP, 
         DOWN, LEFT & RIGHT gesture data. The amount of valid data can be retrieved 
         with the get_number_of_datasets_in_fifo method."""
         return self.read_byte_data(APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS, 4)
 
+    def read_gesture_fifo(self, datasets=None, out=None):
+        """Reads many datasets from the gesture FIFO with as few transfers as
+        possible: a single raw i2c transfer if the adapter supports it, otherwise
+        SMBus block reads of 32 bytes (8 datasets) each.\n
+        :datasets = None: the amount of datasets to read, by default all the
+            datasets in the FIFO.\n
+        :out = None: a GestureBuffer. If given the datasets are appended to it
+            and the amount of datasets read is returned.\n
+        Return value: a bytearray containing the datasets one after the other
+            (UP, DOWN, LEFT, RIGHT, UP, DOWN, ...).
+        """
+        if datasets is None:
+            datasets = self.get_number_of_datasets_in_fifo()
+        if out is not None:
+            return out.extend(self.read_gesture_fifo(datasets)) if datasets > 0 else 0
+        data = self._read_fifo_data(datasets * 4) if datasets > 0 else bytearray()
+        if self._overflow_pending:
+            # The overflow flag stays set until the FIFO is cleared: it is done
+            # after reading the datasets, so only the ones that arrived in the
+            # meantime are dropped.
+            self._overflow_pending = False
+            self.reset_gesture_engine_interrupt_settings()
+        return data
+
+    def _read_fifo_data(self, remaining):
+        """Reads remaining bytes from the gesture FIFO (see read_gesture_fifo)."""
+        instrumentation = self.instrumentation
+        with self._bus.lock:
+            if self._bus.combined_transfers:
+                try:
+                    if instrumentation is not None:
+                        start = time.perf_counter()
+                    data = self._bus.read_combined(self.i2c_address,
+                                                   APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS, remaining)
+                    if instrumentation is not None:
+                        instrumentation.record_transaction("read", APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS,
+                                                           remaining, time.perf_counter() - start)
+                    return data
+                except OSError:
+                    # The adapter refused the raw transfer: use SMBus block reads from now on.
+                    self._bus.combined_transfers = False
+
+            data = bytearray()
+            while remaining > 0:
+                # Every block read starting at the FIFO address pops the next datasets.
+                amount = min(remaining, SMBUS_BLOCK_MAX)
+                if instrumentation is not None:
+                    start = time.perf_counter()
+                data += bytes(self._bus.handle.read_i2c_block_data(
+                    self.i2c_address, APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS, amount))
+                if instrumentation is not None:
+                    instrumentation.record_transaction("read", APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS,
+                                                       amount, time.perf_counter() - start)
+                remaining -= amount
+            return data
+
+    def _count_votes(self, buffer, tolerance, der_tolerance, counts, profile=None):
+        """gesture.count_votes, timed when the instrumentation is enabled."""
+        if self.instrumentation is None:
+            return gesture.count_votes(buffer, tolerance, der_tolerance, counts, profile=profile)
+        start = time.perf_counter()
+        gesture.count_votes(buffer, tolerance, der_tolerance, counts, profile=profile)
+        self.instrumentation.record_parse(len(buffer), time.perf_counter() - start)
+        return counts
+
     def parse_gesture(self, parse_millis, tolerance=12, der_tolerance=6, confidence=6):
         """ Returns a list containing the gesture on the vertical and horizontal axis."""
-        # Detecting method:
-        # 1) identify instants where difference between values on same axis is greater than tolerance
-        # 2) identify instants where both curves are raising or falling
-        # 2.1) the curves must be both raising or both falling at the same instants
-        # 3) In those instants which value is greater ?
-        # 3.1) if up[i] > down[i]
-        #          if dup > 0 and ddown > 0 (curves are raising):
-        #              up_count++;
-        #          else if dup < 0 and ddown < 0 (curves are falling):
-        #              down_count++
-        # 4) After having processed all datasets in the fifo see if there is enough "confidence" to tell a gesture has been detected
-        #      if up_count > down_count + confidence:
-        #          gesture = UP_GESTURE
-        #      else if down_count > up_count + confidence:
-        #          gesture = DOWN_GESTURE
-        #      else
-        #          gesture = NO_GESTURE
         parse_seconds = parse_millis / 1000
         start_time = time.time()
-        detected_gestures = [APDS_9960.NO_GESTURE, APDS_9960.NO_GESTURE]
         counts = [0, 0, 0, 0]
-
-        prev_dataset = None
-        first_iteration = True
+        buffer = self._gesture_buffer
+        buffer.clear()
+        self.gesture_overflowed = False
+        # When the FIFO is empty there is no point in asking again before a new dataset is ready.
+        poll_interval = self.get_gesture_dataset_period()
 
         while start_time + parse_seconds > time.time():
             datasets_in_fifo = self.get_number_of_datasets_in_fifo()
 
             if datasets_in_fifo > 0:
-                if first_iteration:
-                    first_iteration = False
-                    prev_dataset = self.get_gesture_data()
-                else:
-                    for _ in range(datasets_in_fifo):
-                        curr_dataset = self.get_gesture_data()
-
-                        derivatives = [curr_dataset[i] - prev_dataset[i] for i in range(4)]
-                        axis_difference = [curr_dataset[i] - curr_dataset[i + 1] for i in range(0, 4, 2)]
-
-                        for axis in range(2):
-                            up_left_index = axis * 2
-                            down_right_index = axis * 2 + 1
-                            if (abs(axis_difference[axis]) > tolerance) and (
-                                    abs(derivatives[up_left_index]) > der_tolerance or abs(
-                                derivatives[down_right_index]) > der_tolerance):
-                                if derivatives[up_left_index] >= 0 and derivatives[down_right_index] >= 0:
-                                    if curr_dataset[up_left_index] > curr_dataset[down_right_index]:
-                                        counts[up_left_index] += 1
-                                    else:
-                                        counts[down_right_index] += 1
-                                elif derivatives[up_left_index] <= 0 and derivatives[down_right_index] <= 0:
-                                    if curr_dataset[up_left_index] < curr_dataset[down_right_index]:
-                                        counts[up_left_index] += 1
-                                    else:
-                                        counts[down_right_index] += 1
-
-                        prev_dataset = curr_dataset
-
-        if counts[1] >= counts[0] + confidence:
-            detected_gestures[0] = APDS_9960.DOWN_GESTURE
-        elif counts[0] >= counts[1] + confidence:
-            detected_gestures[0] = APDS_9960.UP_GESTURE
-
-        if counts[3] >= counts[2] + confidence:
-            detected_gestures[1] = APDS_9960.RIGHT_GESTURE
-        elif counts[2] >= counts[3] + confidence:
-            detected_gestures[1] = APDS_9960.LEFT_GESTURE
-
-        return detected_gestures
+                self.read_gesture_fifo(datasets_in_fifo, out=buffer)
+                self._count_votes(buffer, tolerance, der_tolerance, counts)
+                # Keep the last dataset: it is the previous one of the next read.
+                buffer.discard(len(buffer) - 1)
+            else:
+                time.sleep(min(poll_interval, max(0, start_time + parse_seconds - time.time())))
+
+        return gesture.decide(counts, confidence)
+
+    def capture_gesture(self, interrupt=None, timeout=None, tolerance=12, der_tolerance=6, confidence=6):
+        """Waits for a gesture and returns it (in the same format as parse_gesture).
+        Instead of polling the FIFO level continuously it waits for the
+        interrupt, then drains the FIFO every time new data is signaled until
+        the gesture engine exits.\n
+        :interrupt = None: an object with a wait(timeout) method, like
+            GpioInterrupt or PollingInterrupt (melopero_apds9960.interrupt).
+            By default a PollingInterrupt is used.\n
+        :timeout = None: the maximum time in seconds to wait for the beginning
+            of a gesture, by default waits forever.\n
+        Return value: the detected gestures or None if the timeout expired.
+        """
+        counts = [0, 0, 0, 0]
+        if not self._drain_gesture(interrupt, timeout, tolerance, der_tolerance, counts):
+            return None
+        return gesture.decide(counts, confidence)
+
+    def capture_gesture_event(self, interrupt=None, timeout=None, tolerance=12, der_tolerance=6,
+                              confidence=6, level_threshold=120, tap_max_datasets=16):
+        """Same as capture_gesture, but returns a gesture.GestureEvent: besides
+        up, down, left and right it reports diagonals, near, far and tap
+        gestures and a confidence score. They are computed in the same pass
+        over the FIFO data, without other bus reads.\n
+        :level_threshold = 120, tap_max_datasets = 16: see gesture.make_event.\n
+        Return value: the GestureEvent or None if the timeout expired.
+        """
+        counts = [0, 0, 0, 0]
+        profile = gesture.new_profile()
+        if not self._drain_gesture(interrupt, timeout, tolerance, der_tolerance, counts, profile):
+            return None
+        event = gesture.make_event(counts, profile, confidence, level_threshold, tap_max_datasets)
+        event.overflowed = self.gesture_overflowed
+        return event
+
+    def _drain_gesture(self, interrupt, timeout, tolerance, der_tolerance, counts, profile=None):
+        """Waits for a gesture and adds its votes to counts (see capture_gesture).
+        Returns False if the timeout expired."""
+        if interrupt is None:
+            interrupt = PollingInterrupt(self)
+        if not interrupt.wait(timeout):
+            return False
+
+        buffer = self._gesture_buffer
+        buffer.clear()
+        self.gesture_overflowed = False
+        # The last datasets of a gesture may not reach the threshold: if no
+        # interrupt comes in time the FIFO is checked anyway.
+        drain_timeout = 2 * self.get_fifo_fill_time()
+        while True:
+            if self.read_gesture_fifo(out=buffer) > 0:
+                self._count_votes(buffer, tolerance, der_tolerance, counts, profile)
+                buffer.discard(len(buffer) - 1)
+            elif not self.is_gesture_engine_running():
+                break
+            interrupt.wait(drain_timeout)
+        return True
+
+    def recognize_gestures(self, recognizer=None, interrupt=None, timeout=None):
+        """Generator of the detected gestures (in the same format as
+        parse_gesture). The datasets are passed to a GestureRecognizer as
+        soon as they are read, so a gesture is usually yielded before the
+        hand has left the sensor.\n
+        :recognizer = None: a gesture.GestureRecognizer, by default one is
+            created with the exit settings of the device (see GestureRecognizer.from_device).\n
+        :interrupt = None: see capture_gesture.\n
+        :timeout = None: the generator ends if no gesture begins within
+            timeout seconds, by default it waits forever.
+        """
+        if recognizer is None:
+            recognizer = gesture.GestureRecognizer.from_device(self)
+        if interrupt is None:
+            interrupt = PollingInterrupt(self)
+
+        while interrupt.wait(timeout):
+            self.gesture_overflowed = False
+            # Computed for every gesture: a DrainController may change the settings.
+            drain_timeout = 2 * self.get_fifo_fill_time()
+            while True:
+                data = self.read_gesture_fifo()
+                if data:
+                    if self.instrumentation is None:
+                        detected = recognizer.push_block(data)
+                    else:
+                        start = time.perf_counter()
+                        detected = recognizer.push_block(data)
+                        self.instrumentation.record_parse(len(data) // 4, time.perf_counter() - start)
+                    yield from detected
+                elif not self.is_gesture_engine_running():
+                    break
+                interrupt.wait(drain_timeout)
+            detected_gestures = recognizer.end()
+            if detected_gestures is not None:
+                yield detected_gestures
 
     def parse_gesture_in_fifo(self, tolerance=12, der_tolerance=6, confidence=6):
         """ Returns a list containing the gesture on the vertical and horizontal axis."""
-        # Detecting method:
-        # 1) identify instants where difference between values on same axis is greater than tolerance
-        # 2) identify instants where both curves are raising or falling
-        # 2.1) the curves must be both raising or both falling at the same instants
-        # 3) In those instants which value is greater ?
-        # 3.1) if up[i] > down[i]
-        #          if dup > 0 and ddown > 0 (curves are raising):
-        #              up_count++;
-        #          else if dup < 0 and ddown < 0 (curves are falling):
-        #              down_count++
-        # 4) After having processed all datasets in the fifo see if there is enough "confidence" to tell a gesture has been detected
-        #      if up_count > down_count + confidence:
-        #          gesture = UP_GESTURE
-        #      else if down_count > up_count + confidence:
-        #          gesture = DOWN_GESTURE
-        #      else
-        #          gesture = NO_GESTURE
+        self.gesture_overflowed = False
         datasets_in_fifo = self.get_number_of_datasets_in_fifo()
-        detected_gestures = [APDS_9960.NO_GESTURE, APDS_9960.NO_GESTURE]
-
-        if datasets_in_fifo == 0:
-            return detected_gestures
-
         counts = [0, 0, 0, 0]
-
-        prev_dataset = self.get_gesture_data()
-
-        for _ in range(1, datasets_in_fifo):
-            curr_dataset = self.get_gesture_data()
-
-            derivatives = [curr_dataset[i] - prev_dataset[i] for i in range(4)]
-            axis_difference = [curr_dataset[i] - curr_dataset[i + 1] for i in range(0, 4, 2)]
-
-            for axis in range(2):
-                up_left_index = axis * 2
-                down_right_index = axis * 2 + 1
-                if (abs(axis_difference[axis]) > tolerance) and (abs(derivatives[up_left_index]) > der_tolerance or abs(
-                        derivatives[down_right_index]) > der_tolerance):
-                    if derivatives[up_left_index] >= 0 and derivatives[down_right_index] >= 0:
-                        if curr_dataset[up_left_index] > curr_dataset[down_right_index]:
-                            counts[up_left_index] += 1
-                        else:
-                            counts[down_right_index] += 1
-                    elif derivatives[up_left_index] <= 0 and derivatives[down_right_index] <= 0:
-                        if curr_dataset[up_left_index] < curr_dataset[down_right_index]:
-                            counts[up_left_index] += 1
-                        else:
-                            counts[down_right_index] += 1
-
-            prev_dataset = curr_dataset
-
-        if counts[1] >= counts[0] + confidence:
-            detected_gestures[0] = APDS_9960.DOWN_GESTURE
-        elif counts[0] >= counts[1] + confidence:
-            detected_gestures[0] = APDS_9960.UP_GESTURE
-
-        if counts[3] >= counts[2] + confidence:
-            detected_gestures[1] = APDS_9960.RIGHT_GESTURE
-        elif counts[2] >= counts[3] + confidence:
-            detected_gestures[1] = APDS_9960.LEFT_GESTURE
-
-        return detected_gestures
+        buffer = self._gesture_buffer
+        buffer.clear()
+
+        if datasets_in_fifo > 0:
+            self.read_gesture_fifo(datasets_in_fifo, out=buffer)
+            self._count_votes(buffer, tolerance, der_tolerance, counts)
+
+        return gesture.decide(counts, confidence)
+
+    def parse_gesture_event_in_fifo(self, tolerance=12, der_tolerance=6, confidence=6,
+                                    level_threshold=120, tap_max_datasets=16):
+        """Same as parse_gesture_in_fifo, but returns a gesture.GestureEvent
+        (see capture_gesture_event)."""
+        buffer = self._gesture_buffer
+        buffer.clear()
+        self.gesture_overflowed = False
+        self.read_gesture_fifo(out=buffer)
+        counts = [0, 0, 0, 0]
+        profile = gesture.new_profile()
+        self._count_votes(buffer, tolerance, der_tolerance, counts, profile)
+        event = gesture.make_event(counts, profile, confidence, level_threshold, tap_max_datasets)
+        event.overflowed = self.gesture_overflowed
+        return event
 
     # =========================================================================
     #     Wait Engine Methods
     # =========================================================================
 
     def enable_wait_engine(self, enable=True):
-        self.write_flag_data([enable], APDS_9960.ENABLE_REG_ADDRESS, 3)
+        self.write_field("wait_engine", bool(enable))
 
     def set_wait_time(self, wtime, long_wait=False):
         """Sets the wait time in WTIME register. This is the time that will pass
@@ -806,8 +1149,35 @@ class APDS_9960():
         if not (2.78 <= wtime <= 712):
             raise ValueError("The wait time must be between 2.78 ms and 712 ms")
 
-        # long_wait
-        self.write_flag_data([long_wait], APDS_9960.CONFIG_1_REG_ADDRESS, 1)
-        # wtime
-        reg_value = 256 - int(wtime / 2.78)
-        self.write_byte_data(reg_value, APDS_9960.WAIT_TIME_REG_ADDRESS)
+        self.write_fields(long_wait=bool(long_wait), wtime=256 - int(wtime / 2.78))
+
+
+def _field_getter(field):
+    if field.width == 1:
+        def getter(self):
+            return bool(field.decode(self.read_register(field.address)))
+    else:
+        def getter(self):
+            return field.decode(self.read_register(field.address))
+    getter.__name__ = "get_" + field.name
+    getter.__doc__ = f"Returns the {field.mnemonic} field of register {hex(field.address)}."
+    return getter
+
+
+def _field_setter(field):
+    def setter(self, value):
+        self.write_field(field.name, value)
+    setter.__name__ = "set_" + field.name
+    setter.__doc__ = (f"Writes the {field.mnemonic} field of register {hex(field.address)}.\n"
+                      f":value: must be in range [{field.minimum}-{field.maximum}].")
+    return setter
+
+
+# get_<field> and set_<field> for all the fields of registers.FIELDS that do
+# not have a hand written accessor (the enable_ methods count as setters).
+for _field in FIELDS.values():
+    if not hasattr(APDS_9960, "get_" + _field.name):
+        setattr(APDS_9960, "get_" + _field.name, _field_getter(_field))
+    if not (hasattr(APDS_9960, "set_" + _field.name) or hasattr(APDS_9960, "enable_" + _field.name)):
+        setattr(APDS_9960, "set_" + _field.name, _field_setter(_field))
+del _field
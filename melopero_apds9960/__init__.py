@@ -1,5 +1,32 @@
 """
 @author: Leonardo La Rocca
+
+The driver is imported on first access of melopero_apds9960.APDS_9960:
+"import melopero_apds9960" alone is cheap, for example for tools that only
+need the constants of melopero_apds9960.registers.
 """
+import sys
+import types
+
+
+class _Package(types.ModuleType):
+    def __setattr__(self, name, value):
+        # Importing the submodule melopero_apds9960.APDS_9960 sets it as an
+        # attribute of the package: keep the class instead.
+        if name == "APDS_9960" and isinstance(value, types.ModuleType):
+            value = value.APDS_9960
+        super().__setattr__(name, value)
+
+
+def __getattr__(name):
+    if name == "APDS_9960":
+        from melopero_apds9960.APDS_9960 import APDS_9960
+        return APDS_9960
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + ["APDS_9960"])
+
 
-from melopero_apds9960.APDS_9960 import APDS_9960
\ No newline at end of file
+sys.modules[__name__].__class__ = _Package
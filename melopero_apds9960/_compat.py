@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Optional dependencies shared by the modules of the package.
+"""
+import sys
+
+# NumPy is imported the first time a batch is large enough to use it (see
+# _import_numpy): importing it takes longer than processing many samples.
+numpy = None
+_numpy_imported = False
+
+
+def _import_numpy():
+    """Returns the numpy module, or None if it is not installed."""
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+def _is_array(samples):
+    # An array exists only if the caller imported NumPy already.
+    module = sys.modules.get("numpy")
+    return module is not None and isinstance(samples, module.ndarray)
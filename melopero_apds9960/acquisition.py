@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Parallel acquisition from sensors connected to different i2c adapters.
+Every bus has its own i/o worker (the executor of its SharedBus), so buses
+are read concurrently while the transactions on the same bus stay serialized.
+"""
+from melopero_apds9960.APDS_9960 import APDS_9960
+from collections import namedtuple, deque
+import queue
+import threading
+import time
+
+# timestamp: time.monotonic() at the end of the read, name: the name of the
+# sensor, bus: the i2c bus number, value: the result of the operation.
+Sample = namedtuple("Sample", ["timestamp", "name", "bus", "value"])
+
+
+def _physical_bus(device):
+    """The SharedBus that performs the transactions of the device (for
+    devices behind a multiplexer it is the bus the multiplexer is on)."""
+    mux = getattr(device._bus.handle, "mux", None)
+    return mux.bus if mux is not None else device._bus
+
+
+class Acquisition():
+    """Reads many APDS_9960s, one worker per i2c bus. The sensors on the same
+    bus are read one after the other by the worker of that bus (the executor
+    of its SharedBus), different buses are read at the same time.\n
+    :operation = APDS_9960.read_if_valid: a function called with the
+        APDS_9960 as argument, its result is the value of the Sample.
+    """
+
+    def __init__(self, operation=APDS_9960.read_if_valid):
+        self.operation = operation
+        self.sensors = dict()
+        self._buses = dict()
+        self._busy_time = dict()
+        self._samples = dict()
+        self._start = None
+        self._last = None
+
+    def add(self, name, device):
+        """Adds a sensor.\n
+        :name: the name of the sensor, used in the Samples.\n
+        :device: the APDS_9960.
+        """
+        if name in self.sensors:
+            raise ValueError(f"A sensor named {name} already exists")
+        bus = _physical_bus(device)
+        self.sensors[name] = device
+        self._buses.setdefault(bus, []).append(name)
+        self._busy_time.setdefault(bus, 0.0)
+        self._samples.setdefault(bus, 0)
+
+    def add_array(self, array):
+        """Adds all the sensors of a SensorArray (see melopero_apds9960.mux),
+        in the order that minimizes the channel switches."""
+        for name in array.schedule():
+            self.add(name, array.sensors[name])
+
+    def _read_bus(self, bus, names):
+        start = time.monotonic()
+        samples = []
+        for name in names:
+            value = self.operation(self.sensors[name])
+            samples.append(Sample(time.monotonic(), name, bus.i2c_bus, value))
+        return samples, time.monotonic() - start
+
+    def _collect(self, bus, future):
+        samples, busy_time = future.result()
+        self._busy_time[bus] += busy_time
+        self._samples[bus] += len(samples)
+        self._last = time.monotonic()
+        return samples
+
+    def read_round(self):
+        """Reads every sensor once.\n
+        Return value: a list of Samples ordered by timestamp.
+        """
+        if self._start is None:
+            self._start = time.monotonic()
+        futures = [(bus, bus.executor.submit(self._read_bus, bus, names))
+                   for bus, names in self._buses.items()]
+        samples = []
+        for bus, future in futures:
+            samples.extend(self._collect(bus, future))
+        samples.sort(key=lambda sample: sample.timestamp)
+        return samples
+
+    def _chain(self, bus, rounds, results, stop):
+        """Reads a round of the bus, hands the samples to results and
+        submits the next round to the same worker (other jobs submitted to
+        the bus executor in the meantime run between the rounds)."""
+        if stop.is_set():
+            results.put((bus, None))
+            return
+        try:
+            samples, busy_time = self._read_bus(bus, self._buses[bus])
+        except Exception as error:
+            results.put((bus, error))
+            return
+        results.put((bus, (samples, busy_time)))
+        if rounds is not None:
+            rounds -= 1
+            if rounds == 0:
+                results.put((bus, None))
+                return
+        bus.executor.submit(self._chain, bus, rounds, results, stop)
+
+    def stream(self, rounds=None):
+        """Generator of Samples ordered by timestamp. Unlike repeated calls
+        to read_round, the buses do not wait for each other: every worker
+        starts its next round as soon as the previous one ends.\n
+        :rounds = None: the amount of rounds to read on every bus, by default
+            forever.
+        """
+        if self._start is None:
+            self._start = time.monotonic()
+        results = queue.Queue()
+        stop = threading.Event()
+        buffers = {bus: deque() for bus in self._buses}
+        # The timestamp of the last sample received from every running bus:
+        # the following samples of that bus will be newer.
+        last = {bus: None for bus in self._buses}
+        for bus in self._buses:
+            bus.executor.submit(self._chain, bus, rounds, results, stop)
+
+        try:
+            while last or any(buffers.values()):
+                if last:
+                    bus, result = results.get()
+                    if result is None:
+                        del last[bus]
+                    elif isinstance(result, Exception):
+                        raise result
+                    else:
+                        samples, busy_time = result
+                        self._busy_time[bus] += busy_time
+                        self._samples[bus] += len(samples)
+                        self._last = time.monotonic()
+                        buffers[bus].extend(samples)
+                        if samples:
+                            last[bus] = samples[-1].timestamp
+
+                # k-way merge: a sample can be emitted when no bus can still
+                # produce an older one.
+                while True:
+                    heads = [buffer for buffer in buffers.values() if buffer]
+                    if not heads:
+                        break
+                    oldest = min(heads, key=lambda buffer: buffer[0].timestamp)
+                    timestamp = oldest[0].timestamp
+                    if any(not buffers[bus] and (newest is None or newest < timestamp)
+                           for bus, newest in last.items()):
+                        break
+                    yield oldest.popleft()
+        finally:
+            stop.set()
+
+    def get_stats(self):
+        """Returns a dictionary with the aggregate
+        samples per second and, for every bus, the samples, the samples per
+        second and the utilization: the fraction of time its worker was busy."""
+        # Started but no round finished yet: nothing measured.
+        elapsed = 0.0 if self._start is None or self._last is None else self._last - self._start
+        buses = dict()
+        for bus, names in self._buses.items():
+            buses[bus.i2c_bus] = {"sensors": len(names),
+                                  "samples": self._samples[bus],
+                                  "samples_per_second": self._samples[bus] / elapsed if elapsed > 0 else 0.0,
+                                  "utilization": self._busy_time[bus] / elapsed if elapsed > 0 else 0.0}
+        samples = sum(self._samples.values())
+        return {"samples": samples,
+                "samples_per_second": samples / elapsed if elapsed > 0 else 0.0,
+                "buses": buses}
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+asyncio interface to the APDS-9960. The bus i/o runs in the executor thread
+dedicated to the device's i2c bus, so transactions of devices on the same bus
+stay serialized while the event loop keeps running.
+"""
+import asyncio
+import functools
+from melopero_apds9960.APDS_9960 import APDS_9960
+from melopero_apds9960.gesture_buffer import GestureBuffer
+from melopero_apds9960.interrupt import PollingInterrupt
+from melopero_apds9960 import gesture
+
+
+class AsyncAPDS9960():
+    """Wraps an APDS_9960. Every method of APDS_9960 is available as a
+    coroutine with the same name and arguments, for example
+    await device.set_led_drive(APDS_9960.LED_DRIVE_50_mA).\n
+    :device = None: the APDS_9960 to wrap. If not given a new one is created
+        passing it the keyword arguments (i2c_address, i2c_bus, ...).
+    """
+
+    def __init__(self, device=None, **kwargs):
+        self.device = device if device is not None else APDS_9960(**kwargs)
+
+    async def run(self, function, *args, **kwargs):
+        """Runs function(*args, **kwargs) in the executor of the device's bus
+        and returns its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.device.executor,
+                                          functools.partial(function, *args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.device, name)
+        if not callable(method):
+            return method
+
+        @functools.wraps(method)
+        async def coroutine(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+        return coroutine
+
+    async def get_color_data(self):
+        return await self.run(self.device.get_color_data)
+
+    async def get_proximity_data(self):
+        return await self.run(self.device.get_proximity_data)
+
+    async def wake_up(self, wake_up=True):
+        """Same as APDS_9960.wake_up, but waits for the power up without
+        blocking the event loop."""
+        await self.run(self.device.write_field, "power_on", bool(wake_up))
+        await asyncio.sleep(APDS_9960.POWER_UP_DELAY)
+
+    async def enable_all_engines_and_power_up(self, enable=True):
+        """Same as APDS_9960.enable_all_engines_and_power_up, but waits for the
+        power up without blocking the event loop."""
+        value = 0b01001111 if enable else 0
+        await self.run(self.device.write_byte_data, value, APDS_9960.ENABLE_REG_ADDRESS)
+        await asyncio.sleep(APDS_9960.POWER_UP_DELAY)
+
+    async def proximity(self, interval=0.1):
+        """Asynchronous iterator over the proximity values, one every interval seconds.\n
+        :interval = 0.1: the time in seconds between two readings.
+        """
+        while True:
+            yield await self.get_proximity_data()
+            await asyncio.sleep(interval)
+
+    async def gestures(self, tolerance=12, der_tolerance=6, confidence=6, poll_interval=None):
+        """Asynchronous iterator over the detected gestures. A gesture is
+        yielded (in the same format as APDS_9960.parse_gesture) every time the
+        gesture engine exits after detecting a movement on at least one axis.
+        Every bus read is a separate call in the executor and the waits
+        between them run on the event loop, so other coroutines can use the
+        bus while a gesture is drained.\n
+        :poll_interval = None: the time in seconds between two polls of the
+            gesture status, by default it is derived from the gesture wait time
+            and the FIFO threshold (as in PollingInterrupt).
+        """
+        interrupt = await self.run(PollingInterrupt, self.device, poll_interval)
+        buffer = GestureBuffer(64)
+
+        while True:
+            status = await self.get_gesture_status()
+            if not (status["Gesture FIFO Data"] or status["Gesture FIFO Overflow"]):
+                await asyncio.sleep(interrupt.interval)
+                continue
+
+            counts = [0, 0, 0, 0]
+            buffer.clear()
+            self.device.gesture_overflowed = False
+            while True:
+                if await self.run(self.device.read_gesture_fifo, None, buffer) > 0:
+                    # Same vote counting (and instrumentation) as APDS_9960.capture_gesture.
+                    self.device._count_votes(buffer, tolerance, der_tolerance, counts)
+                    buffer.discard(len(buffer) - 1)
+                elif not await self.run(self.device.is_gesture_engine_running):
+                    break
+                await asyncio.sleep(interrupt.interval)
+
+            detected_gestures = gesture.decide(counts, confidence)
+            if detected_gestures != [gesture.NO_GESTURE, gesture.NO_GESTURE]:
+                yield detected_gestures
+
+    async def close(self):
+        # Closing may wait for the bus executor to stop: it must run neither
+        # inside it nor on the event loop thread.
+        await asyncio.get_running_loop().run_in_executor(None, self.device.close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
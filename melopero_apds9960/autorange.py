@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Automatic ranging of the ALS gain and integration time. The controller
+estimates the light level from every color sample and picks the shortest
+integration time that, with the highest gain that does not get close to
+saturation, collects enough counts on the clear channel:
+
+    auto = AutoRange(device)
+    while True:
+        reading = auto.read() # same as device.read_if_valid
+        if reading is not None and reading.color is not None:
+            lux = converter.lux([reading.color], gain=reading.gain,
+                                integration_millis=reading.integration_millis)
+"""
+from melopero_apds9960.registers import ALS_GAIN_FACTORS, TIME_STEP_MILLIS
+from collections import namedtuple
+import math
+import time
+
+# timestamp: time.monotonic() of the change, gain: the new ALS gain multiplier,
+# integration_millis: the new integration time, sample_rate: the measurements
+# per second with the new settings (see APDS_9960.get_cycle_time), reason:
+# why the settings were changed.
+RangeChange = namedtuple("RangeChange", ["timestamp", "gain", "integration_millis", "sample_rate", "reason"])
+
+
+class AutoRange():
+    """Adjusts ALS gain and integration time to the light level.\n
+    After a saturated sample it goes straight to the shortest exposure (1x,
+    min_integration_millis), which measures the light level in one sample,
+    then to the planned settings: from any settings the controller usually
+    converges in two samples.\n
+    Gain and ATIME are written together with APDS_9960.write_fields, so that
+    a change is one write per register that changes. ATIME (0x81) and CONTROL
+    (0x8F) are not contiguous, a change of both takes two writes: joining
+    them in one block write would rewrite the thresholds and the reserved
+    registers in between. With the register cache enabled no read is needed.\n
+    The first color sample after a change may have been integrated with the
+    old settings: read discards it.\n
+    :device: the APDS_9960, its ALS engine must be enabled.\n
+    :min_counts = 1000: the clear channel counts wanted for a good resolution.
+        Longer integration times are used only when the highest gain can not
+        reach them.\n
+    :target = 0.5: the highest fraction of the saturation a new setting may
+        reach with the current light level, the rest is headroom for changes.\n
+    :high = 0.8: a sample above this fraction of the saturation triggers a
+        change toward a shorter exposure.\n
+    :min_integration_millis = 2.78: the shortest integration time.\n
+    :max_integration_millis = 200: the longest integration time, it bounds the
+        sample period in the dark.\n
+    :on_change = None: a function called with every RangeChange.
+    """
+
+    def __init__(self, device, min_counts=1000, target=0.5, high=0.8, min_integration_millis=TIME_STEP_MILLIS,
+                 max_integration_millis=200, on_change=None):
+        if not 0 < target < high <= 1:
+            raise ValueError("Must be 0 < target < high <= 1")
+        if not (TIME_STEP_MILLIS <= min_integration_millis <= max_integration_millis <= 712):
+            raise ValueError("The integration times must be in range [2.78 - 712] millis.")
+        self.device = device
+        self.min_counts = min_counts
+        self.target = target
+        self.high = high
+        self.min_cycles = max(1, int(min_integration_millis / TIME_STEP_MILLIS))
+        self.max_cycles = min(256, int(max_integration_millis / TIME_STEP_MILLIS))
+        self.on_change = on_change
+        self.changes = []
+        self.samples = 0
+        self.saturated = 0
+        self.discarded = 0
+        # Samples from the last change to the first sample that needed none.
+        self.last_convergence = 0
+        self._since_change = None
+        self._discard = False
+        self.gain_index = device.get_als_gain()
+        self.cycles = round(device.get_timing().als_integration_millis / TIME_STEP_MILLIS)
+
+    @property
+    def gain(self):
+        """The current ALS gain multiplier."""
+        return ALS_GAIN_FACTORS[self.gain_index]
+
+    @property
+    def integration_millis(self):
+        return self.cycles * TIME_STEP_MILLIS
+
+    def read(self):
+        """Same as APDS_9960.read_if_valid, the color samples are used to
+        adjust the settings. The color of the first sample after a change
+        is removed from the reading (None if there is nothing else).
+        The settings may change before read returns: the gain and
+        integration time the color was taken with are the ones in the
+        reading, not the current gain and integration_millis."""
+        reading = self.device.read_if_valid()
+        if reading is None or reading.color is None:
+            return reading
+        if self._discard:
+            self._discard = False
+            self.discarded += 1
+            if reading.proximity is None:
+                return None
+            return reading._replace(color=None)
+        self.observe(reading.color)
+        return reading
+
+    def observe(self, color):
+        """Adjusts the settings given a color sample taken with the current
+        settings. Returns the RangeChange or None if the settings are kept.\n
+        :color: [clear, red, green, blue] as returned by get_color_data.
+        """
+        self.samples += 1
+        clear = color[0]
+        saturation = min(65535, self.cycles * 1025)
+        if self._since_change is not None:
+            self._since_change += 1
+
+        if clear >= saturation:
+            self.saturated += 1
+            if (self.gain_index, self.cycles) == (0, self.min_cycles):
+                return None
+            return self._change(0, self.min_cycles, "saturated")
+
+        # Counts per cycle at 1x, a dark sample is assumed at half a count.
+        rate = max(clear, 0.5) / (ALS_GAIN_FACTORS[self.gain_index] * self.cycles)
+        gain_index, cycles = self.plan(rate)
+        if (gain_index, cycles) != (self.gain_index, self.cycles):
+            expected = rate * ALS_GAIN_FACTORS[gain_index] * cycles
+            if clear > self.high * saturation:
+                return self._change(gain_index, cycles, f"{clear} counts, over {self.high:.0%} of {saturation}")
+            if clear < self.min_counts / 2 and expected > clear:
+                return self._change(gain_index, cycles, f"{clear} counts, below {self.min_counts}")
+            if cycles * 2 <= self.cycles:
+                return self._change(gain_index, cycles,
+                                    f"{cycles * TIME_STEP_MILLIS:.1f} ms are enough for {self.min_counts} counts")
+        if self._since_change is not None:
+            self.last_convergence = self._since_change
+            self._since_change = None
+        return None
+
+    def plan(self, rate):
+        """Returns the (ALS_GAIN_NX, cycles) for a light level.\n
+        :rate: the clear channel counts per integration cycle at 1x gain.
+        """
+        best = None
+        for gain_index in reversed(range(len(ALS_GAIN_FACTORS))):
+            per_cycle = rate * ALS_GAIN_FACTORS[gain_index]
+            # Up to 63 cycles the saturation grows with the integration time, so
+            # the fraction of the saturation depends only on the gain.
+            if per_cycle > self.target * 1025:
+                continue
+            longest = min(self.max_cycles, max(self.min_cycles, int(self.target * 65535 / per_cycle)))
+            cycles = min(longest, max(self.min_cycles, math.ceil(self.min_counts / per_cycle)))
+            counts = per_cycle * cycles
+            if best is None:
+                best = (gain_index, cycles, counts)
+            elif counts >= self.min_counts and cycles < best[1]:
+                best = (gain_index, cycles, counts)
+            elif best[2] < self.min_counts and counts > best[2]:
+                best = (gain_index, cycles, counts)
+        if best is None:
+            # Too bright even at 1x: the shortest exposure saturates the least.
+            return 0, self.min_cycles
+        return best[0], best[1]
+
+    def _change(self, gain_index, cycles, reason):
+        changes = dict()
+        if gain_index != self.gain_index:
+            changes["als_gain"] = gain_index
+        if cycles != self.cycles:
+            changes["atime"] = 256 - cycles
+        self.device.write_fields(**changes)
+        self.gain_index = gain_index
+        self.cycles = cycles
+        self._discard = True
+        if self._since_change is None:
+            self._since_change = 0
+        change = RangeChange(time.monotonic(), self.gain, self.integration_millis, self.get_sample_rate(), reason)
+        self.changes.append(change)
+        if self.on_change is not None:
+            self.on_change(change)
+        return change
+
+    def get_sample_rate(self):
+        """Returns the ALS measurements per second with the current settings
+        (the cycle also includes the proximity and wait engines if enabled)."""
+        cycle_time = self.device.get_cycle_time()
+        return 1 / cycle_time if cycle_time else 0.0
+
+    def get_stats(self):
+        """Returns a dictionary with the samples observed, the saturated and
+        discarded ones, the changes, the samples needed by the last change to
+        converge, the current settings and sample rate."""
+        return {"samples": self.samples,
+                "saturated": self.saturated,
+                "discarded": self.discarded,
+                "changes": len(self.changes),
+                "last_convergence": self.last_convergence,
+                "gain": self.gain,
+                "integration_millis": self.integration_millis,
+                "sample_rate": self.get_sample_rate()}
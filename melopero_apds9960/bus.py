@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+"""
+import threading
+
+# smbus2 and concurrent.futures are imported on first use: importing the
+# package does not load them (see benchmarks/import_time.py).
+
+# Maximum amount of bytes that can be transferred with an SMBus block command.
+SMBUS_BLOCK_MAX = 32
+# smbus2.I2cFunc.I2C: the adapter supports raw i2c transfers.
+I2C_FUNC_I2C = 0x00000001
+
+
+class BusBackend():
+    """Interface of the objects that perform the i2c transactions for the
+    driver. smbus2.SMBus implements it, other implementations (for example
+    melopero_apds9960.simulator.SimulatedAPDS9960) can be passed to APDS_9960
+    with the bus argument. The method signatures are the ones of smbus2.SMBus.
+    Backends that support raw i2c transfers also provide i2c_rdwr and a funcs
+    attribute containing smbus2.I2cFunc.I2C.
+    """
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        """Reads length bytes starting at register, returns a list of ints."""
+        raise NotImplementedError
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        """Writes the list of ints data starting at register."""
+        raise NotImplementedError
+
+    def write_byte(self, i2c_addr, value):
+        """Sends a single byte (used for the "address access" of a register)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SharedBus():
+    """An open bus handle shared by every device that lives on the same
+    i2c adapter. The lock must be held for the whole duration of a
+    transaction so that devices used from different threads do not
+    interleave their messages.\n
+    :handle: the object that performs the transactions (an SMBus instance or
+        another BusBackend).\n
+    :i2c_bus: the bus number the handle was opened on.
+    """
+
+    def __init__(self, handle, i2c_bus=None):
+        self.handle = handle
+        self.i2c_bus = i2c_bus
+        self.lock = threading.RLock()
+        self.users = 0
+        # Raw i2c transfers are not limited to 32 bytes, but not every
+        # adapter (nor every bus backend) supports them.
+        funcs = getattr(handle, "funcs", None)
+        self.combined_transfers = (hasattr(handle, "i2c_rdwr") and funcs is not None
+                                   and bool(funcs & I2C_FUNC_I2C))
+        self._executor = None
+        # (multiplexer, channel) currently selected on this bus, see melopero_apds9960.mux
+        self.route = None
+
+    @property
+    def executor(self):
+        """A single thread executor dedicated to this bus, created on first
+        use. Submitting all the i/o of a bus to it keeps the transactions
+        serialized without blocking the caller."""
+        with self.lock:
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix=f"i2c-{self.i2c_bus}")
+            return self._executor
+
+    def read_combined(self, i2c_addr, register, length):
+        """Reads length bytes starting at register with a single raw i2c
+        transfer (write register address, repeated start, read).
+        Only available if combined_transfers is True.\n
+        Return value: a bytearray.
+        """
+        from smbus2 import i2c_msg
+        write = i2c_msg.write(i2c_addr, [register])
+        read = i2c_msg.read(i2c_addr, length)
+        self.handle.i2c_rdwr(write, read)
+        return bytearray(bytes(read))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        close = getattr(self.handle, "close", None)
+        if close is not None:
+            close()
+
+
+class ClosedBus():
+    """Takes the place of the SharedBus of a closed device: any use of the
+    bus raises RuntimeError."""
+
+    def __getattr__(self, name):
+        raise RuntimeError("device is closed")
+
+
+CLOSED_BUS = ClosedBus()
+
+
+class BusPool():
+    """Keeps one open handle per i2c bus and hands it out to every device
+    created on that bus. The handle is closed when the last device releases it.\n
+    :factory = None: callable that opens a bus given its number, by default
+        smbus2.SMBus (imported when the first bus is opened).
+    """
+
+    def __init__(self, factory=None):
+        self.factory = factory if factory is not None else _open_smbus
+        self._buses = dict()
+        self._lock = threading.Lock()
+
+    def acquire(self, i2c_bus):
+        """Returns the SharedBus for the given bus number, opening it if needed."""
+        with self._lock:
+            shared = self._buses.get(i2c_bus)
+            if shared is None:
+                shared = SharedBus(self.factory(i2c_bus), i2c_bus)
+                self._buses[i2c_bus] = shared
+            shared.users += 1
+            return shared
+
+    def release(self, shared):
+        """Gives back a handle obtained with acquire. The handle is closed
+        when no device is using it anymore."""
+        with self._lock:
+            shared.users -= 1
+            if shared.users <= 0 and self._buses.get(shared.i2c_bus) is shared:
+                del self._buses[shared.i2c_bus]
+                shared.close()
+
+    def open_buses(self):
+        """Returns the numbers of the buses that are currently open."""
+        with self._lock:
+            return list(self._buses.keys())
+
+
+def _open_smbus(i2c_bus):
+    from smbus2 import SMBus
+    return SMBus(i2c_bus)
+
+
+default_pool = BusPool()
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Color processing of batches of [clear, red, green, blue] samples: normalized
+RGB, HSV, illuminance (lux) and correlated color temperature (CCT), computed
+in one call for the whole batch:
+
+    converter = ColorConverter.from_device(device)
+    colors = converter.convert(samples)
+    colors.lux, colors.cct, colors.rgb, colors.hsv, colors.saturated
+
+Lux and CCT follow the method of the ams design note DN40: the infrared
+component is estimated from the four channels and subtracted, the lux are
+a weighted sum of the IR-free channels divided by the counts per lux of the
+integration time and gain, the CCT is linear in the blue/red ratio. The
+default coefficients are the ones of the design note for a sensor in open
+air: use ColorCalibration to store the coefficients of each device (glass,
+diffuser) and calibrate_lux / calibrate_cct to fit them to a reference meter.
+"""
+from melopero_apds9960.registers import ALS_GAIN_FACTORS, TIME_STEP_MILLIS
+from melopero_apds9960._compat import _import_numpy, _is_array
+from collections import namedtuple
+import colorsys
+
+# Below this amount of samples the pure Python loop is faster than NumPy.
+NUMPY_MIN_SAMPLES = 32
+
+# rgb: red, green and blue divided by the saturation (0 to 1), hsv: hue,
+# saturation and value (0 to 1, as colorsys.rgb_to_hsv) of rgb, lux and cct:
+# NaN when they can not be computed, saturated: True if the clear channel
+# reached the saturation (lux and cct are not reliable).
+# With NumPy every field is an array, rgb and hsv of shape (N, 3), otherwise
+# lists (of tuples for rgb and hsv).
+ColorBatch = namedtuple("ColorBatch", ["rgb", "hsv", "lux", "cct", "saturated"])
+
+
+class ColorCalibration():
+    """The coefficients used to compute lux and CCT.\n
+    :r_coef = 0.136, g_coef = 1.0, b_coef = -0.444: the weights of the IR-free
+        red, green and blue channels in the illuminance.\n
+    :ct_coef = 3810, ct_offset = 1391: CCT = ct_coef * blue / red + ct_offset
+        (IR-free channels).\n
+    :device_factor = 310: the device and package factor (DF in DN40).\n
+    :glass_attenuation = 1.0: the attenuation of the glass or diffuser over
+        the sensor (GA in DN40), 1 in open air.
+    """
+
+    def __init__(self, r_coef=0.136, g_coef=1.0, b_coef=-0.444, ct_coef=3810, ct_offset=1391,
+                 device_factor=310, glass_attenuation=1.0):
+        self.r_coef = r_coef
+        self.g_coef = g_coef
+        self.b_coef = b_coef
+        self.ct_coef = ct_coef
+        self.ct_offset = ct_offset
+        self.device_factor = device_factor
+        self.glass_attenuation = glass_attenuation
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def copy(self, **changes):
+        """Returns a copy of the calibration with the given coefficients changed."""
+        return ColorCalibration(**dict(self.to_dict(), **changes))
+
+    def __repr__(self):
+        return "ColorCalibration(" + ", ".join(f"{name}={value!r}" for name, value in vars(self).items()) + ")"
+
+
+class ColorConverter():
+    """Converts color samples taken with a given ALS configuration.\n
+    :calibration = None: the ColorCalibration of the device, by default the
+        coefficients of DN40 in open air.\n
+    :gain = 1: the ALS gain multiplier (1, 4, 16 or 64, see ALS_GAIN_FACTORS).\n
+    :integration_millis = 2.78: the ALS integration time in milliseconds.\n
+    :saturation = None: the largest channel value, by default derived from
+        the integration time as the driver does.
+    """
+
+    def __init__(self, calibration=None, gain=1, integration_millis=TIME_STEP_MILLIS, saturation=None):
+        self.calibration = calibration if calibration is not None else ColorCalibration()
+        self.gain = gain
+        self.integration_millis = integration_millis
+        if saturation is None:
+            saturation = min(65535, round(integration_millis / TIME_STEP_MILLIS) * 1025)
+        self.saturation = saturation
+
+    @classmethod
+    def from_device(cls, device, calibration=None):
+        """Returns a converter for the current ALS configuration of the device.
+        Call update again after changing the gain or the integration time."""
+        converter = cls(calibration)
+        converter.update(device)
+        return converter
+
+    def update(self, device):
+        """Takes gain, integration time and saturation from the device. The
+        integration time and saturation cost no bus transaction, the gain
+        is read from the register cache if enabled."""
+        timing = device.get_timing()
+        self.gain = ALS_GAIN_FACTORS[device.get_als_gain()]
+        self.integration_millis = timing.als_integration_millis
+        self.saturation = timing.saturation
+
+    def convert(self, samples, gain=None, integration_millis=None, saturation=None, use_numpy=None):
+        """Returns the ColorBatch of a batch of samples.\n
+        :samples: [clear, red, green, blue] samples: a list of lists (e.g. the
+            colors returned by get_color_data or Reading.color) or a NumPy
+            array of shape (N, 4).\n
+        :gain, integration_millis, saturation = None: override the
+            configuration of the converter, either one value for all the
+            samples or one value per sample (e.g. the Reading fields of
+            samples taken while the configuration changed).\n
+        :use_numpy = None: force (True) or prevent (False) the use of NumPy.
+            By default it is used for arrays and for batches of at least
+            NUMPY_MIN_SAMPLES samples, if installed.
+        """
+        gain = self.gain if gain is None else gain
+        integration_millis = self.integration_millis if integration_millis is None else integration_millis
+        saturation = self.saturation if saturation is None else saturation
+        if use_numpy is None:
+            use_numpy = (_is_array(samples) or len(samples) >= NUMPY_MIN_SAMPLES) and _import_numpy() is not None
+        if use_numpy:
+            if _import_numpy() is None:
+                raise RuntimeError("NumPy is not installed")
+            return self._convert_numpy(samples, gain, integration_millis, saturation)
+        return self._convert_python(samples, gain, integration_millis, saturation)
+
+    def lux(self, samples, **kwargs):
+        """Returns only the illuminance of the samples, see convert."""
+        return self.convert(samples, **kwargs).lux
+
+    def cct(self, samples, **kwargs):
+        """Returns only the correlated color temperature of the samples, see convert."""
+        return self.convert(samples, **kwargs).cct
+
+    def _convert_python(self, samples, gain, integration_millis, saturation):
+        calibration = self.calibration
+        r_coef, g_coef, b_coef = calibration.r_coef, calibration.g_coef, calibration.b_coef
+        ct_coef, ct_offset = calibration.ct_coef, calibration.ct_offset
+        scale = calibration.glass_attenuation * calibration.device_factor
+        count = len(samples)
+        gains = _per_sample(gain, count)
+        times = _per_sample(integration_millis, count)
+        saturations = _per_sample(saturation, count)
+
+        rgb, hsv, lux, cct, saturated = [], [], [], [], []
+        for (clear, red, green, blue), gain, millis, full in zip(samples, gains, times, saturations):
+            color = (min(red / full, 1.0), min(green / full, 1.0), min(blue / full, 1.0))
+            rgb.append(color)
+            hsv.append(colorsys.rgb_to_hsv(*color))
+            ir = (red + green + blue - clear) / 2
+            red_ir = red - ir
+            blue_ir = blue - ir
+            lux.append(max(0.0, (r_coef * red_ir + g_coef * (green - ir) + b_coef * blue_ir)
+                           * scale / (millis * gain)))
+            cct.append(ct_coef * blue_ir / red_ir + ct_offset if red_ir > 0 else float("nan"))
+            saturated.append(clear >= full)
+        return ColorBatch(rgb, hsv, lux, cct, saturated)
+
+    def _convert_numpy(self, samples, gain, integration_millis, saturation):
+        numpy = _import_numpy()
+        calibration = self.calibration
+        data = numpy.asarray(samples, dtype=numpy.float64).reshape(-1, 4)
+        clear, red, green, blue = data.T
+        gain = numpy.asarray(gain, dtype=numpy.float64)
+        millis = numpy.asarray(integration_millis, dtype=numpy.float64)
+        full = numpy.asarray(saturation, dtype=numpy.float64)
+
+        # One saturation per sample divides a row, a single one the whole array.
+        rgb = numpy.minimum(data[:, 1:] / (full.reshape(-1, 1) if full.ndim else full), 1.0)
+        ir = (red + green + blue - clear) / 2
+        red_ir = red - ir
+        blue_ir = blue - ir
+        lux = numpy.maximum((calibration.r_coef * red_ir + calibration.g_coef * (green - ir)
+                             + calibration.b_coef * blue_ir)
+                            * (calibration.glass_attenuation * calibration.device_factor) / (millis * gain), 0.0)
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            cct = numpy.where(red_ir > 0, calibration.ct_coef * blue_ir / red_ir + calibration.ct_offset, numpy.nan)
+        return ColorBatch(rgb, rgb_to_hsv(rgb), lux, cct, clear >= full)
+
+    # =========================================================================
+    #     Calibration
+    # =========================================================================
+
+    def calibrate_lux(self, samples, reference_lux, **kwargs):
+        """Returns a copy of the calibration with the glass attenuation that
+        makes the mean lux of the samples equal to the reference.\n
+        :samples: samples taken under a steady light, see convert.\n
+        :reference_lux: the illuminance measured by a reference lux meter.\n
+        :kwargs: passed to convert.
+        """
+        measured = [value for value in self.convert(samples, **kwargs).lux if value > 0]
+        if not measured:
+            raise ValueError("The samples are too dark to calibrate")
+        factor = reference_lux / (sum(measured) / len(measured))
+        return self.calibration.copy(glass_attenuation=self.calibration.glass_attenuation * factor)
+
+    def calibrate_cct(self, samples, reference_cct, **kwargs):
+        """Returns a copy of the calibration with ct_coef and ct_offset fitted
+        (least squares) to the CCT of two or more light sources.\n
+        :samples: a list with a batch of samples for every light source.\n
+        :reference_cct: the CCT of every light source (Kelvin).\n
+        :kwargs: passed to convert.
+        """
+        if len(samples) != len(reference_cct) or len(samples) < 2:
+            raise ValueError("At least two light sources are needed")
+        ratios = []
+        for batch in samples:
+            # (cct - offset) / coef is the blue/red ratio of the IR-free channels.
+            values = [(value - self.calibration.ct_offset) / self.calibration.ct_coef
+                      for value in self.convert(batch, **kwargs).cct if value == value]
+            if not values:
+                raise ValueError("The samples are too dark to calibrate")
+            ratios.append(sum(values) / len(values))
+        mean_ratio = sum(ratios) / len(ratios)
+        mean_cct = sum(reference_cct) / len(reference_cct)
+        variance = sum((ratio - mean_ratio) ** 2 for ratio in ratios)
+        if variance == 0:
+            raise ValueError("The light sources have the same color")
+        ct_coef = sum((ratio - mean_ratio) * (cct - mean_cct)
+                      for ratio, cct in zip(ratios, reference_cct)) / variance
+        return self.calibration.copy(ct_coef=ct_coef, ct_offset=mean_cct - ct_coef * mean_ratio)
+
+
+def rgb_to_hsv(rgb):
+    """Same as colorsys.rgb_to_hsv on every row of a NumPy array of shape (N, 3)."""
+    numpy = _import_numpy()
+    red, green, blue = rgb.T
+    high = rgb.max(axis=1)
+    delta = high - rgb.min(axis=1)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        saturation = numpy.where(high > 0, delta / high, 0.0)
+        red_c = (high - red) / delta
+        green_c = (high - green) / delta
+        blue_c = (high - blue) / delta
+        hue = numpy.where(red == high, blue_c - green_c,
+                          numpy.where(green == high, 2.0 + red_c - blue_c, 4.0 + green_c - red_c))
+        hue = numpy.where(delta > 0, (hue / 6.0) % 1.0, 0.0)
+    return numpy.stack((hue, saturation, high), axis=1)
+
+
+def _per_sample(value, count):
+    """Returns one value per sample given a value or a sequence of values."""
+    if not hasattr(value, "__len__"):
+        return [value] * count
+    if len(value) != count:
+        raise ValueError("Expected one value per sample")
+    return value
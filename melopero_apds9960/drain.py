@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Adapts the gesture engine to the rate at which the host actually drains the
+gesture FIFO, so that a slow or loaded host does not lose datasets.
+"""
+from melopero_apds9960.APDS_9960 import APDS_9960
+from collections import namedtuple
+
+# timestamp: time.monotonic() of the change, setting: "fifo_threshold" or
+# "gesture_wait_time", old and new: the register values (FIFO_INT_AFTER_N_DATASET(S)
+# or GESTURE_WAIT_N_MILLIS), reason: why the setting was changed.
+Adjustment = namedtuple("Adjustment", ["timestamp", "setting", "old", "new", "reason"])
+
+
+class DrainController():
+    """Watches the FIFO level every time the device reads it (all the gesture
+    methods do, see APDS_9960.get_number_of_datasets_in_fifo). When the FIFO
+    overflows or is found fuller than high_water, the host is not keeping up
+    and the controller takes one step:\n
+    1. it lowers the FIFO threshold, so that the interrupt (or the polling,
+       see PollingInterrupt) comes earlier and leaves more room in the FIFO
+       for the host latency,\n
+    2. when the threshold is already at 1 dataset, it raises the gesture wait
+       time, so that the device produces fewer datasets per second.\n
+    After relax_after drains in a row below low_water it steps back toward
+    the original settings, in the opposite order. Every change is appended
+    to changes and passed to on_change.\n
+    The photodiode pairs (GDIMS) are not changed: every dataset holds the
+    four values anyway, so they do not change how fast the FIFO fills.\n
+    :device: the APDS_9960.\n
+    :interrupt = None: the PollingInterrupt used to wait for the gesture data,
+        its interval is updated after every change.\n
+    :high_water = 24: the FIFO level (datasets) that triggers a step.\n
+    :low_water = 8: the FIFO level below which a drain counts toward relaxing.\n
+    :relax_after = 64: the drains below low_water needed to step back.\n
+    :max_wait_time = GESTURE_WAIT_14_MILLIS: the longest gesture wait time
+        the controller may set: longer waits leave too few datasets per gesture.\n
+    :cooldown = 0.1: the seconds after a change during which no other step
+        is taken, so that the effect of the change can be observed.\n
+    :on_change = None: a function called with every Adjustment.
+    """
+
+    def __init__(self, device, interrupt=None, high_water=24, low_water=8, relax_after=64,
+                 max_wait_time=APDS_9960.GESTURE_WAIT_14_MILLIS, cooldown=0.1, on_change=None):
+        if not 0 < low_water < high_water <= APDS_9960.GESTURE_FIFO_SIZE:
+            raise ValueError("Must be 0 < low_water < high_water <= 32")
+        if not (APDS_9960.GESTURE_WAIT_0_MILLIS <= max_wait_time
+                <= APDS_9960.GESTURE_WAIT_39_2_MILLIS):
+            raise ValueError("max_wait_time must be one of GESTURE_WAIT_N_MILLIS.")
+        self.device = device
+        self.interrupt = interrupt
+        self.high_water = high_water
+        self.low_water = low_water
+        self.relax_after = relax_after
+        self.max_wait_time = max_wait_time
+        self.cooldown = cooldown
+        self.on_change = on_change
+        self.changes = []
+        self.drains = 0
+        self.overflows = 0
+        self.max_level = 0
+        self._levels = 0
+        self._calm_drains = 0
+        self._last_change = None
+        self.fifo_threshold = None
+        self.gesture_wait_time = None
+        self.original_fifo_threshold = None
+        self.original_gesture_wait_time = None
+
+    def attach(self):
+        """Starts watching the device, the current settings are the ones the
+        controller steps back to."""
+        self.fifo_threshold = self.device.get_gesture_fifo_threshold()
+        self.gesture_wait_time = self.device.get_gesture_wait_time()
+        self.original_fifo_threshold = self.fifo_threshold
+        self.original_gesture_wait_time = self.gesture_wait_time
+        self.device.drain_controller = self
+        return self
+
+    def detach(self, restore=True):
+        """Stops watching the device.\n
+        :restore = True: if True the original settings are written back.
+        """
+        if self.device.drain_controller is self:
+            self.device.drain_controller = None
+        if restore and self.fifo_threshold is not None:
+            with self.device.batch():
+                self.device.set_gesture_fifo_threshold(self.original_fifo_threshold)
+                self.device.set_gesture_wait_time(self.original_gesture_wait_time)
+            self.fifo_threshold = self.original_fifo_threshold
+            self.gesture_wait_time = self.original_gesture_wait_time
+            self._update_interrupt()
+
+    def __enter__(self):
+        return self.attach()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
+
+    def observe(self, level, overflow, now):
+        """Called by the device with every FIFO level it reads.\n
+        :level: the datasets in the FIFO.\n
+        :overflow: True if the overflow flag is set.\n
+        :now: time.monotonic() of the read.
+        """
+        if level == 0 and not overflow:
+            # An empty FIFO says nothing about the drain rate (e.g. no gesture).
+            return
+        self.drains += 1
+        self._levels += level
+        self.max_level = max(self.max_level, level)
+        if overflow:
+            self.overflows += 1
+
+        if overflow or level >= self.high_water:
+            self._calm_drains = 0
+            if self._last_change is None or now - self._last_change >= self.cooldown:
+                self._tighten(now, "FIFO overflow" if overflow
+                              else f"FIFO level {level}/{APDS_9960.GESTURE_FIFO_SIZE}")
+        elif level <= self.low_water:
+            self._calm_drains += 1
+            if self._calm_drains >= self.relax_after:
+                self._calm_drains = 0
+                self._relax(now)
+        else:
+            self._calm_drains = 0
+
+    def _tighten(self, now, reason):
+        if self.fifo_threshold > APDS_9960.FIFO_INT_AFTER_1_DATASET:
+            self._change("fifo_threshold", self.fifo_threshold - 1, now, reason)
+        elif self.gesture_wait_time < self.max_wait_time:
+            self._change("gesture_wait_time", self.gesture_wait_time + 1, now, reason)
+
+    def _relax(self, now):
+        reason = f"{self.relax_after} drains below {self.low_water} datasets"
+        if self.gesture_wait_time > self.original_gesture_wait_time:
+            self._change("gesture_wait_time", self.gesture_wait_time - 1, now, reason)
+        elif self.fifo_threshold < self.original_fifo_threshold:
+            self._change("fifo_threshold", self.fifo_threshold + 1, now, reason)
+
+    def _change(self, setting, value, now, reason):
+        if setting == "fifo_threshold":
+            old = self.fifo_threshold
+            self.device.set_gesture_fifo_threshold(value)
+            self.fifo_threshold = value
+        else:
+            old = self.gesture_wait_time
+            self.device.set_gesture_wait_time(value)
+            self.gesture_wait_time = value
+        self._last_change = now
+        self._update_interrupt()
+        adjustment = Adjustment(now, setting, old, value, reason)
+        self.changes.append(adjustment)
+        if self.on_change is not None:
+            self.on_change(adjustment)
+
+    def _update_interrupt(self):
+        if self.interrupt is not None and hasattr(self.interrupt, "update_interval"):
+            self.interrupt.update_interval()
+
+    def get_stats(self):
+        """Returns a dictionary with the drains (FIFO reads with data), the
+        overflows, the mean and highest FIFO level, the datasets lost (as
+        estimated by the device), the current settings and the changes."""
+        return {"drains": self.drains,
+                "overflows": self.overflows,
+                "lost_datasets": self.device.lost_datasets,
+                "mean_level": self._levels / self.drains if self.drains else 0.0,
+                "max_level": self.max_level,
+                "fifo_threshold_datasets": APDS_9960.FIFO_THRESHOLD_DATASETS[self.fifo_threshold],
+                "gesture_wait_millis": APDS_9960.GESTURE_WAIT_TIMES_MILLIS[self.gesture_wait_time],
+                "changes": len(self.changes)}
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Gesture classification on blocks of UDLR datasets. The functions work on data
+read from the device as well as on recorded data.
+"""
+from melopero_apds9960.gesture_buffer import GestureBuffer
+from melopero_apds9960.registers import FIELDS, GESTURE_CONFIG_1_REG_ADDRESS
+from melopero_apds9960._compat import _import_numpy, _is_array
+
+# Gestures
+NO_GESTURE = 'no_gesture'
+UP_GESTURE = 'up'
+DOWN_GESTURE = 'down'
+LEFT_GESTURE = 'left'
+RIGHT_GESTURE = 'right'
+NEAR_GESTURE = 'near'
+FAR_GESTURE = 'far'
+TAP_GESTURE = 'tap'
+# Diagonal gestures are named vertical_horizontal, for example 'up_left'.
+
+# Below this amount of datasets the pure Python loop is faster than NumPy.
+NUMPY_MIN_DATASETS = 128
+
+
+# Consecutive "gesture end" datasets needed to exit, for each exit persistence setting (GEXPERS).
+EXIT_PERSISTENCE_DATASETS = [1, 2, 4, 7]
+
+# Detecting method:
+# 1) identify instants where difference between values on same axis is greater than tolerance
+# 2) identify instants where both curves are raising or falling
+# 2.1) the curves must be both raising or both falling at the same instants
+# 3) In those instants which value is greater ?
+# 3.1) if up[i] > down[i]
+#          if dup > 0 and ddown > 0 (curves are raising):
+#              up_count++;
+#          else if dup < 0 and ddown < 0 (curves are falling):
+#              down_count++
+# 4) After having processed all datasets in the fifo see if there is enough "confidence" to tell a gesture has been detected
+#      if up_count > down_count + confidence:
+#          gesture = UP_GESTURE
+#      else if down_count > up_count + confidence:
+#          gesture = DOWN_GESTURE
+#      else
+#          gesture = NO_GESTURE
+
+
+def count_votes(samples, tolerance=12, der_tolerance=6, counts=None, use_numpy=None, profile=None):
+    """Counts how many datasets vote for each direction.\n
+    :samples: the datasets, one of: a bytes-like object (U, D, L, R, U, D, ...),
+        a list of [U, D, L, R] lists, a NumPy array of shape (N, 4) or a GestureBuffer.\n
+    :tolerance = 12: minimum difference between the two values on the same axis.\n
+    :der_tolerance = 6: minimum derivative of at least one of the two values.\n
+    :counts = None: a list [up, down, left, right] where the votes are added,
+        by default a new list is created.\n
+    :use_numpy = None: force (True) or prevent (False) the use of NumPy. By
+        default NumPy is used if installed and the block is large enough.\n
+    :profile = None: a list [first, last, peak, datasets] updated in the same
+        pass with the level (sum of U, D, L and R) of the first, last and
+        highest dataset and the amount of datasets. Start from new_profile().\n
+    Return value: the list [up, down, left, right] of votes.
+    """
+    if counts is None:
+        counts = [0, 0, 0, 0]
+
+    if isinstance(samples, GestureBuffer):
+        chunks = samples.chunks()
+        if len(chunks) == 2:
+            # The dataset before the wrap point is the previous one of the second chunk.
+            _count_block(chunks[0], tolerance, der_tolerance, counts, use_numpy, profile)
+            _count_block(chunks[0][-4:].tobytes() + chunks[1].tobytes(),
+                         tolerance, der_tolerance, counts, use_numpy, profile)
+        elif chunks:
+            _count_block(chunks[0], tolerance, der_tolerance, counts, use_numpy, profile)
+        return counts
+
+    if _is_array(samples):
+        _count_block(samples, tolerance, der_tolerance, counts, use_numpy, profile)
+    elif isinstance(samples, (bytes, bytearray, memoryview)):
+        _count_block(samples, tolerance, der_tolerance, counts, use_numpy, profile)
+    else:
+        _count_block(bytes(value for dataset in samples for value in dataset),
+                     tolerance, der_tolerance, counts, use_numpy, profile)
+    return counts
+
+
+def new_profile():
+    """Returns an empty level profile for count_votes."""
+    return [0, 0, 0, 0]
+
+
+def decide(counts, confidence=6):
+    """Returns the gestures detected on the vertical and horizontal axis
+    ([UP_GESTURE/DOWN_GESTURE/NO_GESTURE, LEFT_GESTURE/RIGHT_GESTURE/NO_GESTURE])
+    given the votes returned by count_votes."""
+    detected_gestures = [NO_GESTURE, NO_GESTURE]
+
+    if counts[1] >= counts[0] + confidence:
+        detected_gestures[0] = DOWN_GESTURE
+    elif counts[0] >= counts[1] + confidence:
+        detected_gestures[0] = UP_GESTURE
+
+    if counts[3] >= counts[2] + confidence:
+        detected_gestures[1] = RIGHT_GESTURE
+    elif counts[2] >= counts[3] + confidence:
+        detected_gestures[1] = LEFT_GESTURE
+
+    return detected_gestures
+
+
+def classify(samples, tolerance=12, der_tolerance=6, confidence=6, use_numpy=None):
+    """Returns the gestures detected in a block of datasets, in the same format
+    as APDS_9960.parse_gesture. See count_votes for the accepted formats."""
+    return decide(count_votes(samples, tolerance, der_tolerance, use_numpy=use_numpy), confidence)
+
+
+class GestureEvent():
+    """A detected gesture.\n
+    gesture: one of the gesture constants (UP_GESTURE, ..., NEAR_GESTURE,
+        FAR_GESTURE, TAP_GESTURE), a diagonal ('up_left', 'down_right', ...)
+        or NO_GESTURE.\n
+    vertical, horizontal: the gestures on the two axes, as returned by parse_gesture.\n
+    confidence: from 0 to 1. For movements it is the vote margin over the
+        votes of the axis (the lowest of the two axes for diagonals), for
+        near, far and tap the level change over the highest level.\n
+    counts: the (up, down, left, right) votes.\n
+    datasets: the amount of datasets.\n
+    start_level, end_level, peak_level: the sum of U, D, L and R at the
+        first, last and highest dataset.\n
+    overflowed: True if the gesture FIFO overflowed while the gesture was
+        read, some datasets are missing.
+    """
+    __slots__ = ("gesture", "vertical", "horizontal", "confidence", "counts",
+                 "datasets", "start_level", "end_level", "peak_level", "overflowed")
+
+    def __init__(self, gesture, vertical, horizontal, confidence, counts, datasets,
+                 start_level, end_level, peak_level, overflowed=False):
+        self.gesture = gesture
+        self.vertical = vertical
+        self.horizontal = horizontal
+        self.confidence = confidence
+        self.counts = counts
+        self.datasets = datasets
+        self.start_level = start_level
+        self.end_level = end_level
+        self.peak_level = peak_level
+        self.overflowed = overflowed
+
+    def to_list(self):
+        """Returns [vertical, horizontal], the format of parse_gesture."""
+        return [self.vertical, self.horizontal]
+
+    def __bool__(self):
+        return self.gesture != NO_GESTURE
+
+    def __repr__(self):
+        return (f"GestureEvent({self.gesture!r}, confidence={self.confidence:.2f}, "
+                f"counts={self.counts}, datasets={self.datasets}"
+                + (", overflowed=True)" if self.overflowed else ")"))
+
+
+def make_event(counts, profile, confidence=6, level_threshold=120, tap_max_datasets=16):
+    """Builds the GestureEvent given the votes and the level profile
+    computed by count_votes. Near, far and tap are reported only when no
+    movement is detected on either axis.\n
+    :confidence = 6: see decide.\n
+    :level_threshold = 120: the minimum change of level (sum of U, D, L and R)
+        for near, far and tap gestures.\n
+    :tap_max_datasets = 16: the longest gesture that can be a tap.
+    """
+    vertical, horizontal = decide(counts, confidence)
+    start_level, end_level, peak_level, datasets = profile
+
+    if vertical != NO_GESTURE or horizontal != NO_GESTURE:
+        margins = []
+        for detected, first in ((vertical, 0), (horizontal, 2)):
+            if detected != NO_GESTURE:
+                votes = counts[first] + counts[first + 1]
+                # With confidence 0 an axis can be decided without votes.
+                margins.append(abs(counts[first] - counts[first + 1]) / votes if votes else 0.0)
+        if vertical == NO_GESTURE:
+            kind = horizontal
+        elif horizontal == NO_GESTURE:
+            kind = vertical
+        else:
+            kind = f"{vertical}_{horizontal}"
+        score = min(margins)
+    else:
+        rise = peak_level - start_level
+        fall = peak_level - end_level
+        kind = NO_GESTURE
+        score = 0.0
+        # The peak is 0 only if level_threshold <= 0 and the FIFO was empty or dark.
+        peak = peak_level if peak_level > 0 else 1
+        if datasets <= tap_max_datasets and rise >= level_threshold and fall >= level_threshold:
+            kind = TAP_GESTURE
+            score = min(rise, fall) / peak
+        elif end_level - start_level >= level_threshold:
+            kind = NEAR_GESTURE
+            score = (end_level - start_level) / peak
+        elif start_level - end_level >= level_threshold:
+            kind = FAR_GESTURE
+            score = (start_level - end_level) / peak
+
+    return GestureEvent(kind, vertical, horizontal, score, tuple(counts), datasets,
+                        start_level, end_level, peak_level)
+
+
+def analyze(samples, tolerance=12, der_tolerance=6, confidence=6, level_threshold=120,
+            tap_max_datasets=16, use_numpy=None):
+    """Returns the GestureEvent detected in a block of datasets. The votes and
+    the levels are computed in the same pass. See count_votes and make_event
+    for the arguments."""
+    profile = new_profile()
+    counts = count_votes(samples, tolerance, der_tolerance, use_numpy=use_numpy, profile=profile)
+    return make_event(counts, profile, confidence, level_threshold, tap_max_datasets)
+
+
+class GestureRecognizer():
+    """Classifies gestures one dataset at a time, with the same votes as
+    count_votes. A gesture is returned (in the same format as
+    APDS_9960.parse_gesture) as soon as one axis has a margin of confidence
+    votes, or when the gesture ends if no axis reached it: the end is
+    detected like the gesture engine does, when all the non masked values
+    are below the exit threshold for exit_persistence datasets in a row.
+    Every gesture is returned once, the recognizer then waits for its end.
+    The state is a fixed amount of numbers, whatever the gesture duration.\n
+    :tolerance = 12, der_tolerance = 6, confidence = 6: see classify.\n
+    :exit_threshold = 0: see APDS_9960.set_gesture_exit_threshold.\n
+    :exit_persistence = 1: the amount of consecutive datasets below the
+        exit threshold that end a gesture.\n
+    :exit_mask = (False, False, False, False): if True the (up, down, left,
+        right) value is not compared with the exit threshold.\n
+    :early = True: if False the gesture is returned only when it ends.
+    """
+
+    def __init__(self, tolerance=12, der_tolerance=6, confidence=6, exit_threshold=0,
+                 exit_persistence=1, exit_mask=(False, False, False, False), early=True):
+        self.tolerance = tolerance
+        self.der_tolerance = der_tolerance
+        self.confidence = confidence
+        self.exit_threshold = exit_threshold
+        self.exit_persistence = exit_persistence
+        self.exit_mask = tuple(exit_mask)
+        self.early = early
+        self.counts = [0, 0, 0, 0]
+        self.reset()
+
+    @classmethod
+    def from_device(cls, device, **kwargs):
+        """Creates a recognizer with the exit threshold, persistence and mask
+        configured in the device. The other arguments are passed to the constructor."""
+        # Persistence and mask share GCONF1: one read decodes both.
+        gconf1 = device.read_register(GESTURE_CONFIG_1_REG_ADDRESS)
+        kwargs.setdefault("exit_threshold", device.read_field("gesture_exit_threshold"))
+        kwargs.setdefault("exit_persistence",
+                          EXIT_PERSISTENCE_DATASETS[FIELDS["gesture_exit_persistence"].decode(gconf1)])
+        kwargs.setdefault("exit_mask", tuple(bool(FIELDS["gesture_exit_mask_" + side].decode(gconf1))
+                                             for side in ("up", "down", "left", "right")))
+        return cls(**kwargs)
+
+    def reset(self):
+        """Forgets the current gesture."""
+        self.counts[:] = (0, 0, 0, 0)
+        self.previous = None
+        self.decided = False
+        self.datasets = 0
+        self._exit_count = 0
+
+    def push(self, sample):
+        """Adds a dataset.\n
+        :sample: the (up, down, left, right) values.\n
+        Return value: the detected gestures or None.
+        """
+        up, down, left, right = sample[0], sample[1], sample[2], sample[3]
+        previous = self.previous
+        self.previous = (up, down, left, right)
+        self.datasets += 1
+        counts = self.counts
+        if previous is not None:
+            self._vote(up, down, up - previous[0], down - previous[1], 0)
+            self._vote(left, right, left - previous[2], right - previous[3], 2)
+
+        threshold = self.exit_threshold
+        mask = self.exit_mask
+        if ((mask[0] or up <= threshold) and (mask[1] or down <= threshold)
+                and (mask[2] or left <= threshold) and (mask[3] or right <= threshold)):
+            self._exit_count += 1
+            if self._exit_count >= self.exit_persistence:
+                return self.end()
+        else:
+            self._exit_count = 0
+
+        if self.early and not self.decided and (abs(counts[0] - counts[1]) >= self.confidence
+                                                or abs(counts[2] - counts[3]) >= self.confidence):
+            detected_gestures = decide(counts, self.confidence)
+            if detected_gestures != [NO_GESTURE, NO_GESTURE]:
+                self.decided = True
+                return detected_gestures
+        return None
+
+    def push_block(self, data):
+        """Adds many datasets (U, D, L, R, U, D, ... bytes, as read from the FIFO).\n
+        Return value: a list with the gestures detected, usually empty.
+        """
+        detected = []
+        for start in range(0, len(data) - 3, 4):
+            gestures = self.push(data[start:start + 4])
+            if gestures is not None:
+                detected.append(gestures)
+        return detected
+
+    def end(self):
+        """Ends the current gesture (for example when the gesture engine
+        exited).\n
+        Return value: the detected gestures if they were not returned yet, otherwise None.
+        """
+        detected_gestures = None
+        if not self.decided:
+            detected_gestures = decide(self.counts, self.confidence)
+            if detected_gestures == [NO_GESTURE, NO_GESTURE]:
+                detected_gestures = None
+        self.reset()
+        return detected_gestures
+
+    def _vote(self, curr_up_left, curr_down_right, der_up_left, der_down_right, up_left_index):
+        # Same rule as _count_python, for a single dataset.
+        if (abs(curr_up_left - curr_down_right) > self.tolerance) and (
+                abs(der_up_left) > self.der_tolerance or abs(der_down_right) > self.der_tolerance):
+            if der_up_left >= 0 and der_down_right >= 0:
+                if curr_up_left > curr_down_right:
+                    self.counts[up_left_index] += 1
+                else:
+                    self.counts[up_left_index + 1] += 1
+            elif der_up_left <= 0 and der_down_right <= 0:
+                if curr_up_left < curr_down_right:
+                    self.counts[up_left_index] += 1
+                else:
+                    self.counts[up_left_index + 1] += 1
+
+
+def _count_block(block, tolerance, der_tolerance, counts, use_numpy, profile=None):
+    is_array = _is_array(block)
+    datasets = block.shape[0] if is_array else len(block) // 4
+    if datasets < 2:
+        if datasets == 1 and profile is not None and profile[3] == 0:
+            level = int(sum(block[0])) if is_array else sum(block[0:4])
+            profile[:] = (level, level, level, 1)
+        return
+
+    if use_numpy is None:
+        use_numpy = (is_array or datasets >= NUMPY_MIN_DATASETS) and _import_numpy() is not None
+    if use_numpy:
+        numpy = _import_numpy()
+        if numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        if not is_array:
+            block = numpy.frombuffer(block, dtype=numpy.uint8, count=datasets * 4).reshape(-1, 4)
+        _count_numpy(block, tolerance, der_tolerance, counts, profile)
+    else:
+        if is_array:
+            block = block.astype(_import_numpy().uint8).tobytes()
+        _count_python(block, datasets, tolerance, der_tolerance, counts, profile)
+
+
+def _count_python(data, datasets, tolerance, der_tolerance, counts, profile=None):
+    # Only scalars are created in the loop, so it does not trigger the garbage collector.
+    if profile is not None:
+        if profile[3] == 0:
+            # The first dataset of a block is the last one of the previous block, unless it is the first block.
+            level = data[0] + data[1] + data[2] + data[3]
+            profile[:] = (level, level, level, 1)
+        peak = profile[2]
+    previous = 0
+    for current in range(4, datasets * 4, 4):
+        if profile is not None:
+            level = data[current] + data[current + 1] + data[current + 2] + data[current + 3]
+            if level > peak:
+                peak = level
+        for up_left_index in (0, 2):
+            down_right_index = up_left_index + 1
+            curr_up_left = data[current + up_left_index]
+            curr_down_right = data[current + down_right_index]
+            der_up_left = curr_up_left - data[previous + up_left_index]
+            der_down_right = curr_down_right - data[previous + down_right_index]
+            if (abs(curr_up_left - curr_down_right) > tolerance) and (
+                    abs(der_up_left) > der_tolerance or abs(der_down_right) > der_tolerance):
+                if der_up_left >= 0 and der_down_right >= 0:
+                    if curr_up_left > curr_down_right:
+                        counts[up_left_index] += 1
+                    else:
+                        counts[down_right_index] += 1
+                elif der_up_left <= 0 and der_down_right <= 0:
+                    if curr_up_left < curr_down_right:
+                        counts[up_left_index] += 1
+                    else:
+                        counts[down_right_index] += 1
+        previous = current
+    if profile is not None and datasets > 1:
+        profile[1] = level
+        profile[2] = peak
+        profile[3] += datasets - 1
+
+
+def _count_numpy(block, tolerance, der_tolerance, counts, profile=None):
+    numpy = _import_numpy()
+    values = block.astype(numpy.int16)
+    if profile is not None:
+        levels = values.sum(axis=1)
+        if profile[3] == 0:
+            profile[:] = (int(levels[0]), int(levels[0]), int(levels[0]), 1)
+        profile[1] = int(levels[-1])
+        profile[2] = max(profile[2], int(levels.max()))
+        profile[3] += len(levels) - 1
+    current = values[1:]
+    derivatives = current - values[:-1]
+    for up_left_index in (0, 2):
+        down_right_index = up_left_index + 1
+        curr_up_left = current[:, up_left_index]
+        curr_down_right = current[:, down_right_index]
+        der_up_left = derivatives[:, up_left_index]
+        der_down_right = derivatives[:, down_right_index]
+
+        valid = (numpy.abs(curr_up_left - curr_down_right) > tolerance) & (
+            (numpy.abs(der_up_left) > der_tolerance) | (numpy.abs(der_down_right) > der_tolerance))
+        raising = (der_up_left >= 0) & (der_down_right >= 0)
+        falling = ~raising & (der_up_left <= 0) & (der_down_right <= 0)
+        up_left_wins = (raising & (curr_up_left > curr_down_right)) | (falling & (curr_up_left < curr_down_right))
+
+        voting = valid & (raising | falling)
+        up_left_votes = int(numpy.count_nonzero(voting & up_left_wins))
+        counts[up_left_index] += up_left_votes
+        counts[down_right_index] += int(numpy.count_nonzero(voting)) - up_left_votes
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+"""
+
+UP = 0
+DOWN = 1
+LEFT = 2
+RIGHT = 3
+
+
+class GestureBuffer():
+    """Ring buffer of gesture datasets (UP, DOWN, LEFT, RIGHT bytes) backed by
+    a preallocated bytearray. Adding and reading datasets does not create
+    lists, so a continuous gesture stream does not put pressure on the
+    garbage collector. When the buffer is full the oldest datasets are
+    overwritten.\n
+    :capacity = 128: the maximum amount of datasets stored.
+    """
+
+    def __init__(self, capacity=128):
+        if capacity < 1:
+            raise ValueError("capacity must be greater than 0")
+        self.capacity = capacity
+        self.data = bytearray(capacity * 4)
+        self._view = memoryview(self.data)
+        self._start = 0
+        self._length = 0
+        self.overwritten = 0
+
+    def __len__(self):
+        return self._length
+
+    def clear(self):
+        self._start = 0
+        self._length = 0
+
+    def position(self, index):
+        """Returns the offset in data of the dataset with the given index
+        (0 is the oldest dataset)."""
+        if not (-self._length <= index < self._length):
+            raise IndexError("dataset index out of range")
+        if index < 0:
+            index += self._length
+        return ((self._start + index) % self.capacity) * 4
+
+    def extend(self, datasets):
+        """Appends datasets to the buffer.\n
+        :datasets: a bytes-like object (or list of ints) whose length is a
+            multiple of 4, for example the value returned by read_gesture_fifo.\n
+        Return value: the amount of datasets added.
+        """
+        if not isinstance(datasets, (bytes, bytearray, memoryview)):
+            datasets = bytes(datasets)
+        source = memoryview(datasets)
+        count = len(source) // 4
+        added = min(count, self.capacity)
+        # Only the newest datasets are kept if they do not fit in the buffer.
+        source = source[(count - added) * 4:count * 4]
+        self.overwritten += count - added
+
+        overflow = self._length + added - self.capacity
+        if overflow > 0:
+            self._start = (self._start + overflow) % self.capacity
+            self._length -= overflow
+            self.overwritten += overflow
+
+        end = ((self._start + self._length) % self.capacity) * 4
+        size = added * 4
+        first = min(size, len(self.data) - end)
+        self._view[end:end + first] = source[:first]
+        if first < size:
+            self._view[0:size - first] = source[first:]
+        self._length += added
+        return count
+
+    def discard(self, amount):
+        """Removes the oldest amount datasets."""
+        amount = min(amount, self._length)
+        self._start = (self._start + amount) % self.capacity
+        self._length -= amount
+
+    def dataset(self, index):
+        """Returns a 4 bytes memoryview of the dataset with the given index
+        (UP, DOWN, LEFT, RIGHT). The view shares the buffer memory."""
+        position = self.position(index)
+        return self._view[position:position + 4]
+
+    def up(self, index):
+        return self.data[self.position(index) + UP]
+
+    def down(self, index):
+        return self.data[self.position(index) + DOWN]
+
+    def left(self, index):
+        return self.data[self.position(index) + LEFT]
+
+    def right(self, index):
+        return self.data[self.position(index) + RIGHT]
+
+    def chunks(self):
+        """Returns the content of the buffer as a list of one or two
+        memoryviews (two if the content wraps around the end of the buffer),
+        oldest datasets first."""
+        if self._length == 0:
+            return []
+        start = self._start * 4
+        end = start + self._length * 4
+        if end <= len(self.data):
+            return [self._view[start:end]]
+        return [self._view[start:], self._view[:end - len(self.data)]]
+
+    def arrays(self):
+        """Same as chunks but every chunk is a NumPy uint8 array of shape
+        (N, 4) sharing the buffer memory. Requires NumPy."""
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("NumPy is not installed")
+        return [numpy.frombuffer(chunk, dtype=numpy.uint8).reshape(-1, 4) for chunk in self.chunks()]
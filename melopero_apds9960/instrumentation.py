@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Opt-in counters and timings of the driver: i2c transactions per register,
+bytes transferred, latency histograms, gesture FIFO overflows and parser
+time. Disabled by default, enable it with APDS_9960.enable_instrumentation.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets, the last one is +Inf.
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.05, 0.1)
+
+
+class Histogram():
+    """Histogram of durations. Every duration is counted only in its bucket,
+    the counts are accumulated when exported to Prometheus.\n
+    :buckets: the upper bounds of the buckets in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        return {"buckets": dict(zip(self.buckets + (float("inf"),), self.counts)),
+                "count": self.count, "sum": self.sum}
+
+
+class Instrumentation():
+    """Collects the statistics of one or more devices.\n
+    :buckets = DEFAULT_BUCKETS: the upper bounds of the latency histograms in seconds.\n
+    :labels = None: a dictionary of labels added to every exported metric,
+        for example {"sensor": "left"}.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, labels=None):
+        self.buckets = tuple(buckets)
+        self.labels = dict(labels) if labels else dict()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (kind, register) -> [transactions, bytes]
+            self.transactions = dict()
+            # kind -> Histogram
+            self.latency = dict()
+            self.fifo_overflows = 0
+            self.parsed_datasets = 0
+            self.parse_time = Histogram(self.buckets)
+            # section name -> Histogram
+            self.sections = dict()
+
+    def record_transaction(self, kind, register_address, length, seconds):
+        """Records an i2c transaction.\n
+        :kind: "read", "write" or "address" (address access).\n
+        :register_address: the first register.\n
+        :length: the amount of data bytes.\n
+        :seconds: the duration.
+        """
+        with self._lock:
+            counters = self.transactions.get((kind, register_address))
+            if counters is None:
+                counters = self.transactions[(kind, register_address)] = [0, 0]
+            counters[0] += 1
+            counters[1] += length
+            histogram = self.latency.get(kind)
+            if histogram is None:
+                histogram = self.latency[kind] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def record_overflow(self):
+        """Records a gesture FIFO overflow. The device calls it once per
+        overflow, when it first sees the GFOV bit set: the instrumentation
+        keeps no state of its own, so it can be shared by many devices."""
+        with self._lock:
+            self.fifo_overflows += 1
+
+    def record_parse(self, datasets, seconds):
+        """Records the classification of datasets."""
+        with self._lock:
+            self.parsed_datasets += datasets
+            self.parse_time.observe(seconds)
+
+    def record_section(self, name, seconds):
+        with self._lock:
+            histogram = self.sections.get(name)
+            if histogram is None:
+                histogram = self.sections[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def measure(self, name):
+        """Times the code in the with block, for example the callbacks of the
+        application: with instrumentation.measure("callback"): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_section(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Returns all the statistics as a dictionary of plain values."""
+        with self._lock:
+            return {
+                "transactions": {f"{kind} {hex(register)}": {"count": count, "bytes": length}
+                                 for (kind, register), (count, length) in sorted(self.transactions.items())},
+                "total_transactions": sum(count for count, _ in self.transactions.values()),
+                "total_bytes": sum(length for _, length in self.transactions.values()),
+                "latency": {kind: histogram.snapshot() for kind, histogram in self.latency.items()},
+                "fifo_overflows": self.fifo_overflows,
+                "parsed_datasets": self.parsed_datasets,
+                "parse_time": self.parse_time.snapshot(),
+                "sections": {name: histogram.snapshot() for name, histogram in self.sections.items()},
+            }
+
+    def to_prometheus(self, prefix="apds9960"):
+        """Returns the statistics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines += _header(f"{prefix}_transactions_total", "counter", "i2c transactions per register.")
+            for (kind, register), (count, _) in sorted(self.transactions.items()):
+                lines.append(f"{prefix}_transactions_total{self._labels(kind=kind, register=hex(register))} {count}")
+            lines += _header(f"{prefix}_bytes_total", "counter", "Data bytes transferred per register.")
+            for (kind, register), (_, length) in sorted(self.transactions.items()):
+                lines.append(f"{prefix}_bytes_total{self._labels(kind=kind, register=hex(register))} {length}")
+
+            lines += _header(f"{prefix}_transaction_seconds", "histogram", "Duration of the i2c transactions.")
+            for kind, histogram in sorted(self.latency.items()):
+                lines += self._histogram(f"{prefix}_transaction_seconds", histogram, kind=kind)
+
+            lines += _header(f"{prefix}_fifo_overflows_total", "counter", "Gesture FIFO overflows (GFOV).")
+            lines.append(f"{prefix}_fifo_overflows_total{self._labels()} {self.fifo_overflows}")
+            lines += _header(f"{prefix}_parsed_datasets_total", "counter", "Gesture datasets classified.")
+            lines.append(f"{prefix}_parsed_datasets_total{self._labels()} {self.parsed_datasets}")
+            lines += _header(f"{prefix}_parse_seconds", "histogram", "Duration of the gesture classification.")
+            lines += self._histogram(f"{prefix}_parse_seconds", self.parse_time)
+
+            if self.sections:
+                lines += _header(f"{prefix}_section_seconds", "histogram", "Duration of the measured sections.")
+                for name, histogram in sorted(self.sections.items()):
+                    lines += self._histogram(f"{prefix}_section_seconds", histogram, section=name)
+        return "\n".join(lines) + "\n"
+
+    def _labels(self, **labels):
+        labels = {**self.labels, **labels}
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+    def _histogram(self, name, histogram, **labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{self._labels(**labels, le=le)} {cumulative}")
+        lines.append(f"{name}_sum{self._labels(**labels)} {histogram.sum}")
+        lines.append(f"{name}_count{self._labels(**labels)} {histogram.count}")
+        return lines
+
+
+def _header(name, metric_type, description):
+    return [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Ways to wait for the INT line of the device without busy-polling. Every
+waiter has a wait(timeout=None) method that blocks until the device signals
+new gesture data (returning True) or the timeout in seconds expires
+(returning False), and a close method.
+"""
+import ctypes
+import fcntl
+import os
+import select
+import time
+
+# Linux GPIO character device ABI (v1), from include/uapi/linux/gpio.h
+_GPIOHANDLE_REQUEST_INPUT = 1 << 0
+_GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+_GPIO_IOC_MAGIC = 0xB4
+
+
+class _GpioEventRequest(ctypes.Structure):
+    _fields_ = [("lineoffset", ctypes.c_uint32),
+                ("handleflags", ctypes.c_uint32),
+                ("eventflags", ctypes.c_uint32),
+                ("consumer_label", ctypes.c_char * 32),
+                ("fd", ctypes.c_int)]
+
+
+class _GpioHandleData(ctypes.Structure):
+    _fields_ = [("values", ctypes.c_uint8 * 64)]
+
+
+class _GpioEventData(ctypes.Structure):
+    _fields_ = [("timestamp", ctypes.c_uint64),
+                ("id", ctypes.c_uint32)]
+
+
+def _iowr(number, structure):
+    return (3 << 30) | (ctypes.sizeof(structure) << 16) | (_GPIO_IOC_MAGIC << 8) | number
+
+
+_GPIO_GET_LINEEVENT_IOCTL = _iowr(0x04, _GpioEventRequest)
+_GPIOHANDLE_GET_LINE_VALUES_IOCTL = _iowr(0x08, _GpioHandleData)
+
+
+class GpioInterrupt():
+    """Waits for the INT line using the Linux GPIO character device. The
+    process sleeps in the kernel until the line goes low, so no CPU is used
+    while waiting. The gesture interrupts must be enabled with
+    enable_gesture_interrupts.\n
+    :line: the offset of the GPIO line connected to INT (e.g. 4 for GPIO4 on a Raspberry Pi).\n
+    :chip = "/dev/gpiochip0": the GPIO chip device.
+    """
+
+    def __init__(self, line, chip="/dev/gpiochip0"):
+        chip_fd = os.open(chip, os.O_RDONLY)
+        try:
+            request = _GpioEventRequest(lineoffset=line,
+                                        handleflags=_GPIOHANDLE_REQUEST_INPUT,
+                                        eventflags=_GPIOEVENT_REQUEST_FALLING_EDGE,
+                                        consumer_label=b"apds9960-int")
+            fcntl.ioctl(chip_fd, _GPIO_GET_LINEEVENT_IOCTL, request)
+        finally:
+            os.close(chip_fd)
+        self._fd = request.fd
+        self._poll = select.poll()
+        self._poll.register(self._fd, select.POLLIN | select.POLLPRI)
+
+    def is_asserted(self):
+        """Returns True if the INT line is low (interrupt pending)."""
+        data = _GpioHandleData()
+        fcntl.ioctl(self._fd, _GPIOHANDLE_GET_LINE_VALUES_IOCTL, data)
+        return data.values[0] == 0
+
+    def wait(self, timeout=None):
+        # The falling edge may have happened before wait was called.
+        if self.is_asserted():
+            self._discard_events()
+            return True
+        events = self._poll.poll(None if timeout is None else timeout * 1000)
+        if not events:
+            return False
+        self._discard_events()
+        return True
+
+    def _discard_events(self):
+        while self._poll.poll(0):
+            os.read(self._fd, ctypes.sizeof(_GpioEventData))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PollingInterrupt():
+    """Fallback for hosts where INT is not connected. Polls the gesture status
+    register, sleeping between two polls for half the time the device needs
+    to fill the FIFO up to its threshold (see APDS_9960.get_fifo_fill_time).\n
+    :device: the APDS_9960 to poll.\n
+    :interval = None: the time in seconds between two polls, by default it is
+        derived from the gesture wait time and the FIFO threshold.
+    """
+
+    # Polling faster than this only loads the bus.
+    MIN_INTERVAL = 0.001
+
+    def __init__(self, device, interval=None):
+        self.device = device
+        if interval is None:
+            interval = device.get_fifo_fill_time() / 2
+        self.interval = max(interval, PollingInterrupt.MIN_INTERVAL)
+
+    def update_interval(self):
+        """Derives the interval again from the current settings of the device,
+        after the gesture wait time or the FIFO threshold changed."""
+        self.interval = max(self.device.get_fifo_fill_time() / 2, PollingInterrupt.MIN_INTERVAL)
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.device.get_gesture_status()
+            if status["Gesture FIFO Data"] or status["Gesture FIFO Overflow"]:
+                return True
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
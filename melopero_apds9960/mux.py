@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Support for many APDS-9960 on the same bus behind TCA9548A-style i2c
+multiplexers (the address of the APDS-9960 can not be changed, so every
+sensor needs its own multiplexer channel).
+"""
+from melopero_apds9960.APDS_9960 import APDS_9960
+from melopero_apds9960.bus import BusBackend, SharedBus, default_pool
+import time
+
+
+class TCA9548A():
+    """An i2c multiplexer with 8 channels selected by writing a bit mask to
+    its control register. The channel is switched only when it changes.\n
+    :bus: the SharedBus (or BusBackend) the multiplexer is connected to.\n
+    :i2c_address = 0x70: the address of the multiplexer.
+    """
+    DEFAULT_I2C_ADDRESS = 0x70
+    CHANNELS = 8
+
+    def __init__(self, bus, i2c_address=DEFAULT_I2C_ADDRESS):
+        self.bus = bus if isinstance(bus, SharedBus) else SharedBus(bus)
+        self.i2c_address = i2c_address
+        self.switches = 0
+
+    def select(self, channel):
+        """Connects the given channel to the bus (and disconnects every other
+        channel, also of the other multiplexers on the same bus)."""
+        if not (0 <= channel < TCA9548A.CHANNELS):
+            raise ValueError(f"channel must be in range [0-{TCA9548A.CHANNELS - 1}]")
+        with self.bus.lock:
+            route = self.bus.route
+            if route == (self, channel):
+                return
+            if route is not None and route[0] is not self:
+                route[0]._write(0)
+            self._write(1 << channel)
+            self.bus.route = (self, channel)
+            self.switches += 1
+
+    def disable(self):
+        """Disconnects all the channels."""
+        with self.bus.lock:
+            self._write(0)
+            if self.bus.route is not None and self.bus.route[0] is self:
+                self.bus.route = None
+
+    def _write(self, mask):
+        self.bus.handle.write_byte(self.i2c_address, mask)
+
+
+class MuxedBus(BusBackend):
+    """BusBackend that selects a multiplexer channel before every
+    transaction. The selection and the transaction happen while holding the
+    lock of the parent bus, so they can not be interleaved with other sensors.\n
+    :mux: the TCA9548A.\n
+    :channel: the channel of the multiplexer.
+    """
+
+    def __init__(self, mux, channel):
+        self.mux = mux
+        self.channel = channel
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        with self.mux.bus.lock:
+            self.mux.select(self.channel)
+            return self.mux.bus.handle.read_i2c_block_data(i2c_addr, register, length)
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        with self.mux.bus.lock:
+            self.mux.select(self.channel)
+            self.mux.bus.handle.write_i2c_block_data(i2c_addr, register, data)
+
+    def write_byte(self, i2c_addr, value):
+        with self.mux.bus.lock:
+            self.mux.select(self.channel)
+            self.mux.bus.handle.write_byte(i2c_addr, value)
+
+
+class SensorArray():
+    """Owns a bus and the APDS-9960s connected to it through multiplexers.
+    The sensors are read in channel order, starting from the channel already
+    selected, so every round needs the minimum amount of channel switches.\n
+    :i2c_bus = 1: the number of the i2c bus.\n
+    :bus = None: a BusBackend (or SharedBus) to use instead of opening i2c_bus.\n
+    :bus_pool = None: the pool used to open i2c_bus, by default the module wide one.
+    """
+
+    def __init__(self, i2c_bus=1, bus=None, bus_pool=None):
+        if bus is not None:
+            self._bus_pool = None
+            self.bus = bus if isinstance(bus, SharedBus) else SharedBus(bus, i2c_bus)
+        else:
+            self._bus_pool = bus_pool if bus_pool is not None else default_pool
+            self.bus = self._bus_pool.acquire(i2c_bus)
+        self.sensors = dict()
+        self._muxes = dict()
+        self._stats = dict()
+        self._samples = 0
+        self._busy_time = 0.0
+        self._first_read = None
+        self._last_read = None
+
+    def add_sensor(self, name, channel, mux_address=TCA9548A.DEFAULT_I2C_ADDRESS, **kwargs):
+        """Creates the APDS_9960 connected to the given multiplexer channel.\n
+        :name: the name used to identify the sensor.\n
+        :channel: the multiplexer channel.\n
+        :mux_address = 0x70: the address of the multiplexer.\n
+        :kwargs: other arguments of APDS_9960 (e.g. register_cache=True).\n
+        Return value: the APDS_9960.
+        """
+        if name in self.sensors:
+            raise ValueError(f"A sensor named {name} already exists")
+        mux = self._muxes.get(mux_address)
+        if mux is None:
+            mux = TCA9548A(self.bus, mux_address)
+            self._muxes[mux_address] = mux
+        for device in self.sensors.values():
+            if device._bus.handle.mux is mux and device._bus.handle.channel == channel:
+                raise ValueError(f"Channel {channel} of multiplexer {hex(mux_address)} is already used")
+
+        device = APDS_9960(bus=MuxedBus(mux, channel), **kwargs)
+        self.sensors[name] = device
+        self._stats[name] = {"reads": 0, "total_latency": 0.0, "last_latency": 0.0, "max_latency": 0.0}
+        return device
+
+    def schedule(self):
+        """Returns the names of the sensors in the order they will be read:
+        grouped by multiplexer and channel, starting from the selected channel."""
+        def route(name):
+            backend = self.sensors[name]._bus.handle
+            return (backend.mux.i2c_address, backend.channel)
+
+        order = sorted(self.sensors, key=route)
+        if self.bus.route is not None:
+            current = (self.bus.route[0].i2c_address, self.bus.route[1])
+            for index, name in enumerate(order):
+                if route(name) >= current:
+                    order = order[index:] + order[:index]
+                    break
+        return order
+
+    def read_all(self, operation=APDS_9960.read_if_valid):
+        """Performs an operation on every sensor, in schedule order.\n
+        :operation = APDS_9960.read_if_valid: a function called with the
+            APDS_9960 as argument (for example APDS_9960.get_proximity_data).\n
+        Return value: a dictionary {name: result of the operation}.
+        """
+        results = dict()
+        for name in self.schedule():
+            start = time.perf_counter()
+            results[name] = operation(self.sensors[name])
+            end = time.perf_counter()
+
+            latency = end - start
+            stats = self._stats[name]
+            stats["reads"] += 1
+            stats["total_latency"] += latency
+            stats["last_latency"] = latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+            self._samples += 1
+            self._busy_time += latency
+            if self._first_read is None:
+                self._first_read = start
+            self._last_read = end
+        return results
+
+    def get_stats(self):
+        """Returns a dictionary with the aggregate samples per second, the
+        amount of channel switches and, for every sensor, the amount of reads
+        and the mean, last and max latency in seconds."""
+        elapsed = 0.0 if self._first_read is None else self._last_read - self._first_read
+        sensors = dict()
+        for name, stats in self._stats.items():
+            reads = stats["reads"]
+            sensors[name] = {"reads": reads,
+                             "mean_latency": stats["total_latency"] / reads if reads else 0.0,
+                             "last_latency": stats["last_latency"],
+                             "max_latency": stats["max_latency"]}
+        return {"samples": self._samples,
+                "samples_per_second": self._samples / elapsed if elapsed > 0 else 0.0,
+                "bus_busy_time": self._busy_time,
+                "channel_switches": sum(mux.switches for mux in self._muxes.values()),
+                "sensors": sensors}
+
+    def close(self):
+        for device in self.sensors.values():
+            device.close()
+        for mux in self._muxes.values():
+            mux.disable()
+        if self._bus_pool is not None:
+            self._bus_pool.release(self.bus)
+        self.bus = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
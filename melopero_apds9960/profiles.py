@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Declarative configuration profiles. A profile is a set of settings (the
+keywords of APDS_9960.configure), compiled to an image of the configuration
+registers and applied by writing only the registers that differ from the
+current state of the chip:
+
+    night = Profile({"enable_als_engine": True, "enable_proximity_engine": True,
+                     "als_gain": "ALS_GAIN_16X"}, name="night")
+    night.apply(device)
+    night.save("night.json")
+    Profile.load("night.json").apply(other_device)
+"""
+from melopero_apds9960.APDS_9960 import APDS_9960
+from melopero_apds9960.bus import BusBackend
+from melopero_apds9960.register_cache import CACHEABLE_REGISTERS, POWER_ON_VALUES
+from melopero_apds9960.registers import Registers
+import json
+import time
+
+_PON = 0x01
+
+# Registers used only by one engine, keyed by its ENABLE bit: while the engine
+# is disabled their value does not matter.
+ENGINE_REGISTERS = {
+    0x02: (0x81, 0x84, 0x85, 0x86, 0x87),  # ALS: ATIME, thresholds
+    0x04: (0x89, 0x8B, 0x8E, 0x9D, 0x9E),  # proximity: thresholds, pulses, offsets
+    0x08: (0x83,),  # wait: WTIME
+    0x40: (0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6, 0xA7, 0xA9, 0xAA),  # gesture
+}
+
+
+class _RegisterImage(BusBackend):
+    """An in-memory bus backend: the registers of a chip that does not exist,
+    used to run the setters without touching the real device."""
+
+    def __init__(self, registers):
+        self.registers = bytearray(256)
+        for address, value in registers.items():
+            self.registers[address] = value
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        return list(self.registers[register:register + length])
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self.registers[register:register + len(data)] = bytes(data)
+
+    def write_byte(self, i2c_addr, value):
+        pass
+
+
+class Profile():
+    """A complete configuration of the device. The registers that are not
+    set by the profile keep their power-on values, so the result of apply
+    does not depend on the previous configuration of the chip.\n
+    :settings = None: a dictionary of settings as accepted by
+        APDS_9960.configure. Values can also be the names of the APDS_9960
+        constants, e.g. "FIFO_INT_AFTER_16_DATASETS".\n
+    :name = None: the name of the profile.\n
+    :power_on = True: the value of the PON bit (False leaves the device in
+        the SLEEP state).\n
+    :registers = None: a dictionary {register_address: value} written over
+        the compiled settings (see from_device).
+    """
+
+    def __init__(self, settings=None, name=None, power_on=True, registers=None):
+        self.settings = dict(settings) if settings else dict()
+        self.name = name
+        self.power_on = power_on
+        self.registers = dict(registers) if registers else dict()
+        for address in self.registers:
+            if address not in CACHEABLE_REGISTERS:
+                raise ValueError(f"{hex(address)} is not a configuration register")
+
+    @classmethod
+    def from_device(cls, device, name=None):
+        """Returns a profile with the current configuration of the device."""
+        registers = device.read_configuration()
+        return cls(name=name, power_on=bool(registers[APDS_9960.ENABLE_REG_ADDRESS] & _PON),
+                   registers=registers)
+
+    def compile(self):
+        """Returns the register image of the profile as a dictionary
+        {register_address: value} of all the configuration registers. The
+        settings are validated by the setters (ValueError if invalid)."""
+        image = _RegisterImage(POWER_ON_VALUES)
+        device = APDS_9960(bus=image)
+        device.configure(**{name: _resolve(value) for name, value in self.settings.items()})
+        if self.power_on:
+            image.registers[APDS_9960.ENABLE_REG_ADDRESS] |= _PON
+        else:
+            image.registers[APDS_9960.ENABLE_REG_ADDRESS] &= ~_PON
+        for address, value in self.registers.items():
+            image.registers[address] = value
+        return {address: image.registers[address] for address in sorted(CACHEABLE_REGISTERS)}
+
+    def diff(self, current, image=None, skip_disabled=True):
+        """Returns the registers {register_address: value} that must be written
+        to go from the current configuration (a dictionary as returned by
+        APDS_9960.read_configuration) to this profile.\n
+        :image = None: the result of compile, compiled again if not given.\n
+        :skip_disabled = True: if True the registers of the engines disabled
+            by the profile are left as they are (see ENGINE_REGISTERS). They
+            are written when a profile enables the engine again.
+        """
+        if image is None:
+            image = self.compile()
+        skipped = set()
+        if skip_disabled:
+            enable = image[APDS_9960.ENABLE_REG_ADDRESS]
+            for bit, registers in ENGINE_REGISTERS.items():
+                if not enable & bit:
+                    skipped.update(registers)
+        return {address: value for address, value in image.items()
+                if current.get(address) != value and address not in skipped}
+
+    def apply(self, device, current=None, max_gap=4, skip_disabled=True):
+        """Configures the device writing only the registers that differ from
+        its current configuration. Contiguous changes are sent with one block
+        write, gaps of up to max_gap unchanged configuration registers are
+        rewritten with their current value to join two runs. ENABLE is written
+        after the other registers when it enables something, so the engines
+        start with the new settings.\n
+        :device: the APDS_9960.\n
+        :current = None: the current configuration, by default it is read with
+            APDS_9960.read_configuration (from the register cache if enabled).\n
+        :max_gap = 4: the longest run of unchanged registers rewritten to save a transaction.\n
+        :skip_disabled = True: see diff.\n
+        Return value: the list of (start_address, [values]) block writes performed.
+        """
+        if current is None:
+            current = device.read_configuration()
+        image = self.compile()
+        writes = plan_writes(self.diff(current, image, skip_disabled), current, max_gap)
+        enable = APDS_9960.ENABLE_REG_ADDRESS
+        old_enable = current.get(enable, 0)
+        new_enable = image[enable]
+        if writes and writes[0][0] == enable and new_enable & ~old_enable:
+            writes.append(writes.pop(0))
+        for start, values in writes:
+            device.write_byte_data(values, start)
+        if new_enable & _PON and not old_enable & _PON:
+            time.sleep(APDS_9960.POWER_UP_DELAY)
+        return writes
+
+    # =========================================================================
+    #     Serialization
+    # =========================================================================
+
+    def to_dict(self):
+        result = {"name": self.name, "power_on": self.power_on, "settings": self.settings}
+        if self.registers:
+            result["registers"] = {hex(address): value for address, value in sorted(self.registers.items())}
+        return result
+
+    @classmethod
+    def from_dict(cls, data):
+        registers = {int(address, 16) if isinstance(address, str) else address: value
+                     for address, value in data.get("registers", dict()).items()}
+        return cls(data.get("settings"), data.get("name"), data.get("power_on", True), registers)
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=4)
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def to_toml(self):
+        lines = []
+        if self.name is not None:
+            lines.append(f"name = {_toml_value(self.name)}")
+        lines.append(f"power_on = {_toml_value(self.power_on)}")
+        lines.append("")
+        lines.append("[settings]")
+        lines += [f"{name} = {_toml_value(value)}" for name, value in self.settings.items()]
+        if self.registers:
+            lines.append("")
+            lines.append("[registers]")
+            lines += [f'"{hex(address)}" = {value}' for address, value in sorted(self.registers.items())]
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def from_toml(cls, text):
+        """Needs Python 3.11 (tomllib) or the tomli package."""
+        try:
+            import tomllib
+        except ImportError:
+            import tomli as tomllib
+        return cls.from_dict(tomllib.loads(text))
+
+    def save(self, path):
+        """Writes the profile to a .json or .toml file."""
+        text = self.to_toml() if path.endswith(".toml") else self.to_json()
+        with open(path, "w") as file:
+            file.write(text)
+
+    @classmethod
+    def load(cls, path):
+        """Reads a profile from a .json or .toml file."""
+        with open(path) as file:
+            text = file.read()
+        return cls.from_toml(text) if path.endswith(".toml") else cls.from_json(text)
+
+    def __repr__(self):
+        return f"Profile({self.name!r}, {self.settings})"
+
+
+def plan_writes(changes, current, max_gap=4):
+    """Groups the changed registers in block writes (see Profile.apply).\n
+    :changes: a dictionary {register_address: value} of the registers to write.\n
+    :current: the current values of the configuration registers.\n
+    :max_gap = 4: the longest run of unchanged registers rewritten to join two runs.\n
+    Return value: a list of (start_address, [values]) tuples.
+    """
+    registers = dict(changes)
+    addresses = sorted(changes)
+    for previous, following in zip(addresses, addresses[1:]):
+        gap = range(previous + 1, following)
+        if len(gap) <= max_gap and all(address in CACHEABLE_REGISTERS and address in current
+                                       for address in gap):
+            for address in gap:
+                registers[address] = current[address]
+    return APDS_9960.group_contiguous(registers)
+
+
+def _resolve(value):
+    """Replaces the names of the register constants (see Registers) with
+    their values. Raises ValueError for strings that are not the name of a constant."""
+    if isinstance(value, str):
+        if not value.startswith("_") and value in vars(Registers):
+            return getattr(Registers, value)
+        raise ValueError(f"Unknown APDS_9960 constant: {value!r}")
+    if isinstance(value, (list, tuple)):
+        return [_resolve(item) for item in value]
+    if isinstance(value, dict):
+        return {name: _resolve(item) for name, item in value.items()}
+    return value
+
+
+def _toml_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return json.dumps(value)
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(_toml_value(item) for item in value) + "]"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{name} = {_toml_value(item)}" for name, item in value.items()) + "}"
+    raise ValueError(f"Cannot write {value!r} to TOML")
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Binary recordings of gesture FIFO datasets, color and proximity samples and
+register configurations, for tuning and testing the gesture parsers offline.
+
+File layout (little endian):
+    header: magic b"APDS9960", version (uint16), start time (float64, seconds since the epoch)
+    records: type (uint8), payload length (uint16), timestamp (float64, seconds since the start), payload
+
+Payloads:
+    DATASETS: the bytes read from the gesture FIFO (U, D, L, R, U, ...)
+    GESTURE_END: empty, the gesture engine exited
+    COLOR: clear, red, green, blue (4 x uint16)
+    PROXIMITY: the proximity value (uint8)
+    CONFIG: the address of the first register (uint8) and the values of the registers from there on
+    MARKER: an utf-8 text, for example the label of the next gesture
+"""
+from melopero_apds9960.APDS_9960 import APDS_9960
+from melopero_apds9960.bus import BusBackend
+from melopero_apds9960.register_cache import BULK_READ_BLOCKS
+from melopero_apds9960.interrupt import PollingInterrupt
+from collections import namedtuple
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"APDS9960"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sHd")
+RECORD_HEADER = struct.Struct("<BHd")
+COLOR_FORMAT = struct.Struct("<4H")
+MAX_PAYLOAD = 0xFFFF
+
+DATASETS = 1
+GESTURE_END = 2
+COLOR = 3
+PROXIMITY = 4
+CONFIG = 5
+MARKER = 6
+
+# payload is a memoryview of the recording: it is valid until the Recording is closed.
+Record = namedtuple("Record", ["type", "timestamp", "payload"])
+# datasets: bytes (U, D, L, R, U, ...), label: the text of the last marker before the gesture (or None).
+RecordedGesture = namedtuple("RecordedGesture", ["timestamp", "duration", "label", "datasets"])
+
+
+class RecordingWriter():
+    """Appends records to a recording file. If the file already exists the
+    new records are added at its end, with timestamps relative to the same start.\n
+    :path: the path of the file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "ab+")
+        self._file.seek(0)
+        header = self._file.read(FILE_HEADER.size)
+        if header:
+            self.start_time = _parse_header(header)
+        else:
+            self.start_time = time.time()
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, self.start_time))
+        self.records = 0
+
+    def write(self, record_type, payload=b"", timestamp=None):
+        """Appends a record.\n
+        :record_type: one of the record types (DATASETS, COLOR, ...).\n
+        :payload = b"": the bytes of the payload.\n
+        :timestamp = None: seconds since the start of the recording, by default now.
+        """
+        if len(payload) > MAX_PAYLOAD:
+            raise ValueError(f"payload must be at most {MAX_PAYLOAD} bytes")
+        if timestamp is None:
+            timestamp = time.time() - self.start_time
+        self._file.write(RECORD_HEADER.pack(record_type, len(payload), timestamp))
+        self._file.write(payload)
+        self.records += 1
+
+    def write_datasets(self, data, timestamp=None):
+        """Records the bytes read from the gesture FIFO."""
+        for start in range(0, len(data), MAX_PAYLOAD - MAX_PAYLOAD % 4):
+            self.write(DATASETS, bytes(data[start:start + MAX_PAYLOAD - MAX_PAYLOAD % 4]), timestamp)
+
+    def write_gesture_end(self, timestamp=None):
+        self.write(GESTURE_END, b"", timestamp)
+
+    def write_color(self, color, timestamp=None):
+        """Records [clear, red, green, blue] as returned by APDS_9960.get_color_data."""
+        self.write(COLOR, COLOR_FORMAT.pack(*color), timestamp)
+
+    def write_proximity(self, proximity, timestamp=None):
+        self.write(PROXIMITY, bytes([proximity]), timestamp)
+
+    def write_config(self, values, start=0x80, timestamp=None):
+        """Records the values of the registers starting at the given address."""
+        self.write(CONFIG, bytes([start]) + bytes(values), timestamp)
+
+    def write_device_config(self, device, timestamp=None):
+        """Reads the configuration registers of the device and records them.
+        The registers between two BULK_READ_BLOCKS (status and data) are not
+        read, they are recorded as 0."""
+        first = BULK_READ_BLOCKS[0][0]
+        values = []
+        for start, amount in BULK_READ_BLOCKS:
+            values.extend([0] * (start - first - len(values)))
+            values.extend(device.read_byte_data(start, amount))
+        self.write_config(values, first, timestamp)
+
+    def write_marker(self, text, timestamp=None):
+        self.write(MARKER, text.encode("utf-8"), timestamp)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def record_gesture(device, writer, label=None, interrupt=None, timeout=None):
+    """Waits for a gesture like APDS_9960.capture_gesture, recording the raw
+    datasets instead of parsing them.\n
+    :device: the APDS_9960.\n
+    :writer: the RecordingWriter.\n
+    :label = None: if given a marker with this text is recorded before the gesture.\n
+    :interrupt = None: see APDS_9960.capture_gesture.\n
+    :timeout = None: see APDS_9960.capture_gesture.\n
+    Return value: the amount of datasets recorded or None if the timeout expired.
+    """
+    if interrupt is None:
+        interrupt = PollingInterrupt(device)
+    if not interrupt.wait(timeout):
+        return None
+    if label is not None:
+        writer.write_marker(label)
+
+    datasets = 0
+    drain_timeout = 2 * device.get_fifo_fill_time()
+    while True:
+        data = device.read_gesture_fifo()
+        if data:
+            writer.write_datasets(data)
+            datasets += len(data) // 4
+        elif not device.is_gesture_engine_running():
+            break
+        interrupt.wait(drain_timeout)
+    writer.write_gesture_end()
+    return datasets
+
+
+def _parse_header(header):
+    if len(header) < FILE_HEADER.size:
+        raise ValueError("Not a recording: the file is too short")
+    magic, version, start_time = FILE_HEADER.unpack(header[:FILE_HEADER.size])
+    if magic != MAGIC:
+        raise ValueError("Not a recording: wrong magic number")
+    if version > VERSION:
+        raise ValueError(f"Unsupported recording version {version}")
+    return start_time
+
+
+class Recording():
+    """Reads a recording through a memory map: records are decoded only when
+    iterated and their payloads are not copied. A record cut short by an
+    interrupted write at the end of the file is ignored.\n
+    :path: the path of the file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            self._file.close()
+            raise ValueError("Not a recording: the file is too short")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self.start_time = _parse_header(self._view[:FILE_HEADER.size])
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, types=None):
+        """Generator of Records.\n
+        :types = None: a collection of record types, by default all the records are returned.
+        """
+        view = self._view
+        size = len(view)
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER.size <= size:
+            record_type, length, timestamp = RECORD_HEADER.unpack_from(view, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > size:
+                return
+            if types is None or record_type in types:
+                yield Record(record_type, timestamp, view[offset:offset + length])
+            offset += length
+
+    def gestures(self):
+        """Generator of RecordedGestures: the datasets recorded up to every
+        GESTURE_END record, labeled with the text of the last marker."""
+        label = None
+        chunks = []
+        start = None
+        for record in self.records((DATASETS, GESTURE_END, MARKER)):
+            if record.type == MARKER:
+                label = str(record.payload, "utf-8")
+            elif record.type == DATASETS:
+                if start is None:
+                    start = record.timestamp
+                chunks.append(record.payload)
+            elif chunks:
+                yield RecordedGesture(start, record.timestamp - start, label, b"".join(chunks))
+                label = None
+                chunks = []
+                start = None
+
+    def colors(self):
+        """Generator of (timestamp, [clear, red, green, blue])."""
+        for record in self.records((COLOR,)):
+            yield record.timestamp, list(COLOR_FORMAT.unpack(record.payload))
+
+    def proximities(self):
+        """Generator of (timestamp, proximity)."""
+        for record in self.records((PROXIMITY,)):
+            yield record.timestamp, record.payload[0]
+
+    def configs(self):
+        """Generator of (timestamp, registers): registers is a dictionary
+        {address: value} of the recorded registers."""
+        for record in self.records((CONFIG,)):
+            start = record.payload[0]
+            yield record.timestamp, {start + index: value for index, value in enumerate(record.payload[1:])}
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Payloads of some records are still referenced: the map is
+            # released when they are garbage collected.
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayBus(BusBackend):
+    """Bus backend that plays a recording back to the driver as fast as it
+    is read, so the unmodified parsers (parse_gesture_in_fifo,
+    capture_gesture, read_if_valid, ...) can be run on recorded data:
+
+        replay = ReplayBus(recording)
+        device = APDS_9960(bus=replay)
+        while not replay.finished:
+            device.capture_gesture(interrupt=replay)
+
+    The registers start with the first recorded configuration. Every
+    recorded gesture is offered as a whole: the FIFO level is the amount of
+    its datasets (at most 255) and the gesture engine runs until they have
+    been read. The next gesture is offered once the engine has been seen
+    stopped (or when next_gesture is called). The bus can also be used as
+    the interrupt of capture_gesture, so that it never sleeps. Every read of
+    the proximity or color data returns the next recorded sample.\n
+    :recording: the Recording.
+    """
+
+    def __init__(self, recording):
+        self.registers = bytearray(256)
+        for _, registers in recording.configs():
+            for address, value in registers.items():
+                self.registers[address] = value
+            break
+        self.gestures = [gesture for gesture in recording.gestures()]
+        self.colors = [color for _, color in recording.colors()]
+        self.proximities = [proximity for _, proximity in recording.proximities()]
+        self.gesture_index = -1
+        self.color_index = 0
+        self.proximity_index = 0
+        self._fifo = memoryview(b"")
+        self.next_gesture()
+
+    @property
+    def finished(self):
+        """True when all the gestures have been read."""
+        return self.gesture_index >= len(self.gestures)
+
+    @property
+    def current_gesture(self):
+        """The RecordedGesture being replayed (None when finished)."""
+        return None if self.finished else self.gestures[self.gesture_index]
+
+    def next_gesture(self):
+        """Discards what is left of the current gesture and offers the next one."""
+        self.gesture_index += 1
+        self._fifo = memoryview(b"")
+        if not self.finished:
+            self._fifo = memoryview(self.gestures[self.gesture_index].datasets)
+
+    def wait(self, timeout=None):
+        """Interrupt interface (see APDS_9960.capture_gesture): returns
+        immediately, True if the FIFO holds datasets."""
+        return len(self._fifo) > 0
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        if register >= APDS_9960.GESTURE_FIFO_UP_REG_ADDRESS:
+            data = list(self._fifo[:length])
+            self._fifo = self._fifo[length:]
+            return data + [0] * (length - len(data))
+        if register == APDS_9960.GESTURE_CONFIG_4_REG_ADDRESS:
+            running = len(self._fifo) > 0
+            if not running and not self.finished:
+                self.next_gesture()
+            return [self.registers[register] & 0xFE | running] + self._registers(register + 1, length - 1)
+        return self._registers(register, length)
+
+    def _registers(self, register, length):
+        data = []
+        for address in range(register, register + length):
+            if address == APDS_9960.STATUS_REG_ADDRESS:
+                valid = (self.color_index < len(self.colors)) | (self.proximity_index < len(self.proximities)) << 1
+                data.append(valid | (0x04 if len(self._fifo) else 0))
+            elif APDS_9960.CLEAR_DATA_LOW_BYTE_REG_ADDRESS <= address <= APDS_9960.BLUE_DATA_HIGH_BYTE_REG_ADDRESS:
+                index = min(self.color_index, len(self.colors) - 1)
+                color = COLOR_FORMAT.pack(*self.colors[index]) if self.colors else bytes(8)
+                data.append(color[address - APDS_9960.CLEAR_DATA_LOW_BYTE_REG_ADDRESS])
+                if address == APDS_9960.BLUE_DATA_HIGH_BYTE_REG_ADDRESS and self.colors:
+                    self.color_index += 1
+            elif address == APDS_9960.PROX_DATA_REG_ADDRESS:
+                index = min(self.proximity_index, len(self.proximities) - 1)
+                data.append(self.proximities[index] if self.proximities else 0)
+                self.proximity_index += 1
+            elif address == APDS_9960.GESTURE_FIFO_LEVEL_REG_ADDRESS:
+                data.append(min(len(self._fifo) // 4, 255))
+            elif address == APDS_9960.GESTURE_STATUS_REG_ADDRESS:
+                data.append(1 if len(self._fifo) else 0)
+            else:
+                data.append(self.registers[address & 0xFF])
+        return data
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        for index, value in enumerate(data):
+            self.registers[(register + index) & 0xFF] = value
+
+    def write_byte(self, i2c_addr, value):
+        pass
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+"""
+
+# Registers that only change when the host writes them. Status, data, FIFO
+# and GCONF4 (GMODE and GFIFO_CLR are changed by the device) are never cached.
+CACHEABLE_REGISTERS = frozenset([
+    0x80, 0x81, 0x83, 0x84, 0x85, 0x86, 0x87, 0x89, 0x8B, 0x8C, 0x8D, 0x8E,
+    0x8F, 0x90, 0x9D, 0x9E, 0x9F, 0xA0, 0xA1, 0xA2, 0xA3, 0xA4, 0xA5, 0xA6,
+    0xA7, 0xA9, 0xAA
+])
+
+# Values of the cacheable registers after power on (the others are 0).
+POWER_ON_VALUES = {0x81: 0xFF, 0x83: 0xFF, 0x8D: 0x40, 0x8E: 0x40, 0x90: 0x01, 0xA6: 0x40}
+
+# Contiguous (start, length) blocks covering all the cacheable registers,
+# each one fits in a single SMBus block read (32 bytes max). They skip
+# STATUS to PDATA (0x93-0x9C): reading the data clears AVALID and PVALID,
+# so a pending measurement would be lost.
+BULK_READ_BLOCKS = [(0x80, 0x13), (0x9D, 14)]
+
+
+class RegisterCache():
+    """Shadow copy of the configuration registers of the device. Writes go
+    through to the device and update the copy, so that flag updates do not
+    need to read the register first.\n
+    :verify_interval = 0: if greater than 0, every verify_interval cached reads
+        the register is read back from the device to detect drift (for example
+        after a brown-out reset). 0 disables verification.
+    """
+
+    def __init__(self, verify_interval=0):
+        self.verify_interval = verify_interval
+        self.values = dict()
+        self.hits = 0
+        self.misses = 0
+        self.drift_events = 0
+        self._reads_since_verify = 0
+
+    def load(self, read_block):
+        """Populates the cache with a bulk read.\n
+        :read_block: callable(start_address, amount) returning a list of ints.
+        """
+        self.values.clear()
+        for start, amount in BULK_READ_BLOCKS:
+            self.update(start, read_block(start, amount))
+
+    def invalidate(self):
+        self.values.clear()
+
+    def update(self, register_address, values):
+        """Stores the values written to (or read from) consecutive registers
+        starting at register_address."""
+        for index, value in enumerate(values):
+            address = register_address + index
+            if address in CACHEABLE_REGISTERS:
+                self.values[address] = value
+
+    def get(self, register_address):
+        """Returns the cached value or None if the register is not cached."""
+        value = self.values.get(register_address)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def needs_verification(self):
+        """Returns True when the next cached read should be checked against
+        the device."""
+        if self.verify_interval <= 0:
+            return False
+        self._reads_since_verify += 1
+        if self._reads_since_verify >= self.verify_interval:
+            self._reads_since_verify = 0
+            return True
+        return False
+
+    def get_stats(self):
+        "Returns a dictionary containing the cache counters."
+        return {"hits": self.hits, "misses": self.misses,
+                "drift_events": self.drift_events, "cached_registers": len(self.values)}
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Register map and constants of the APDS-9960. This module imports nothing,
+so tools that only need the constants (for example to print a configuration)
+do not pay for the driver and the i2c libraries:
+
+    from melopero_apds9960 import registers
+    registers.ENABLE_REG_ADDRESS, registers.ALS_GAIN_16X
+
+The same constants are attributes of APDS_9960 (and of the Registers class).
+FIELDS describes the bit fields of the configuration registers, the field
+accessors of APDS_9960 (e.g. get_als_gain) are generated from it.
+"""
+
+DEFAULT_I2C_ADDRESS = 0x39
+
+# Register addresses
+ENABLE_REG_ADDRESS = 0x80
+CONFIG_1_REG_ADDRESS = 0x8D
+CONFIG_2_REG_ADDRESS = 0x90
+CONFIG_3_REG_ADDRESS = 0x9F
+CONTROL_1_REG_ADDRESS = 0x8F
+INTERRUPT_PERSISTANCE_REG_ADDRESS = 0x8C
+STATUS_REG_ADDRESS = 0x93
+
+# Proximity Registers Addresses
+PROX_INT_LOW_THR_REG_ADDRESS = 0x89
+PROX_INT_HIGH_THR_REG_ADDRESS = 0x8B
+PROX_PULSE_COUNT_REG_ADDRESS = 0x8E
+PROX_UP_RIGHT_OFFSET_REG_ADDRESS = 0x9D
+PROX_DOWN_LEFT_OFFSET_REG_ADDRESS = 0x9E
+PROX_DATA_REG_ADDRESS = 0x9C
+
+# ALS Register Addresses
+ALS_ATIME_REG_ADDRESS = 0x81
+ALS_INT_LOW_THR_LOW_BYTE_REG_ADDRESS = 0x84  # This register provides the low byte of the low interrupt threshold.
+ALS_INT_LOW_THR_HIGH_BYTE_REG_ADDRESS = 0x85  # This register provides the high byte of the low interrupt threshold.
+ALS_INT_HIGH_THR_LOW_BYTE_REG_ADDRESS = 0x86  # This register provides the low byte of the high interrupt threshold.
+ALS_INT_HIGH_THR_HIGH_BYTE_REG_ADDRESS = 0x87  # This register provides the high byte of the high interrupt threshold.
+
+CLEAR_DATA_LOW_BYTE_REG_ADDRESS = 0x94  # Low Byte of clear channel data.
+CLEAR_DATA_HIGH_BYTE_REG_ADDRESS = 0x95  # High Byte of clear channel data.
+RED_DATA_LOW_BYTE_REG_ADDRESS = 0x96  # Low Byte of red channel data.
+RED_DATA_HIGH_BYTE_REG_ADDRESS = 0x97  # High Byte of red channel data.
+GREEN_DATA_LOW_BYTE_REG_ADDRESS = 0x98  # Low Byte of green channel data.
+GREEN_DATA_HIGH_BYTE_REG_ADDRESS = 0x99  # High Byte of green channel data.
+BLUE_DATA_LOW_BYTE_REG_ADDRESS = 0x9A  # Low Byte of blue channel data.
+BLUE_DATA_HIGH_BYTE_REG_ADDRESS = 0x9B  # High Byte of blue channel data.
+
+# Gesture Register Addresses
+GESTURE_PROX_ENTER_THR_REG_ADDRESS = 0xA0
+GESTURE_EXIT_THR_REG_ADDRESS = 0xA1
+GESTURE_CONFIG_1_REG_ADDRESS = 0xA2
+GESTURE_CONFIG_2_REG_ADDRESS = 0xA3
+GESTURE_CONFIG_3_REG_ADDRESS = 0xAA
+GESTURE_CONFIG_4_REG_ADDRESS = 0xAB
+GESTURE_OFFSET_REG_ADDRESSES = [0xA4, 0xA5, 0xA7, 0xA9]
+GESTURE_PULSE_COUNT_AND_LEN_REG_ADDRESS = 0xA6
+GESTURE_FIFO_LEVEL_REG_ADDRESS = 0xAE
+GESTURE_FIFO_UP_REG_ADDRESS = 0xFC
+GESTURE_FIFO_DOWN_REG_ADDRESS = 0xFD
+GESTURE_FIFO_LEFT_REG_ADDRESS = 0xFE
+GESTURE_FIFO_RIGHT_REG_ADDRESS = 0xFF
+GESTURE_STATUS_REG_ADDRESS = 0xAF
+
+# Wait Registers Addresses
+WAIT_TIME_REG_ADDRESS = 0x83
+
+# Clear interrupt regs
+FORCE_INTERRUPT_REG_ADDRESS = 0xE4
+PROXIMITY_INT_CLEAR_REG_ADDRESS = 0xE5
+ALS_INT_CLEAR_REG_ADDRESS = 0xE6
+CLEAR_ALL_NON_GEST_INT_REG_ADDRESS = 0xE7
+
+# Proximity pulse lengths
+PULSE_LEN_4_MICROS = 0
+PULSE_LEN_8_MICROS = 1
+PULSE_LEN_16_MICROS = 2
+PULSE_LEN_32_MICROS = 3
+
+# Led drive levels
+LED_DRIVE_100_mA = 0
+LED_DRIVE_50_mA = 1
+LED_DRIVE_25_mA = 2
+LED_DRIVE_12_5_mA = 3
+
+# Led Boost levels
+LED_BOOST_100 = 0
+LED_BOOST_150 = 1
+LED_BOOST_200 = 2
+LED_BOOST_300 = 3
+
+# Proximity gain
+PROXIMITY_GAIN_1X = 0
+PROXIMITY_GAIN_2X = 1
+PROXIMITY_GAIN_4X = 2
+PROXIMITY_GAIN_8X = 3
+
+# ALS Gain
+ALS_GAIN_1X = 0
+ALS_GAIN_4X = 1
+ALS_GAIN_16X = 2
+ALS_GAIN_64X = 3
+
+# Gesture FIFO interrupt levels
+FIFO_INT_AFTER_1_DATASET = 0
+FIFO_INT_AFTER_4_DATASETS = 1
+FIFO_INT_AFTER_8_DATASETS = 2
+FIFO_INT_AFTER_16_DATASETS = 3
+
+# Gesture exit persistences
+EXIT_AFTER_1_GESTURE_END = 0
+EXIT_AFTER_2_GESTURE_END = 1
+EXIT_AFTER_4_GESTURE_END = 2
+EXIT_AFTER_7_GESTURE_END = 3
+
+# Gesture wait time
+GESTURE_WAIT_0_MILLIS = 0
+GESTURE_WAIT_2_8_MILLIS = 1
+GESTURE_WAIT_5_6_MILLIS = 2
+GESTURE_WAIT_8_4_MILLIS = 3
+GESTURE_WAIT_14_MILLIS = 4
+GESTURE_WAIT_22_4_MILLIS = 5
+GESTURE_WAIT_30_8_MILLIS = 6
+GESTURE_WAIT_39_2_MILLIS = 7
+
+# ALS gain multipliers, indexed by ALS_GAIN_NX
+ALS_GAIN_FACTORS = [1, 4, 16, 64]
+# Gesture wait times in milliseconds, indexed by GESTURE_WAIT_N_MILLIS
+GESTURE_WAIT_TIMES_MILLIS = [0, 2.8, 5.6, 8.4, 14, 22.4, 30.8, 39.2]
+# Datasets needed to reach the FIFO threshold, indexed by FIFO_INT_AFTER_N_DATASET(S)
+FIFO_THRESHOLD_DATASETS = [1, 4, 8, 16]
+# Datasets the gesture FIFO can hold
+GESTURE_FIFO_SIZE = 32
+# Approximate duration of a gesture acquisition cycle (without the wait time)
+GESTURE_CYCLE_MILLIS = 1.0
+
+# Approximate duration of a proximity measurement
+PROXIMITY_CYCLE_MILLIS = 1.0
+# Duration of an ALS integration / wait step
+TIME_STEP_MILLIS = 2.78
+
+# Time needed by the device to power up (seconds)
+POWER_UP_DELAY = 0.01
+
+
+class Field():
+    """A bit field of a register. The shift and the masks are computed once,
+    so that encoding and decoding a value take a single expression.\n
+    :name: the name of the field, also used for the generated APDS_9960
+        accessors (get_<name> and set_<name>).\n
+    :mnemonic: the name of the field in the datasheet.\n
+    :address: the address of the register.\n
+    :shift: the position of the least significant bit of the field.\n
+    :width: the number of bits of the field.\n
+    :minimum = 0: the smallest valid value.\n
+    :maximum = None: the largest valid value, by default the largest value
+        that fits in the field (plus bias).\n
+    :bias = 0: subtracted from the value before it is written (e.g. pulse
+        counts are stored minus one).\n
+    :constants = None: the names of the constants accepted by the field, used
+        in the error message.
+    """
+    __slots__ = ("name", "mnemonic", "address", "shift", "width", "mask", "clear",
+                 "minimum", "maximum", "bias", "error")
+
+    def __init__(self, name, mnemonic, address, shift, width, minimum=0, maximum=None,
+                 bias=0, constants=None):
+        self.name = name
+        self.mnemonic = mnemonic
+        self.address = address
+        self.shift = shift
+        self.width = width
+        self.mask = ((1 << width) - 1) << shift
+        self.clear = ~self.mask & 0xFF
+        self.minimum = minimum
+        self.maximum = (1 << width) - 1 + bias if maximum is None else maximum
+        self.bias = bias
+        if constants is not None:
+            self.error = f"{name} must be one of {constants}."
+        else:
+            self.error = f"{name} must be in range [{minimum}-{self.maximum}]"
+
+    def validate(self, value):
+        """Raises ValueError if the value does not fit in the field."""
+        if not self.minimum <= value <= self.maximum:
+            raise ValueError(self.error)
+
+    def encode(self, register_value, value):
+        """Returns the register value with the field set to value (not validated)."""
+        return (register_value & self.clear) | ((value - self.bias) << self.shift)
+
+    def decode(self, register_value):
+        """Returns the value of the field in the given register value."""
+        return ((register_value & self.mask) >> self.shift) + self.bias
+
+    def __repr__(self):
+        return f"Field({self.name!r}, {self.mnemonic!r}, {hex(self.address)}, {self.shift}, {self.width})"
+
+
+# The fields of the configuration registers, by name. The proximity and
+# gesture offsets are sign-magnitude bytes and the ALS thresholds span two
+# registers: they are written by their setters.
+FIELDS = {field.name: field for field in [
+    # ENABLE
+    Field("power_on", "PON", ENABLE_REG_ADDRESS, 0, 1),
+    Field("als_engine", "AEN", ENABLE_REG_ADDRESS, 1, 1),
+    Field("proximity_engine", "PEN", ENABLE_REG_ADDRESS, 2, 1),
+    Field("wait_engine", "WEN", ENABLE_REG_ADDRESS, 3, 1),
+    Field("als_interrupts", "AIEN", ENABLE_REG_ADDRESS, 4, 1),
+    Field("proximity_interrupts", "PIEN", ENABLE_REG_ADDRESS, 5, 1),
+    Field("gestures_engine", "GEN", ENABLE_REG_ADDRESS, 6, 1),
+    # Timing
+    Field("atime", "ATIME", ALS_ATIME_REG_ADDRESS, 0, 8),
+    Field("wtime", "WTIME", WAIT_TIME_REG_ADDRESS, 0, 8),
+    Field("long_wait", "WLONG", CONFIG_1_REG_ADDRESS, 1, 1),
+    # Proximity
+    Field("proximity_low_threshold", "PILT", PROX_INT_LOW_THR_REG_ADDRESS, 0, 8),
+    Field("proximity_high_threshold", "PIHT", PROX_INT_HIGH_THR_REG_ADDRESS, 0, 8),
+    Field("als_interrupt_persistence", "APERS", INTERRUPT_PERSISTANCE_REG_ADDRESS, 0, 4),
+    Field("proximity_interrupt_persistence", "PPERS", INTERRUPT_PERSISTANCE_REG_ADDRESS, 4, 4),
+    Field("proximity_pulse_count", "PPULSE", PROX_PULSE_COUNT_REG_ADDRESS, 0, 6, minimum=1, bias=1),
+    Field("proximity_pulse_length", "PPLEN", PROX_PULSE_COUNT_REG_ADDRESS, 6, 2,
+          constants="PULSE_LEN_N_MICROS"),
+    # CONTROL
+    Field("als_gain", "AGAIN", CONTROL_1_REG_ADDRESS, 0, 2, constants="ALS_GAIN_NX"),
+    Field("proximity_gain", "PGAIN", CONTROL_1_REG_ADDRESS, 2, 2, constants="PROXIMITY_GAIN_NX"),
+    Field("led_drive", "LDRIVE", CONTROL_1_REG_ADDRESS, 6, 2, constants="LED_DRIVE_N_mA"),
+    # CONFIG2
+    Field("led_boost", "LED_BOOST", CONFIG_2_REG_ADDRESS, 4, 2, constants="LED_BOOST_N"),
+    Field("als_saturation_interrupts", "CPSIEN", CONFIG_2_REG_ADDRESS, 6, 1),
+    Field("proximity_saturation_interrupts", "PSIEN", CONFIG_2_REG_ADDRESS, 7, 1),
+    # CONFIG3
+    Field("proximity_mask_right", "PMASK_R", CONFIG_3_REG_ADDRESS, 0, 1),
+    Field("proximity_mask_left", "PMASK_L", CONFIG_3_REG_ADDRESS, 1, 1),
+    Field("proximity_mask_down", "PMASK_D", CONFIG_3_REG_ADDRESS, 2, 1),
+    Field("proximity_mask_up", "PMASK_U", CONFIG_3_REG_ADDRESS, 3, 1),
+    Field("sleep_after_interrupt", "SAI", CONFIG_3_REG_ADDRESS, 4, 1),
+    Field("proximity_gain_compensation", "PCMP", CONFIG_3_REG_ADDRESS, 5, 1),
+    # Gesture
+    Field("gesture_prox_enter_threshold", "GPENTH", GESTURE_PROX_ENTER_THR_REG_ADDRESS, 0, 8),
+    Field("gesture_exit_threshold", "GEXTH", GESTURE_EXIT_THR_REG_ADDRESS, 0, 8),
+    Field("gesture_exit_persistence", "GEXPERS", GESTURE_CONFIG_1_REG_ADDRESS, 0, 2,
+          constants="EXIT_AFTER_N_GESTURE_END"),
+    Field("gesture_exit_mask_right", "GEXMSK_R", GESTURE_CONFIG_1_REG_ADDRESS, 2, 1),
+    Field("gesture_exit_mask_left", "GEXMSK_L", GESTURE_CONFIG_1_REG_ADDRESS, 3, 1),
+    Field("gesture_exit_mask_down", "GEXMSK_D", GESTURE_CONFIG_1_REG_ADDRESS, 4, 1),
+    Field("gesture_exit_mask_up", "GEXMSK_U", GESTURE_CONFIG_1_REG_ADDRESS, 5, 1),
+    Field("gesture_fifo_threshold", "GFIFOTH", GESTURE_CONFIG_1_REG_ADDRESS, 6, 2,
+          constants="FIFO_INT_AFTER_N_DATASET(S)"),
+    Field("gesture_wait_time", "GWTIME", GESTURE_CONFIG_2_REG_ADDRESS, 0, 3,
+          constants="GESTURE_WAIT_N_MILLIS"),
+    Field("gesture_led_drive", "GLDRIVE", GESTURE_CONFIG_2_REG_ADDRESS, 3, 2, constants="LED_DRIVE_N_mA"),
+    Field("gesture_gain", "GGAIN", GESTURE_CONFIG_2_REG_ADDRESS, 5, 2, constants="PROXIMITY_GAIN_NX"),
+    Field("gesture_pulse_count", "GPULSE", GESTURE_PULSE_COUNT_AND_LEN_REG_ADDRESS, 0, 6, minimum=1, bias=1),
+    Field("gesture_pulse_length", "GPLEN", GESTURE_PULSE_COUNT_AND_LEN_REG_ADDRESS, 6, 2,
+          constants="PULSE_LEN_N_MICROS"),
+    Field("gesture_up_down_active", "GDIMS_UD", GESTURE_CONFIG_3_REG_ADDRESS, 0, 1),
+    Field("gesture_right_left_active", "GDIMS_RL", GESTURE_CONFIG_3_REG_ADDRESS, 1, 1),
+    Field("gesture_mode", "GMODE", GESTURE_CONFIG_4_REG_ADDRESS, 0, 1),
+    Field("gesture_interrupts", "GIEN", GESTURE_CONFIG_4_REG_ADDRESS, 1, 1),
+    Field("gesture_fifo_clear", "GFIFO_CLR", GESTURE_CONFIG_4_REG_ADDRESS, 2, 1),
+]}
+
+
+class Registers():
+    """All the constants of this module as class attributes: the base class
+    of APDS_9960, so that they can be accessed as APDS_9960.ALS_GAIN_16X."""
+
+
+for _name, _value in list(globals().items()):
+    # Not isupper: LED_DRIVE_100_mA and the other LED drive constants.
+    if _name[:1].isupper() and not isinstance(_value, type):
+        setattr(Registers, _name, _value)
+del _name, _value
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+"""
+from collections import namedtuple
+import threading
+import time
+
+# timestamp: time.monotonic() of the read, sequence: progressive number of the
+# sample, status: dictionary as returned by get_status, proximity: as returned
+# by get_proximity_data, color: as returned by get_color_data. proximity and
+# color are None until the device completes the first measurement. saturation,
+# integration_millis and gain: see APDS_9960.Reading, they belong to color.
+Snapshot = namedtuple("Snapshot", ["timestamp", "sequence", "status", "proximity", "color",
+                                   "saturation", "integration_millis", "gain"])
+
+
+class Sampler():
+    """Reads status, proximity and color data in a background thread and
+    publishes them as Snapshots when the device has new data (see
+    APDS_9960.read_if_valid). Any number of readers can get the latest
+    snapshot without accessing the bus and without locks: the snapshot is
+    immutable and it is replaced with a single assignment.\n
+    :device: the APDS_9960 to read.\n
+    :interval = None: the time in seconds between two reads. By default it
+        is the cycle time of the device (see APDS_9960.get_cycle_time), so
+        that every read returns new data.\n
+    A read that fails with an OSError (e.g. a bus error) is counted in errors
+    and stored in last_error, the thread keeps sampling.
+    """
+
+    # Never read faster than this, even if the cycle of the device is shorter.
+    MIN_INTERVAL = 0.003
+
+    def __init__(self, device, interval=None):
+        self.device = device
+        self.interval = interval
+        self.latest = None
+        self.samples = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error = None
+        self._first_timestamp = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.interval is None:
+            self.interval = max(self.device.get_cycle_time(), Sampler.MIN_INTERVAL)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="apds9960-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def get_sample_rate(self):
+        """Returns the achieved amount of samples per second."""
+        latest = self.latest
+        if latest is None or latest.timestamp == self._first_timestamp:
+            return 0.0
+        return (self.samples - 1) / (latest.timestamp - self._first_timestamp)
+
+    def get_stats(self):
+        "Returns a dictionary containing the sampler counters."
+        return {"samples": self.samples, "dropped": self.dropped, "errors": self.errors,
+                "sample_rate": self.get_sample_rate(), "interval": self.interval}
+
+    def _read(self):
+        """Returns a new Snapshot or None if the device has no new data."""
+        reading = self.device.read_if_valid()
+        if reading is None:
+            return None
+        timestamp = time.monotonic()
+        previous = self.latest
+        color = reading.color
+        proximity = reading.proximity
+        saturation = reading.saturation
+        integration_millis = reading.integration_millis
+        gain = reading.gain
+        # Only one of the two may be new: the other keeps its last value.
+        if previous is not None:
+            if color is None:
+                color = previous.color
+                saturation = previous.saturation
+                integration_millis = previous.integration_millis
+                gain = previous.gain
+            proximity = previous.proximity if proximity is None else proximity
+        return Snapshot(timestamp, self.samples, reading.status, proximity, color,
+                        saturation, integration_millis, gain)
+
+    def _run(self):
+        next_time = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                snapshot = self._read()
+            except OSError as error:
+                # A transient bus error must not stop the thread: the next period reads again.
+                self.errors += 1
+                self.last_error = error
+                snapshot = None
+            if snapshot is not None:
+                if self._first_timestamp is None:
+                    self._first_timestamp = snapshot.timestamp
+                self.latest = snapshot
+                self.samples += 1
+
+            next_time += self.interval
+            now = time.monotonic()
+            if now > next_time:
+                # The reads are late: the missed periods are skipped and counted.
+                missed = int((now - next_time) / self.interval) + 1
+                self.dropped += missed
+                next_time += missed * self.interval
+            self._stop_event.wait(next_time - now)
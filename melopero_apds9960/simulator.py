@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@author: Leonardo La Rocca
+
+Register level simulation of the APDS-9960, usable as bus backend:
+
+    sim = SimulatedAPDS9960()
+    device = APDS_9960(bus=sim)
+
+The simulation models the ENABLE register (power and engines), the ALS and
+proximity cycles with their data and STATUS flags, ALS and proximity
+interrupts, the gesture engine with its 32 datasets FIFO (level, threshold,
+overflow) and the INT pin. Light, proximity and gesture data come from
+sources that can be constants, functions of the simulated time or recorded
+waveforms.
+"""
+from melopero_apds9960.bus import BusBackend
+from melopero_apds9960 import register_cache
+import time
+
+DEVICE_ID = 0xAB
+I2C_ADDRESS = 0x39
+
+# Register power-on values (all the others are 0)
+POWER_ON_VALUES = {**register_cache.POWER_ON_VALUES, 0x92: DEVICE_ID}
+
+FIFO_SIZE = 32
+ALS_GAINS = [1, 4, 16, 64]
+PROXIMITY_GAINS = [1, 2, 4, 8]
+GESTURE_WAIT_TIMES_MILLIS = [0, 2.8, 5.6, 8.4, 14, 22.4, 30.8, 39.2]
+FIFO_THRESHOLD_DATASETS = [1, 4, 8, 16]
+EXIT_PERSISTENCES = [1, 2, 4, 7]
+TIME_STEP = 0.00278
+PROXIMITY_CYCLE = 0.001
+GESTURE_CYCLE = 0.001
+# After a long pause (e.g. sleep after interrupt) the missed cycles are not simulated.
+MAX_CATCH_UP = 0.5
+
+
+class Waveform():
+    """A recorded signal played back one value per measurement.\n
+    :values: the sequence of values.\n
+    :loop = False: if True the values are repeated forever, otherwise the
+        last value is held (or default is returned if given).\n
+    :default = None: value returned after the last one when not looping.
+    """
+
+    def __init__(self, values, loop=False, default=None):
+        self.values = list(values)
+        self.loop = loop
+        self.default = default
+        self.index = 0
+
+    def next(self):
+        if self.index >= len(self.values):
+            if self.loop and self.values:
+                self.index = 0
+            elif self.default is not None or not self.values:
+                return self.default
+            else:
+                return self.values[-1]
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+    def finished(self):
+        return not self.loop and self.index >= len(self.values)
+
+
+def _sample(source, now):
+    if isinstance(source, Waveform):
+        return source.next()
+    if callable(source):
+        return source(now)
+    return source
+
+
+class SimulatedAPDS9960(BusBackend):
+    """Simulated APDS-9960 implementing the BusBackend interface.\n
+    :light = (0, 0, 0, 0): the light reaching the sensor as (clear, red, green,
+        blue) counts per integration step (2.78 ms) at gain 1x. Can be a tuple,
+        a function of the simulated time in seconds returning a tuple or a Waveform.\n
+    :proximity = 0: the proximity value at gain 1x (0 - 255), as a number,
+        a function of the time or a Waveform.\n
+    :realtime = False: if False the simulated time advances only with the
+        bus transfers (at bus_clock_hz) and with advance. If True it follows
+        the wall clock, which is needed when the code under test sleeps.\n
+    :bus_clock_hz = 400000: the simulated i2c clock.
+    """
+
+    def __init__(self, light=(0, 0, 0, 0), proximity=0, realtime=False, bus_clock_hz=400000):
+        self.light = light
+        self.proximity = proximity
+        self.realtime = realtime
+        self.bus_clock_hz = bus_clock_hz
+        self.i2c_address = I2C_ADDRESS
+        self.registers = bytearray(256)
+        for address, value in POWER_ON_VALUES.items():
+            self.registers[address] = value
+        self.fifo = []
+        self.gesture_source = None
+        self.transactions = 0
+        self.bytes_transferred = 0
+        self.lost_datasets = 0
+
+        self._time = 0.0
+        self._start = time.monotonic()
+        self._next_cycle = None
+        self._next_dataset = None
+        self._exit_count = 0
+        self._als_persistence_count = 0
+        self._proximity_persistence_count = 0
+
+    # =========================================================================
+    #     Bus backend
+    # =========================================================================
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        self._transfer(length)
+        data = []
+        address = register
+        for _ in range(length):
+            if address >= 0xFC:
+                # FIFO page read: UDLR bytes of the oldest dataset, then the next one.
+                data.append(self._read_fifo_byte(address))
+                address = 0xFC if address == 0xFF else address + 1
+            else:
+                data.append(self._read_register(address))
+                address += 1
+        return data
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        self._transfer(len(data))
+        for index, value in enumerate(data):
+            self._write_register(register + index, value)
+
+    def write_byte(self, i2c_addr, value):
+        self._transfer(0)
+        if value == 0xE4:
+            self._set_status(0x30)
+        elif value == 0xE5:
+            self._clear_status(0x60)
+        elif value == 0xE6:
+            self._clear_status(0x90)
+        elif value == 0xE7:
+            self._clear_status(0xF0)
+
+    # =========================================================================
+    #     Simulation control
+    # =========================================================================
+
+    @property
+    def now(self):
+        """The simulated time in seconds."""
+        return time.monotonic() - self._start if self.realtime else self._time
+
+    def advance(self, seconds):
+        """Advances the simulated time (only when realtime is False)."""
+        if not self.realtime:
+            self._time += seconds
+        self._update()
+
+    def play_gesture(self, datasets):
+        """Plays a gesture: the datasets ([U, D, L, R] lists or a flat
+        sequence of bytes) are produced by the gesture engine one per gesture
+        cycle. The proximity seen by the device while the gesture is played is
+        the maximum value of the current dataset."""
+        if datasets and not isinstance(datasets[0], (list, tuple)):
+            datasets = [list(datasets[i:i + 4]) for i in range(0, len(datasets) - 3, 4)]
+        self.gesture_source = Waveform(datasets, default=[0, 0, 0, 0])
+
+    @property
+    def int_asserted(self):
+        """The state of the (active low) INT pin: True if an interrupt is pending."""
+        self._update()
+        return self._interrupt_pending()
+
+    # =========================================================================
+    #     Internals
+    # =========================================================================
+
+    def _transfer(self, length):
+        self.transactions += 1
+        self.bytes_transferred += length
+        if not self.realtime:
+            # address + register + data, 9 clock cycles per byte
+            self._time += (2 + length) * 9 / self.bus_clock_hz
+        self._update()
+
+    def _read_register(self, address):
+        if address == 0x93:
+            status = self.registers[0x93]
+            if self.registers[0xAB] & 0x02 and self._gesture_valid():
+                status |= 0x04
+            return status
+        if 0x94 <= address <= 0x9B:
+            self._clear_status(0x01)
+        elif address == 0x9C:
+            self._clear_status(0x02)
+        elif address == 0xAE:
+            return len(self.fifo)
+        elif address == 0xAF:
+            return self._gesture_status()
+        return self.registers[address]
+
+    def _write_register(self, address, value):
+        if address in (0x92, 0x93) or 0x94 <= address <= 0x9C or address in (0xAE, 0xAF):
+            return
+        was_enabled = self._powered()
+        self.registers[address] = value & 0xFF
+        if address == 0x80 and not was_enabled and self._powered():
+            self._next_cycle = self.now
+        elif address == 0xAB:
+            if value & 0x04:
+                # GFIFO_CLR clears the FIFO, GVALID and GFOV and reads back as 0.
+                self.fifo = []
+                self.registers[0xAF] = 0
+                self.registers[0xAB] &= ~0x04
+            if value & 0x01 and self._next_dataset is None:
+                self._next_dataset = self.now
+
+    def _read_fifo_byte(self, address):
+        if not self.fifo:
+            return 0
+        value = self.fifo[0][address - 0xFC]
+        if address == 0xFF:
+            self.fifo.pop(0)
+        return value
+
+    def _set_status(self, mask):
+        self.registers[0x93] |= mask
+
+    def _clear_status(self, mask):
+        self.registers[0x93] &= ~mask & 0xFF
+
+    def _powered(self):
+        return bool(self.registers[0x80] & 0x01)
+
+    def _gesture_status(self):
+        status = self.registers[0xAF] & 0x02
+        if self._gesture_valid():
+            status |= 0x01
+        return status
+
+    def _gesture_valid(self):
+        threshold = FIFO_THRESHOLD_DATASETS[self.registers[0xA2] >> 6]
+        gmode = self.registers[0xAB] & 0x01
+        return len(self.fifo) >= threshold or (not gmode and len(self.fifo) > 0)
+
+    def _interrupt_pending(self):
+        enable = self.registers[0x80]
+        status = self.registers[0x93]
+        if enable & 0x10 and status & 0x10:
+            return True
+        if enable & 0x20 and status & 0x20:
+            return True
+        if self.registers[0xAB] & 0x02 and self._gesture_valid():
+            return True
+        return False
+
+    def _sleeping(self):
+        # Sleep after interrupt: the device stops until the interrupt is cleared.
+        return self.registers[0x9F] & 0x10 and self._interrupt_pending()
+
+    def _cycle_time(self):
+        enable = self.registers[0x80]
+        cycle = 0.0
+        if enable & 0x04:
+            cycle += PROXIMITY_CYCLE
+        if enable & 0x02:
+            cycle += (256 - self.registers[0x81]) * TIME_STEP
+        if enable & 0x08:
+            wait = (256 - self.registers[0x83]) * TIME_STEP
+            cycle += wait * 12 if self.registers[0x8D] & 0x02 else wait
+        return max(cycle, PROXIMITY_CYCLE)
+
+    def _update(self):
+        now = self.now
+        while self._powered() and not self._sleeping():
+            gmode = self.registers[0xAB] & 0x01
+            if gmode:
+                if self._next_dataset is None or self._next_dataset < now - MAX_CATCH_UP:
+                    self._next_dataset = now
+                if self._next_dataset > now:
+                    break
+                self._gesture_cycle(self._next_dataset)
+                wait = GESTURE_WAIT_TIMES_MILLIS[self.registers[0xA3] & 0x07] / 1000
+                self._next_dataset += GESTURE_CYCLE + wait
+            else:
+                self._next_dataset = None
+                if self._next_cycle is None or self._next_cycle < now - MAX_CATCH_UP:
+                    self._next_cycle = now
+                if self._next_cycle > now:
+                    break
+                self._engine_cycle(self._next_cycle)
+                self._next_cycle += self._cycle_time()
+
+    def _engine_cycle(self, now):
+        enable = self.registers[0x80]
+        if enable & 0x04:
+            proximity = self._current_proximity(now)
+            self.registers[0x9C] = proximity
+            self._set_status(0x02)
+            self._check_proximity_interrupt(proximity)
+            if enable & 0x40 and proximity >= self.registers[0xA0]:
+                # Gesture engine entry
+                self.registers[0xAB] |= 0x01
+                self._exit_count = 0
+                self._next_dataset = now
+        if enable & 0x02:
+            cycles = 256 - self.registers[0x81]
+            saturation = min(65535, cycles * 1025)
+            gain = ALS_GAINS[self.registers[0x8F] & 0x03]
+            light = _sample(self.light, now)
+            values = [min(saturation, int(channel * gain * cycles)) for channel in light]
+            for index, value in enumerate(values):
+                self.registers[0x94 + 2 * index] = value & 0xFF
+                self.registers[0x95 + 2 * index] = value >> 8
+            self._set_status(0x01)
+            if values[0] >= saturation:
+                self._set_status(0x80)
+            self._check_als_interrupt(values[0])
+
+    def _current_proximity(self, now):
+        if self.gesture_source is not None and not self.gesture_source.finished():
+            dataset = self.gesture_source.values[self.gesture_source.index]
+            proximity = max(dataset)
+        else:
+            proximity = _sample(self.proximity, now)
+        gain = PROXIMITY_GAINS[(self.registers[0x8F] >> 2) & 0x03]
+        return min(255, int(proximity * gain))
+
+    def _gesture_cycle(self, now):
+        if self.gesture_source is not None:
+            dataset = self.gesture_source.next()
+        else:
+            dataset = [0, 0, 0, 0]
+        if len(self.fifo) >= FIFO_SIZE:
+            self.registers[0xAF] |= 0x02
+            self.lost_datasets += 1
+        else:
+            self.fifo.append([min(255, int(value)) for value in dataset])
+
+        # Gesture exit: all the non masked photodiodes below the exit threshold
+        # for the number of cycles set by the exit persistence.
+        mask = (self.registers[0xA2] >> 2) & 0x0F
+        values = [dataset[3], dataset[2], dataset[1], dataset[0]]  # R, L, D, U as in GEXMSK
+        unmasked = [value for bit, value in enumerate(values) if not mask & (1 << bit)]
+        if all(value <= self.registers[0xA1] for value in unmasked):
+            self._exit_count += 1
+        else:
+            self._exit_count = 0
+        if self._exit_count >= EXIT_PERSISTENCES[self.registers[0xA2] & 0x03]:
+            self.registers[0xAB] &= ~0x01
+            self._exit_count = 0
+            # The proximity engine runs again once the gesture cycle is over
+            # (otherwise a proximity above the entry threshold would enter and
+            # exit again at the same simulated time, forever).
+            self._next_cycle = now + GESTURE_CYCLE
+
+    def _check_proximity_interrupt(self, proximity):
+        if proximity < self.registers[0x89] or proximity > self.registers[0x8B]:
+            self._proximity_persistence_count += 1
+        else:
+            self._proximity_persistence_count = 0
+        if self._proximity_persistence_count >= max(self.registers[0x8C] >> 4, 1):
+            self._set_status(0x20)
+
+    def _check_als_interrupt(self, clear):
+        low = self.registers[0x84] | (self.registers[0x85] << 8)
+        high = self.registers[0x86] | (self.registers[0x87] << 8)
+        if clear < low or clear > high:
+            self._als_persistence_count += 1
+        else:
+            self._als_persistence_count = 0
+        persistence = self.registers[0x8C] & 0x0F
+        required = persistence if persistence <= 3 else (persistence - 3) * 5
+        if self._als_persistence_count >= max(required, 1):
+            self._set_status(0x10)
+
+
+class SimulatedMux(BusBackend):
+    """Simulated TCA9548A i2c multiplexer, usable as bus backend of a
+    SensorArray (see melopero_apds9960.mux):
+
+        mux = SimulatedMux({0: SimulatedAPDS9960(), 1: SimulatedAPDS9960()})
+        array = SensorArray(bus=mux)
+
+    Transactions addressed to a device are routed to the devices connected
+    to the enabled channels: if no device answers or more than one device
+    answers (two channels with the same address enabled) an OSError is
+    raised, as a real bus would fail.\n
+    :channels: dictionary {channel: backend}, the backends must have an
+        i2c_address attribute (as SimulatedAPDS9960).\n
+    :i2c_address = 0x70: the address of the multiplexer.\n
+    :upstream = None: backend receiving the transactions for the devices
+        connected directly to the bus, for example another SimulatedMux.
+    """
+
+    def __init__(self, channels, i2c_address=0x70, upstream=None):
+        self.channels = dict(channels)
+        self.i2c_address = i2c_address
+        self.upstream = upstream
+        self.control = 0
+        self.switches = 0
+
+    def read_i2c_block_data(self, i2c_addr, register, length):
+        if i2c_addr == self.i2c_address:
+            return [self.control] * length
+        return self._target(i2c_addr).read_i2c_block_data(i2c_addr, register, length)
+
+    def write_i2c_block_data(self, i2c_addr, register, data):
+        if i2c_addr == self.i2c_address:
+            raise OSError(121, "Remote I/O error")
+        self._target(i2c_addr).write_i2c_block_data(i2c_addr, register, data)
+
+    def write_byte(self, i2c_addr, value):
+        if i2c_addr == self.i2c_address:
+            if value != self.control:
+                self.switches += 1
+            self.control = value
+        else:
+            self._target(i2c_addr).write_byte(i2c_addr, value)
+
+    def responds_to(self, i2c_addr):
+        return i2c_addr == self.i2c_address or bool(self._responders(i2c_addr))
+
+    def _responders(self, i2c_addr):
+        responders = [backend for channel, backend in self.channels.items()
+                      if self.control & (1 << channel) and _responds(backend, i2c_addr)]
+        if self.upstream is not None and _responds(self.upstream, i2c_addr):
+            responders.append(self.upstream)
+        return responders
+
+    def _target(self, i2c_addr):
+        responders = self._responders(i2c_addr)
+        if not responders:
+            raise OSError(121, f"Remote I/O error: no device at {hex(i2c_addr)}")
+        if len(responders) > 1:
+            raise OSError(5, f"I/O error: {len(responders)} devices answered at {hex(i2c_addr)}")
+        return responders[0]
+
+
+def _responds(backend, i2c_addr):
+    if isinstance(backend, SimulatedMux):
+        return backend.responds_to(i2c_addr)
+    return getattr(backend, "i2c_address", None) == i2c_addr
@@ -18,7 +18,14 @@ setuptools.setup(
         "Development Status :: 3 - Alpha",
         "License :: OSI Approved :: MIT License",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
     ],
+    # Module __getattr__ (PEP 562) and asyncio.get_running_loop.
+    python_requires=">=3.7",
     install_requires=["smbus2>=0.4"],
+    extras_require={"numpy": ["numpy"]},
 )